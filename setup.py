@@ -19,10 +19,18 @@ setup(
         'bluepy',
         'uuid'
     ],
+    extras_require={
+        'numpy': ['numpy'],
+    },
     entry_points={
         'console_scripts': [
             'skooscan=skoopy.scanner:scan',
             'skoocontrol=skoopy.controller:control',
+            'skoodaemon=skoopy.daemon:daemon',
+            'skoobench=skoopy.benchmark:bench',
+            'skoomigrate=skoopy.storage:migrate',
+            'skootrace=skoopy.trace:traceInfo',
+            'skoochoreo=skoopy.choreography:choreograph',
         ],
     },
 )
@@ -0,0 +1,141 @@
+"""
+asyncio API for Skoobots
+
+AsyncSkoobotController wraps a SkoobotController and runs the blocking
+transport calls on a bounded thread pool, so the event loop is never
+blocked and many Skoobots can be driven from one loop.
+"""
+
+import asyncio
+import concurrent.futures
+import functools
+import threading
+
+from skoopy.controller import SkoobotController
+
+DEFAULT_MAX_WORKERS = 16
+
+defaultExecutor = None
+defaultExecutorLock = threading.Lock()
+
+def getDefaultExecutor():
+    """
+    Return the thread pool shared by all AsyncSkoobotControllers
+    that were not given their own executor
+    """
+    global defaultExecutor
+    with defaultExecutorLock:
+        if defaultExecutor == None:
+            defaultExecutor = concurrent.futures.ThreadPoolExecutor(
+                max_workers=DEFAULT_MAX_WORKERS, thread_name_prefix="skoopy")
+        return defaultExecutor
+
+class AsyncSkoobotController:
+    """
+    Awaitable control API for Skoobots.
+
+    Blocking calls on the underlying controller are serialized, since a
+    BLE connection handles one operation at a time, but calls on
+    different controllers run concurrently up to the executor's limit.
+
+    Use as an async context manager to hold a connection:
+
+        async with AsyncSkoobotController(name="alice") as skoobot:
+            await skoobot.cmdForward()
+            distance = await skoobot.requestDistance()
+    """
+
+    def __init__(self, name=None, addr=None, controller=None, executor=None):
+        """
+        name and addr select the Skoobot connected to by the context
+        manager. controller defaults to a new SkoobotController and
+        executor to a shared bounded thread pool.
+        """
+        if controller == None:
+            controller = SkoobotController()
+        if executor == None:
+            executor = getDefaultExecutor()
+        self.controller = controller
+        self.executor = executor
+        self.name = name
+        self.addr = addr
+        self.lock = None
+
+    async def __aenter__(self):
+        addr = await self.connect(self.name, self.addr)
+        if addr == None:
+            raise RuntimeError("Unable to connect to skoobot")
+        return self
+
+    async def __aexit__(self, excType, excValue, traceback):
+        await self.disconnect()
+
+    async def call(self, method, *args):
+        """
+        Run a blocking controller method on the executor
+        """
+        if self.lock == None:
+            self.lock = asyncio.Lock()
+        loop = asyncio.get_running_loop()
+        async with self.lock:
+            return await loop.run_in_executor(self.executor, functools.partial(method, *args))
+
+    @property
+    def connectedSkoobot(self):
+        return self.controller.connectedSkoobot
+
+    async def connect(self, name=None, addr=None):
+        return await self.call(self.controller.connect, name, addr)
+
+    async def disconnect(self):
+        await self.call(self.controller.disconnect)
+
+    async def sendCommand(self, data, waitForResponse=False):
+        await self.call(self.controller.sendCommand, data, waitForResponse)
+
+    async def readBytes(self, charName="data"):
+        return await self.call(self.controller.readBytes, charName)
+
+    async def readData(self, charName="data"):
+        return await self.call(self.controller.readData, charName)
+
+    async def cmdRight(self):
+        await self.call(self.controller.cmdRight)
+
+    async def cmdLeft(self):
+        await self.call(self.controller.cmdLeft)
+
+    async def cmdForward(self):
+        await self.call(self.controller.cmdForward)
+
+    async def cmdBackward(self):
+        await self.call(self.controller.cmdBackward)
+
+    async def cmdStop(self):
+        await self.call(self.controller.cmdStop)
+
+    async def cmdSleep(self):
+        await self.call(self.controller.cmdSleep)
+
+    async def cmdRoverMode(self):
+        await self.call(self.controller.cmdRoverMode)
+
+    async def requestDistance(self):
+        return await self.call(self.controller.requestDistance)
+
+    async def requestAmbientLight(self):
+        return await self.call(self.controller.requestAmbientLight)
+
+    def stream(self, channel, rate=10.0, bufferSize=256, notify=True):
+        """
+        Start streaming samples from a sensor channel. The returned
+        SensorStream supports "async for" and takes over the connection
+        until it is closed.
+        """
+        return self.controller.stream(channel, rate, bufferSize, notify)
+
+    async def wait(self, duration):
+        """
+        Non-blocking equivalent of the command parser's wait
+        """
+        await asyncio.sleep(float(duration))
@@ -0,0 +1,342 @@
+#!/usr/env python3
+"""
+Benchmark suite for skoopy
+
+Measures command latency and sensor throughput against the simulated
+transport, CommandParser dispatch rate, SkoobotRegistry scaling and
+skoocontrol cold-start time. Results can be written as JSON and compared
+against a stored baseline to catch regressions.
+"""
+
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+from skoopy import stats
+from skoopy.registry import SkoobotRegistry
+from skoopy.simulator import TransportSimulated, SimulatedSkoobot, CMD_STOP
+
+def summarise(samples, unit="s"):
+    """
+    Summarise a list of timings, where lower is better
+    """
+    result = { "unit" : unit, "better" : "lower" }
+    result.update(stats.summarise(samples))
+    return result
+
+def rate(value, unit="ops/s"):
+    """
+    Wrap a throughput figure, where higher is better
+    """
+    return { "unit" : unit, "better" : "higher", "value" : value }
+
+def timeCalls(func, iterations, warmup=0):
+    """
+    Call func() repeatedly and return the list of call durations
+    """
+    for i in range(warmup):
+        func()
+    samples = []
+    for i in range(iterations):
+        start = time.perf_counter()
+        func()
+        samples.append(time.perf_counter() - start)
+    return samples
+
+def importTimeReport(moduleName, top=10):
+    """
+    Import a module in a fresh interpreter with -X importtime and
+    report its cumulative import time and the slowest imports
+    """
+    command = [sys.executable, "-X", "importtime", "-c", "import " + moduleName]
+    completed = subprocess.run(command, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE)
+    modules = []
+    total = None
+    for line in completed.stderr.decode(errors="replace").splitlines():
+        # Lines are "import time: <self us> | <cumulative us> | <indent><module>"
+        fields = line.split("|")
+        if not line.startswith("import time:") or len(fields) != 3:
+            continue
+        try:
+            selfTime = int(fields[0].split(":")[1]) / 1e6
+            cumulative = int(fields[1]) / 1e6
+        except ValueError:
+            continue
+        name = fields[2].strip()
+        modules.append((name, selfTime, cumulative))
+        if name == moduleName:
+            total = cumulative
+    if completed.returncode != 0 or total == None:
+        return { "error" : "unable to import {0:s}".format(moduleName) }
+    modules.sort(key=lambda module: module[1], reverse=True)
+    return {
+        "unit" : "s",
+        "better" : "lower",
+        "p50" : total,
+        "slowest" : [ { "module" : name, "self" : selfTime, "cumulative" : cumulative }
+            for name, selfTime, cumulative in modules[:top] ],
+    }
+
+class Benchmark:
+    """
+    Benchmark runner. Each bench* method adds entries to self.results.
+    """
+
+    def __init__(self, quick=False, latency=0.002, jitter=0.0005):
+        self.quick = quick
+        self.latency = latency
+        self.jitter = jitter
+        self.results = {}
+        self.tempDir = tempfile.TemporaryDirectory(prefix="skoobench")
+
+    def makeRegistry(self, fileName="registry.json"):
+        return SkoobotRegistry(os.path.join(self.tempDir.name, fileName))
+
+    def makeController(self, latency=None, jitter=None):
+        # Imported here so that the cold start benchmark is not affected
+        # by this module already having loaded the controller
+        from skoopy.controller import SkoobotController
+
+        latency = self.latency if latency == None else latency
+        jitter = self.jitter if jitter == None else jitter
+        skooAddr = "ee:00:00:00:00:01"
+        transport = TransportSimulated([SimulatedSkoobot(skooAddr)],
+            latency={ "write" : latency, "writeNoResponse" : latency / 10, "read" : latency },
+            jitter=jitter, seed=1)
+        controller = SkoobotController(transport, self.makeRegistry())
+        controller.connect(addr=skooAddr)
+        return controller
+
+    def benchController(self):
+        """
+        Round trip latency of the controller calls against a
+        latency-modelled simulated transport
+        """
+        iterations = 50 if self.quick else 500
+        controller = self.makeController()
+        self.results["controller.sendCommand"] = summarise(
+            timeCalls(controller.cmdStop, iterations, warmup=5))
+        self.results["controller.requestDistance"] = summarise(
+            timeCalls(controller.requestDistance, iterations, warmup=5))
+        self.results["controller.requestAmbientLight"] = summarise(
+            timeCalls(controller.requestAmbientLight, iterations, warmup=5))
+        controller.disconnect()
+
+        controller = self.makeController()
+        controller.setFastMode(True)
+        timeCalls(controller.cmdStop, iterations)
+        controller.sync()
+        self.results["controller.fastCommands"] = rate(controller.stats["commandsPerSecond"], "commands/s")
+        controller.disconnect()
+
+        # One iteration of an obstacle avoidance loop, hand-written with
+        # acknowledged commands and with ControlLoop's step, which sends
+        # the next sensor request ahead and motion commands in fast mode
+        from skoopy.controlloop import ControlLoop, RoverPolicy
+
+        controller = self.makeController()
+        def naiveStep():
+            if controller.requestDistance() < 40:
+                controller.cmdLeft()
+            else:
+                controller.cmdForward()
+        self.results["controller.naiveLoopStep"] = summarise(timeCalls(naiveStep, iterations, warmup=5))
+        loop = ControlLoop(controller, RoverPolicy(), maxAge=1.0)
+        controller.setFastMode(True)
+        self.results["controller.controlLoopStep"] = summarise(timeCalls(loop.step, iterations, warmup=5))
+        controller.disconnect()
+        self.benchConnect()
+
+    def benchConnect(self):
+        """
+        Time from connecting to the first command being acknowledged,
+        with and without a warm GATT cache. Full discovery is modelled
+        as costing twenty round trips.
+        """
+        from skoopy.controller import SkoobotController
+        from skoopy.gattcache import GattCache
+
+        iterations = 10 if self.quick else 50
+        skooAddr = "ee:00:00:00:00:01"
+        latency = { "connect" : self.latency * 5, "discover" : self.latency * 20,
+            "write" : self.latency, "read" : self.latency }
+        for cached in (False, True):
+            gattCache = GattCache(os.path.join(self.tempDir.name, "gatt.json")) if cached else None
+            transport = TransportSimulated([SimulatedSkoobot(skooAddr)], latency=latency,
+                jitter=self.jitter, seed=1, gattCache=gattCache)
+            controller = SkoobotController(transport, self.makeRegistry())
+
+            def connectAndCommand():
+                controller.connect(addr=skooAddr)
+                controller.sendCommand(CMD_STOP, True)
+                controller.disconnect()
+
+            name = "controller.connectFirstCommand" + ("Cached" if cached else "")
+            self.results[name] = summarise(timeCalls(connectAndCommand, iterations, warmup=1))
+
+    def benchParser(self):
+        """
+        Dispatch rate of CommandParser.parseCommandList for long scripts,
+        with no transport latency so that parser overhead dominates
+        """
+        from skoopy.controller import CommandParser
+
+        controller = self.makeController(latency=0.0, jitter=0.0)
+        parser = CommandParser(controller)
+        for length in ((1000,) if self.quick else (1000, 10000)):
+            words = ["forward", "left", "right", "stop"] * (length // 4)
+            samples = timeCalls(lambda: parser.parseCommandList(list(words)), 3 if self.quick else 10)
+            best = min(samples)
+            self.results["parser.commands{0:d}".format(length)] = rate(len(words) / best, "commands/s")
+
+        # The same with instrumentation on, to show its overhead
+        from skoopy import metrics
+        words = ["forward", "left", "right", "stop"] * 250
+        metrics.enable()
+        try:
+            samples = timeCalls(lambda: parser.parseCommandList(list(words)), 3 if self.quick else 10)
+        finally:
+            metrics.disable()
+            metrics.registry.reset()
+        self.results["parser.commands1000Instrumented"] = rate(len(words) / min(samples), "commands/s")
+        controller.disconnect()
+
+    def benchRegistry(self):
+        """
+        Cost of registry save, load and lookups at fleet scale
+        """
+        sizes = (10000,) if self.quick else (10000, 100000)
+        lookups = 100
+        for size in sizes:
+            registry = self.makeRegistry("registry{0:d}.json".format(size))
+            addrs = [ "ee:{0:02x}:{1:02x}:{2:02x}:00:00".format(i >> 16, (i >> 8) & 0xff, i & 0xff)
+                for i in range(size) ]
+            start = time.perf_counter()
+            for i, addr in enumerate(addrs):
+                registry.addSkoobot(addr, "skoobot{0:d}".format(i))
+            addTime = time.perf_counter() - start
+
+            prefix = "registry{0:d}".format(size)
+            self.results[prefix + ".add"] = summarise([addTime])
+            self.results[prefix + ".save"] = summarise(timeCalls(registry.save, 3))
+            self.results[prefix + ".load"] = summarise(timeCalls(registry.load, 3))
+            step = max(1, size // lookups)
+            probeAddrs = addrs[::step]
+            probeNames = [ registry.getSkoobotsByAddress(addr)[0][1] for addr in probeAddrs ]
+            self.results[prefix + ".getSkoobotsByAddress"] = summarise(
+                [ t for addr in probeAddrs for t in timeCalls(lambda: registry.getSkoobotsByAddress(addr), 1) ])
+            self.results[prefix + ".getSkoobotsByName"] = summarise(
+                [ t for name in probeNames for t in timeCalls(lambda: registry.getSkoobotsByName(name), 1) ])
+
+    def benchColdStart(self):
+        """
+        Wall time for a fresh interpreter to run skoocontrol --help
+        """
+        runs = 3 if self.quick else 10
+        command = [sys.executable, "-m", "skoopy.controller", "--help"]
+        samples = []
+        for i in range(runs):
+            start = time.perf_counter()
+            completed = subprocess.run(command, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE)
+            samples.append(time.perf_counter() - start)
+            if completed.returncode != 0:
+                self.results["skoocontrol.coldStart"] = {
+                    "error" : completed.stderr.decode(errors="replace").strip().splitlines()[-1]
+                }
+                return
+        self.results["skoocontrol.coldStart"] = summarise(samples)
+        self.results["skoocontrol.importTime"] = importTimeReport("skoopy.controller")
+
+    suites = {
+        "controller" : benchController,
+        "parser" : benchParser,
+        "registry" : benchRegistry,
+        "startup" : benchColdStart,
+    }
+
+    def run(self, suiteNames=None):
+        if suiteNames == None:
+            suiteNames = self.suites.keys()
+        for suiteName in suiteNames:
+            self.suites[suiteName](self)
+        return self.results
+
+def compareResults(results, baseline, tolerance=0.1):
+    """
+    Compare results against a baseline.
+
+    Returns a list of (name, baseline value, current value) for every
+    metric that got worse by more than tolerance (a fraction).
+    """
+    regressions = []
+    for name, result in results.items():
+        base = baseline.get(name)
+        if base == None or "error" in result or "error" in base:
+            continue
+        key = "value" if "value" in result else "p50"
+        if key not in base:
+            continue
+        if result["better"] == "higher":
+            worse = result[key] < base[key] * (1.0 - tolerance)
+        else:
+            worse = result[key] > base[key] * (1.0 + tolerance)
+        if worse:
+            regressions.append((name, base[key], result[key]))
+    return regressions
+
+def formatResult(name, result):
+    if "error" in result:
+        return "{0:40s} error: {1:s}".format(name, result["error"])
+    if "value" in result:
+        return "{0:40s} {1:12.1f} {2:s}".format(name, result["value"], result["unit"])
+    if "count" not in result:
+        return "{0:40s} {1:9.3f}ms".format(name, result["p50"] * 1000)
+    return "{0:40s} p50 {1:9.3f}ms  p90 {2:9.3f}ms  p99 {3:9.3f}ms  (n={4:d})".format(
+        name, result["p50"] * 1000, result["p90"] * 1000, result["p99"] * 1000, result["count"])
+
+def bench():
+    argParser = argparse.ArgumentParser(description="Benchmark skoopy")
+    argParser.add_argument("--suite", "-s", action="append", choices=sorted(Benchmark.suites.keys()),
+        help="Suite to run (may be repeated; default all)")
+    argParser.add_argument("--quick", "-q", action="store_true", help="Use smaller sizes and fewer iterations")
+    argParser.add_argument("--latency", type=float, default=0.002, help="Simulated BLE latency in seconds")
+    argParser.add_argument("--json", "-j", help="Write the results as JSON to this file")
+    argParser.add_argument("--baseline", "-b", help="Compare against results in this JSON file")
+    argParser.add_argument("--startup-budget", type=float,
+        help="Fail if importing skoopy.controller takes longer than this many seconds")
+    argParser.add_argument("--tolerance", "-t", type=float, default=0.1,
+        help="Allowed fractional regression against the baseline")
+    args = argParser.parse_args()
+
+    benchmark = Benchmark(quick=args.quick, latency=args.latency)
+    results = benchmark.run(args.suite)
+    for name in sorted(results):
+        print(formatResult(name, results[name]))
+
+    if args.json != None:
+        with open(args.json, "w") as jsonFile:
+            json.dump(results, jsonFile, sort_keys=True, indent=4)
+
+    importTime = results.get("skoocontrol.importTime", {})
+    if args.startup_budget != None and "p50" in importTime:
+        for module in importTime["slowest"]:
+            print("    {0:40s} {1:9.3f}ms self".format(module["module"], module["self"] * 1000))
+        if importTime["p50"] > args.startup_budget:
+            print("Import time {0:.3f}s exceeds the budget of {1:.3f}s".format(importTime["p50"], args.startup_budget))
+            exit(1)
+
+    if args.baseline != None:
+        with open(args.baseline, "r") as baselineFile:
+            baseline = json.load(baselineFile)
+        regressions = compareResults(results, baseline, args.tolerance)
+        for name, before, after in regressions:
+            print("REGRESSION {0:s}: {1:g} -> {2:g}".format(name, before, after))
+        if len(regressions) > 0:
+            exit(1)
+
+if __name__ == "__main__":
+    bench()
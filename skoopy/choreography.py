@@ -0,0 +1,279 @@
+"""
+Synchronised choreography across many Skoobots
+
+A Choreography runs a command list on each of several Skoobots, with
+every robot's commands issued on one shared monotonic timeline. Before
+the start every robot is connected through a SkoobotFleet, its
+characteristic handles are resolved and its commands are compiled and
+flattened into a timeline of (offset, command) steps, so nothing but
+the BLE write remains to be done at each step.
+
+Each robot then has its own worker thread that sleeps until the shared
+start time plus the step's offset and issues the step. Motion commands
+are sent without waiting for a write response, as in skoocontrol's fast
+mode, so one robot's slow acknowledgement does not hold up its next
+step. After the run, the time at which each robot's write for each step
+completed is compared with the others to give the skew between robots
+per step.
+"""
+
+import argparse
+import collections
+import json
+import threading
+import time
+
+from skoopy import stats
+from skoopy.controller import CommandParser, CommandError
+from skoopy.fleet import SkoobotFleet
+from skoopy.plan import PlanLoop
+from skoopy.scheduler import sleepUntil
+
+# One step of a robot's timeline:
+#   offset - planned issue time in seconds from the start
+#   position - index of the command word in the robot's word list
+TimelineStep = collections.namedtuple("TimelineStep", ["offset", "position", "command", "method", "args"])
+
+# Timing of one step on one robot:
+#   lateness - actual issue time minus planned issue time, in seconds
+#   duration - time taken by the command itself, in seconds
+#   completed - time the write completed minus planned issue time, in seconds
+ChoreographyTiming = collections.namedtuple("ChoreographyTiming",
+    ["addr", "offset", "command", "lateness", "duration", "completed"])
+
+# Commands that run for an unbounded or self-timed period, and so
+# cannot be placed on a timeline
+UNTIMED_COMMANDS = frozenset(("test", "stream", "rover"))
+
+def flattenPlan(plan, parser):
+    """
+    Return the steps of a CommandPlan compiled by parser as a list of
+    TimelineSteps, with waits turned into offsets and repeat blocks
+    unrolled. Raises a ValueError for commands that cannot be timed.
+    Returns (steps, total duration).
+    """
+    timeline = []
+    waitMethod = parser.cmdWait
+
+    def location(step):
+        if step.line != None:
+            return "line {0:d}, word {1:d}".format(step.line, step.position)
+        return "word {0:d}".format(step.position)
+
+    def flatten(steps, offset):
+        for step in steps:
+            if step.method == waitMethod:
+                offset += step.args[0]
+                continue
+            loop = getattr(step.method, "__self__", None)
+            if isinstance(loop, PlanLoop):
+                if loop.count == None:
+                    raise ValueError("A loop without a count cannot be choreographed (at {0:s})".format(location(step)))
+                for i in range(loop.count):
+                    offset = flatten(loop.steps, offset)
+                continue
+            if step.command in UNTIMED_COMMANDS:
+                raise ValueError("{0:s} cannot be choreographed (at {1:s})".format(step.command, location(step)))
+            timeline.append(TimelineStep(offset, step.position, step.command, step.method, step.args))
+        return offset
+
+    duration = flatten(plan.steps, 0.0)
+    return timeline, duration
+
+class Choreography:
+    """
+    Runs a command list per Skoobot, all on one timeline.
+
+        with SkoobotFleet() as fleet:
+            choreography = Choreography(fleet)
+            choreography.prepare({ "Alice" : ["forward", "wait", "1", "stop"],
+                "Bob" : ["backward", "wait", "1", "stop"] })
+            report = choreography.run()
+
+    leadTime is the time in seconds between the end of preparation and
+    the shared start, allowing every worker to be waiting before the
+    first step.
+    """
+
+    def __init__(self, fleet, leadTime=0.1, fast=True):
+        self.fleet = fleet
+        self.leadTime = leadTime
+        self.fast = fast
+        # Dictionary of address to list of TimelineSteps
+        self.timelines = {}
+        self.duration = 0.0
+        self.timings = []
+        self.errors = {}
+        self.lock = threading.Lock()
+
+    def prepare(self, scripts, timeout=None):
+        """
+        Connect to the Skoobots and compile their timelines.
+
+        scripts is a dictionary of Skoobot name or address to either a
+        list of command words or the path of a script file, compiled
+        with CommandParser.compileScript(). Raises CommandError or ValueError if a script is
+        invalid, before anything is sent. Returns the FleetResult of the
+        connections; Skoobots that could not be connected are left out.
+        """
+        wanted = [ nameAddr for nameAddr in scripts.keys() if nameAddr not in self.fleet.controllers ]
+        result = self.fleet.connect(wanted, timeout)
+        for nameAddr in scripts.keys():
+            if nameAddr in self.fleet.controllers:
+                result.values[nameAddr] = nameAddr
+
+        self.timelines = {}
+        self.duration = 0.0
+        for nameAddr, addr in result.values.items():
+            parser = CommandParser(self.fleet.controllers[addr])
+            script = scripts[nameAddr]
+            if isinstance(script, str):
+                plan = parser.compileScript(script)
+            else:
+                plan = parser.compile(script)
+            timeline, duration = flattenPlan(plan, parser)
+            self.timelines[addr] = timeline
+            self.duration = max(self.duration, duration)
+
+        # Resolve the handles now rather than on each robot's first step
+        self.fleet.run(self.resolve, addrs=list(self.timelines.keys()), timeout=timeout)
+        return result
+
+    def resolve(self, controller):
+        if "cmd" not in controller.characteristics:
+            controller.resolveCharacteristics()
+
+    def perform(self, controller, addr, timeline, start):
+        timings = []
+        try:
+            for step in timeline:
+                deadline = start + step.offset
+                sleepUntil(deadline)
+                issued = time.monotonic()
+                if step.args == None:
+                    step.method()
+                else:
+                    step.method(step.args)
+                completed = time.monotonic()
+                timings.append(ChoreographyTiming(addr, step.offset, step.command,
+                    issued - deadline, completed - issued, completed - deadline))
+            controller.sync()
+        except Exception as exc:
+            self.errors[addr] = exc
+        finally:
+            with self.lock:
+                self.timings.extend(timings)
+
+    def run(self):
+        """
+        Run the prepared timelines and return report()
+        """
+        self.timings = []
+        self.errors = {}
+        previous = {}
+        for addr in self.timelines.keys():
+            controller = self.fleet.controllers[addr]
+            previous[addr] = (controller.fastMode, controller.fastWindow)
+            controller.setFastMode(self.fast, controller.fastWindow)
+
+        # Workers take the fleet's per-robot locks, but not its worker
+        # pool: every robot needs a thread of its own at the same moment
+        start = time.monotonic() + self.leadTime
+        threads = []
+        for addr, timeline in self.timelines.items():
+            thread = threading.Thread(target=self.fleet.runLocked,
+                args=(addr, self.perform, (addr, timeline, start)),
+                name="skoopy-choreography", daemon=True)
+            threads.append(thread)
+        try:
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+        finally:
+            for addr, (fastMode, fastWindow) in previous.items():
+                self.fleet.controllers[addr].setFastMode(fastMode, fastWindow)
+        return self.report()
+
+    def report(self):
+        """
+        Return a dictionary describing the last run:
+            steps - a list with one entry per planned offset, giving the
+                commands issued then, the number of robots and the skew
+                (the spread of the times their writes completed) and
+                worst lateness
+            skew, lateness - statistics over all steps, in seconds
+            errors - dictionary of address to error message
+        """
+        byOffset = collections.defaultdict(list)
+        for timing in self.timings:
+            byOffset[round(timing.offset, 6)].append(timing)
+        steps = []
+        for offset in sorted(byOffset.keys()):
+            timings = byOffset[offset]
+            completed = [ timing.completed for timing in timings ]
+            steps.append({
+                "offset" : offset,
+                "commands" : sorted(set(timing.command for timing in timings)),
+                "robots" : len(timings),
+                "skew" : max(completed) - min(completed),
+                "maxLateness" : max(timing.lateness for timing in timings),
+            })
+        return {
+            "steps" : steps,
+            "skew" : stats.summarise([ step["skew"] for step in steps if step["robots"] > 1 ]),
+            "lateness" : stats.summarise([ timing.lateness for timing in self.timings ]),
+            "plannedDuration" : self.duration,
+            "errors" : { addr : str(error) for addr, error in self.errors.items() },
+        }
+
+def parseSpec(spec):
+    """
+    Split a "<name or address>=<script file>" argument
+    """
+    nameAddr, separator, path = spec.rpartition("=")
+    if separator == "" or nameAddr == "" or path == "":
+        raise argparse.ArgumentTypeError("expected <name or address>=<script>, got {0:s}".format(spec))
+    return nameAddr, path
+
+def choreograph():
+    argParser = argparse.ArgumentParser(description="Run command scripts on several Skoobots in step")
+    argParser.add_argument("robots", nargs="+", type=parseSpec, metavar="ROBOT=SCRIPT",
+        help="Skoobot name or address and the script of commands it runs")
+    argParser.add_argument("--lead", "-l", type=float, default=0.1,
+        help="Seconds between preparation and the shared start")
+    argParser.add_argument("--timeout", type=float, help="Time limit in seconds for connecting")
+    argParser.add_argument("--slow", action="store_true", help="Wait for a response to every motion command")
+    argParser.add_argument("--json", "-j", action="store_true", help="Print the report as JSON")
+    args = argParser.parse_args()
+
+    scripts = dict(args.robots)
+    with SkoobotFleet() as fleet:
+        choreography = Choreography(fleet, args.lead, fast=not args.slow)
+        try:
+            result = choreography.prepare(scripts, args.timeout)
+        except (CommandError, ValueError, OSError) as exc:
+            print(exc)
+            exit(2)
+        for nameAddr, error in result.errors.items():
+            print("Unable to connect to {0:s}: {1:s}".format(nameAddr, str(error)))
+        if len(choreography.timelines) == 0:
+            exit(1)
+        report = choreography.run()
+
+    if args.json:
+        print(json.dumps(report, indent=4, sort_keys=True))
+        return
+    for step in report["steps"]:
+        print("{0:8.3f}s  {1:16s} robots {2:3d}  skew {3:6.1f}ms  max lateness {4:6.1f}ms".format(
+            step["offset"], ",".join(step["commands"]), step["robots"],
+            step["skew"] * 1000, step["maxLateness"] * 1000))
+    skew = report["skew"]
+    if skew["count"] > 0:
+        print("Skew over {0:d} steps: p50 {1:.1f}ms, p90 {2:.1f}ms, max {3:.1f}ms".format(
+            skew["count"], skew["p50"] * 1000, skew["p90"] * 1000, skew["max"] * 1000))
+    for addr, error in report["errors"].items():
+        print("{0:s} failed: {1:s}".format(addr, error))
+
+if __name__ == "__main__":
+    choreograph()
@@ -1,9 +1,9 @@
 #!/usr/env python
 
-from skoopy.transport import TransportBluepy
-from skoopy.registry import SkoobotRegistry
-from pathlib import Path
-from bluepy.btle import BTLEException
+from skoopy import metrics
+from skoopy.plan import CommandPlan, CommandError, PlanLoop, PlanStep
+import collections
+import threading
 import time
 import argparse
 
@@ -23,14 +23,37 @@ CMD_GET_DISTANCE = 0x22
 #    cmd_decrease_gain = 0x32
 CMD_ROVER_MODE = 0x40
 
+# Commands that can safely be sent twice: they set a state or request
+# a reading. Turns are relative, so a repeated turn turns twice.
+IDEMPOTENT_COMMANDS = frozenset((CMD_FORWARD, CMD_BACKWARD, CMD_STOP, CMD_GET_AMBIENT, CMD_GET_DISTANCE))
+
+# Record of one connection attempt made by SkoobotController.connect().
+#   outcome is one of "connected", "failed", "discarded" (connected after
+#   another candidate had already won the race), "abandoned" (still
+#   running when the deadline passed) or "absent" (skipped because the
+#   presence tracker has not heard it recently)
+ConnectAttempt = collections.namedtuple("ConnectAttempt", ["addr", "duration", "outcome"])
+
 class SkoobotController:
     """
     Control API for Skoobots
     """
 
-    def __init__(self):
-        self.transport = TransportBluepy()
-        self.registry = SkoobotRegistry()
+    def __init__(self, transport=None, registry=None):
+        """
+        Construct a controller. By default it uses the bluepy transport
+        and the user's registry, but either may be supplied, e.g. to
+        drive a TransportSimulated. The default registry is not loaded
+        until it is first needed.
+        """
+        if transport == None:
+            from skoopy.transport import TransportBluepy
+            transport = TransportBluepy()
+        self.transport = transport
+        # The transport given above while self.transport is one spawned
+        # for a raced connection, otherwise None. See raceConnect().
+        self.ownTransport = None
+        self._registry = registry
 
         # Table of characteristic name to uuid mappings.
         # The characteristic names used are the ones in the firmware.
@@ -43,12 +66,70 @@ class SkoobotController:
         }
         self.connectedSkoobot = None
 
-    def connect(self, name=None, addr=None):
+        # Cache of characteristic name to characteristic object for the
+        # connected Skoobot. Filled on connect() and cleared on disconnect().
+        self.characteristics = {}
+        self.stats = {
+            "cacheHits" : 0,
+            "cacheMisses" : 0,
+            "commandsSent" : 0,
+            "commandsUnacknowledged" : 0,
+            "commandTime" : 0.0,
+            "commandsPerSecond" : 0.0,
+            "linkLosses" : 0,
+            "reconnects" : 0,
+            "reconnectFailures" : 0,
+            "downtime" : 0.0,
+        }
+        self.connectAttempts = []
+        # Optional PresenceTracker. If set and scanning, connect() skips
+        # Skoobots that have not been heard recently.
+        self.presence = None
+
+        # ReconnectPolicy, or None if link loss is not recovered from.
+        # See setAutoReconnect().
+        self.reconnectPolicy = None
+
+        # Held for each BLE operation, so that a SensorStream's thread
+        # and the caller can use the connection at the same time
+        self.lock = threading.RLock()
+
+        # Fast mode settings - see setFastMode()
+        self.fastMode = False
+        self.fastWindow = 8
+        self.unacknowledged = 0
+        # Wall-clock throughput: the time of the first command sent, and
+        # the time and count of commands when the last one was known to
+        # have been processed. See acknowledge().
+        self.firstSendTime = None
+        self.lastAckTime = None
+        self.commandsAcknowledged = 0
+
+    @property
+    def registry(self):
+        """
+        The Skoobot registry, loaded on first use
+        """
+        if self._registry == None:
+            from skoopy.registry import SkoobotRegistry
+            self._registry = SkoobotRegistry()
+        return self._registry
+
+    @registry.setter
+    def registry(self, registry):
+        self._registry = registry
+
+    def connect(self, name=None, addr=None, race=False, deadline=None):
         """
         Connect to the given Skoobot.
         If no Skoobot is given, connects to the default.
         Returns the address of the connected Skoobot if successful;
         None otherwise.
+
+        If race is True and the name matches several addresses, they
+        are all tried concurrently and the first to connect is kept.
+        deadline limits the time in seconds spent racing.
+        The attempts made are recorded in self.connectAttempts.
         """
         addrList = []
 
@@ -74,30 +155,308 @@ class SkoobotController:
         if self.connectedSkoobot != None:
             self.disconnect()
 
-        for botAddr in addrList:
-            try:
-                self.transport.connect(botAddr)
-                self.connectedSkoobot = botAddr
-                break
-            except BTLEException:
-                pass
+        self.connectAttempts = []
+        # A tracker that has stopped or failed hears nothing, so it
+        # is only consulted while it is scanning
+        if self.presence != None and self.presence.isScanning():
+            for botAddr in addrList:
+                if not self.presence.isPresent(botAddr):
+                    self.connectAttempts.append(ConnectAttempt(botAddr, 0.0, "absent"))
+            addrList = [ botAddr for botAddr in addrList if self.presence.isPresent(botAddr) ]
+
+        if race and len(addrList) > 1:
+            self.raceConnect(addrList, deadline)
+        else:
+            for botAddr in addrList:
+                start = time.monotonic()
+                try:
+                    self.transport.connect(botAddr)
+                    self.connectedSkoobot = botAddr
+                    outcome = "connected"
+                except self.transport.linkErrors:
+                    outcome = "failed"
+                self.connectAttempts.append(ConnectAttempt(botAddr, time.monotonic() - start, outcome))
+                if self.connectedSkoobot != None:
+                    break
+
+        if self.connectedSkoobot != None:
+            self.resolveCharacteristics()
 
         return self.connectedSkoobot
 
+    def raceConnect(self, addrList, deadline=None):
+        """
+        Try to connect to all of addrList concurrently, each on its own
+        transport, and keep the first that succeeds. Connections that
+        complete after the winner are torn down.
+
+        The winner's transport is used until disconnect(), which returns
+        the controller to its own transport.
+        """
+        import concurrent.futures
+
+        lock = threading.Lock()
+        start = time.monotonic()
+        winner = []
+        attempts = []
+        # Set once the race is decided; later outcomes are not recorded
+        decided = []
+
+        def record(botAddr, outcome):
+            if len(decided) == 0:
+                attempts.append(ConnectAttempt(botAddr, time.monotonic() - start, outcome))
+
+        def attempt(botAddr):
+            transport = self.transport.spawn()
+            try:
+                transport.connect(botAddr)
+            except transport.linkErrors:
+                with lock:
+                    record(botAddr, "failed")
+                return None
+            with lock:
+                won = len(winner) == 0
+                if won:
+                    winner.append((botAddr, transport))
+                record(botAddr, "connected" if won else "discarded")
+            if not won:
+                transport.disconnect()
+            return botAddr
+
+        executor = concurrent.futures.ThreadPoolExecutor(max_workers=len(addrList))
+        futures = [ executor.submit(attempt, botAddr) for botAddr in addrList ]
+        try:
+            for future in concurrent.futures.as_completed(futures, deadline):
+                if future.result() != None:
+                    break
+        except concurrent.futures.TimeoutError:
+            pass
+        executor.shutdown(wait=False)
+
+        with lock:
+            if len(winner) > 0:
+                self.connectedSkoobot, transport = winner[0]
+                if self.ownTransport == None:
+                    self.ownTransport = self.transport
+                self.transport = transport
+            else:
+                # Don't let a late connection win after we have given up
+                winner.append((None, None))
+            finished = set(attempt.addr for attempt in attempts)
+            for botAddr in addrList:
+                if botAddr not in finished:
+                    record(botAddr, "abandoned")
+            decided.append(True)
+            self.connectAttempts.extend(attempts)
+
     def disconnect(self):
         self.transport.disconnect()
+        if self.ownTransport != None:
+            self.transport = self.ownTransport
+            self.ownTransport = None
         self.connectedSkoobot = None
+        self.characteristics = {}
+        self.unacknowledged = 0
 
-    def sendCommand(self, data, waitForResponse=False):
-        if self.connectedSkoobot == None:
-            raise RuntimeError("BLE not connected")
-        data = int(data);
-        cmdBytes = data.to_bytes(1, byteorder="little") 
-        characteristics = self.transport.getRawCharacteristicsByUUID(self.uuids["cmd"])
+    def resolveCharacteristics(self):
+        """
+        Discover all characteristics of the connected Skoobot once
+        and cache the ones named in self.uuids.
+        """
+        self.characteristics = {}
+        names = { uuid : name for name, uuid in self.uuids.items() }
+        for charac in self.transport.getRawCharacteristics():
+            name = names.get(str(charac.uuid).lower())
+            if name != None and name not in self.characteristics:
+                self.characteristics[name] = charac
+        self.stats["cacheMisses"] += 1
+
+    def getCharacteristic(self, charName):
+        """
+        Return the characteristic object for the named characteristic,
+        using the per-connection cache where possible.
+
+        Raises a RuntimeError if the firmware does not support it.
+        """
+        charac = self.characteristics.get(charName)
+        if charac != None:
+            self.stats["cacheHits"] += 1
+            return charac
+        self.stats["cacheMisses"] += 1
+        characteristics = self.transport.getRawCharacteristicsByUUID(self.uuids[charName])
         if len(characteristics) == 0:
-            raise RuntimeError("cmd characteristic not supported by firmware")
-        cmd = characteristics[0]
-        cmd.write(cmdBytes, waitForResponse)
+            raise RuntimeError("{0:s} characteristic not supported by firmware".format(charName))
+        charac = characteristics[0]
+        self.characteristics[charName] = charac
+        return charac
+
+    def rediscover(self, charName, error):
+        """
+        Called when an operation on the named characteristic has failed
+        with error but the link is up. If its handle came from the transport's GATT
+        cache, the cached layout may be out of date: it is dropped, the
+        characteristics are discovered again and the new characteristic
+        is returned. Otherwise error is raised.
+        """
+        if not self.transport.layoutCached:
+            raise error
+        self.transport.forgetLayout()
+        self.resolveCharacteristics()
+        return self.getCharacteristic(charName)
+
+    def recover(self, charName, error, retries, idempotent=True):
+        """
+        Called when an operation on the named characteristic has failed
+        with error after retries retries. Returns the characteristic to
+        retry with, None if the operation should be skipped, or raises.
+        """
+        if metrics.enabled:
+            metrics.increment("skoopy_link_errors_total")
+        if self.transport.isConnected():
+            if retries == 0:
+                return self.rediscover(charName, error)
+            raise error
+        policy = self.reconnectPolicy
+        if policy == None or retries >= policy.maxRetries:
+            raise error
+        self.reconnect()
+        if not idempotent:
+            from skoopy.reconnect import MOTION_SKIP, MOTION_RAISE
+            if policy.motionPolicy == MOTION_SKIP:
+                return None
+            if policy.motionPolicy == MOTION_RAISE:
+                raise error
+        return self.getCharacteristic(charName)
+
+    def setAutoReconnect(self, enable=True, policy=None):
+        """
+        When enabled, a lost link is reconnected according to policy, a
+        ReconnectPolicy, and reads and idempotent commands are retried.
+        """
+        if enable and policy == None:
+            from skoopy.reconnect import ReconnectPolicy
+            policy = ReconnectPolicy()
+        self.reconnectPolicy = policy if enable else None
+
+    def reconnect(self):
+        """
+        Reconnect to the current Skoobot after the link was lost,
+        backing off between attempts. Raises the last link error if
+        every attempt fails, leaving the controller disconnected.
+        """
+        addr = self.connectedSkoobot
+        stats = self.stats
+        stats["linkLosses"] += 1
+        self.characteristics = {}
+        # Commands sent without response may have been lost with the link
+        self.unacknowledged = 0
+        start = time.monotonic()
+        error = None
+        for delay in self.reconnectPolicy.delays():
+            time.sleep(delay)
+            try:
+                self.transport.connect(addr)
+                self.resolveCharacteristics()
+                error = None
+                break
+            except self.transport.linkErrors as exc:
+                error = exc
+        stats["downtime"] += time.monotonic() - start
+        if metrics.enabled:
+            metrics.observe("skoopy_reconnect_seconds", time.monotonic() - start,
+                outcome="failed" if error != None else "connected")
+        if error != None:
+            stats["reconnectFailures"] += 1
+            self.disconnect()
+            raise error
+        stats["reconnects"] += 1
+
+    def sendCommand(self, data, waitForResponse=False):
+        with self.lock:
+            timed = metrics.enabled
+            if timed:
+                entered = time.perf_counter()
+            if self.connectedSkoobot == None:
+                raise RuntimeError("BLE not connected")
+            data = int(data);
+            cmdBytes = data.to_bytes(1, byteorder="little") 
+            cmd = self.getCharacteristic("cmd")
+            response = "true" if waitForResponse else "false"
+            start = time.monotonic()
+            retries = 0
+            while cmd != None:
+                try:
+                    # Only the write itself, not the recovery between attempts
+                    attempt = time.perf_counter()
+                    cmd.write(cmdBytes, waitForResponse)
+                    if timed:
+                        metrics.observe("skoopy_transport_write_seconds", time.perf_counter() - attempt,
+                            response=response)
+                    break
+                except self.transport.linkErrors as exc:
+                    if timed:
+                        metrics.increment("skoopy_controller_recoveries_total", operation="write")
+                    cmd = self.recover("cmd", exc, retries, data in IDEMPOTENT_COMMANDS)
+                    retries += 1
+            end = time.monotonic()
+            elapsed = end - start
+            if timed:
+                metrics.observe("skoopy_controller_send_command_seconds", time.perf_counter() - entered,
+                    response=response)
+            stats = self.stats
+            stats["commandTime"] += elapsed
+            stats["commandsSent"] += 1
+            if self.firstSendTime == None:
+                self.firstSendTime = start
+            if waitForResponse:
+                # A write response means every earlier write has been processed
+                self.acknowledge(end)
+            else:
+                self.unacknowledged += 1
+                stats["commandsUnacknowledged"] += 1
+
+    def acknowledge(self, now):
+        """
+        Record that every command sent so far has been processed, and
+        update commandsPerSecond: the commands processed per second of
+        wall-clock time since the first was sent
+        """
+        self.unacknowledged = 0
+        self.lastAckTime = now
+        self.commandsAcknowledged = self.stats["commandsSent"]
+        elapsed = now - self.firstSendTime
+        self.stats["commandsPerSecond"] = self.commandsAcknowledged / elapsed if elapsed > 0.0 else 0.0
+
+    def setFastMode(self, enable=True, window=8):
+        """
+        In fast mode, motion commands are sent with write-without-response.
+        At most window commands are sent in a row without an acknowledgement;
+        the next one waits for a write response, so the Skoobot's buffers
+        cannot overflow.
+        """
+        if window < 1:
+            raise ValueError("window must be at least 1")
+        self.fastMode = enable
+        self.fastWindow = window
+
+    def sync(self):
+        """
+        Wait until every command sent without response has reached the
+        Skoobot. The read response is only sent after earlier writes
+        have been processed.
+        """
+        with self.lock:
+            if self.unacknowledged > 0:
+                self.readBytes("cmd")
+                self.acknowledge(time.monotonic())
+
+    def sendMotion(self, data):
+        """
+        Send a motion command, acknowledged unless in fast mode
+        """
+        with self.lock:
+            waitForResponse = not self.fastMode or self.unacknowledged >= self.fastWindow
+            self.sendCommand(data, waitForResponse)
 
     def readBytes(self, charName="data"):
         """
@@ -105,14 +464,47 @@ class SkoobotController:
 
         returns a bytearray of the data
         """
-        if self.connectedSkoobot == None:
-            raise RuntimeError("BLE not connected")
-        characteristics = self.transport.getRawCharacteristicsByUUID(self.uuids[charName])
-        if len(characteristics) == 0:
-            raise RuntimeError("{0:s} characteristic not supported by firmware".format(charName))
-        charac = characteristics[0]
-        dataBytes = charac.read()
-        return dataBytes
+        with self.lock:
+            timed = metrics.enabled
+            if timed:
+                entered = time.perf_counter()
+            if self.connectedSkoobot == None:
+                raise RuntimeError("BLE not connected")
+            charac = self.getCharacteristic(charName)
+            retries = 0
+            while True:
+                try:
+                    attempt = time.perf_counter()
+                    dataBytes = charac.read()
+                    if timed:
+                        metrics.observe("skoopy_transport_read_seconds", time.perf_counter() - attempt)
+                    break
+                except self.transport.linkErrors as exc:
+                    if timed:
+                        metrics.increment("skoopy_controller_recoveries_total", operation="read")
+                    charac = self.recover(charName, exc, retries)
+                    retries += 1
+            if timed:
+                metrics.observe("skoopy_controller_read_bytes_seconds", time.perf_counter() - entered)
+            return dataBytes
+
+    def supportsNotify(self, charName):
+        """
+        Return True if the firmware supports notifications on the
+        named characteristic
+        """
+        charac = self.getCharacteristic(charName)
+        return "NOTIFY" in charac.propertiesToString().split()
+
+    def stream(self, channel, rate=10.0, bufferSize=256, notify=True):
+        """
+        Start streaming samples from a sensor channel ("distance" or
+        "ambient"). Returns a SensorStream, which can be iterated with
+        "for" or "async for" and should be closed when finished.
+        """
+        from skoopy.stream import SensorStream
+
+        return SensorStream(self, channel, rate, bufferSize, notify).start()
 
     def readData(self, charName="data"):
         dataBytes = self.readBytes(charName)
@@ -120,25 +512,25 @@ class SkoobotController:
         return value
 
     def cmdRight(self):
-       self.sendCommand(CMD_RIGHT, True)
+       self.sendMotion(CMD_RIGHT)
 
     def cmdLeft(self):
-       self.sendCommand(CMD_LEFT, True)
+       self.sendMotion(CMD_LEFT)
 
     def cmdForward(self):
-       self.sendCommand(CMD_FORWARD, True)
+       self.sendMotion(CMD_FORWARD)
 
     def cmdBackward(self):
-       self.sendCommand(CMD_BACKWARD, True)
+       self.sendMotion(CMD_BACKWARD)
 
     def cmdStop(self):
-       self.sendCommand(CMD_STOP, True)
+       self.sendMotion(CMD_STOP)
 
     def cmdSleep(self):
-       self.sendCommand(CMD_SLEEP, True)
+       self.sendMotion(CMD_SLEEP)
 
     def cmdRoverMode(self):
-       self.sendCommand(CMD_ROVER_MODE, True)
+       self.sendMotion(CMD_ROVER_MODE)
 
     def requestDistance(self):
        self.sendCommand(CMD_GET_DISTANCE, True)
@@ -159,12 +551,23 @@ class CommandParser:
             "backward" : (1, "controller", "Backward"),
             "stop" : (1, "controller", "Stop"),
             "sleep" : (1, "controller", "Sleep"),
-            "rover" : (1, "controller", "RoverMode"),
+            "rover" : (1, "self", "Rover"),
             "wait" : (2, "self", "Wait"),
             "test" : (1, "self", "Test"),
             "get" : (2, "self", "Get"),
             "list" : (1, "self", "List"),
             "read" : (2, "self", "Read"),
+            "stream" : (2, "self", "Stream"),
+        }
+        # Argument validators - dictionary in the form:
+        #   <command> : <parse method>
+        # The parse method converts the argument words or raises
+        # ValueError or KeyError.
+        self.argumentTable = {
+            "wait" : "Duration",
+            "get" : "Property",
+            "stream" : "Property",
+            "read" : "Characteristic",
         }
         # Skoobot property table - dictionary in the form:
         #   <property> : <request method>
@@ -173,60 +576,195 @@ class CommandParser:
             "ambient" : "AmbientLight",
         }
         self.controller = controller
+        # Samples per second for the stream command
+        self.streamRate = 10.0
+        # File that command output is printed to; None for stdout
+        self.output = None
+        # TimedScheduler used to run plans, or None to run them directly
+        self.scheduler = None
+        # Iterations per second of the host-side rover, or None to use
+        # the Skoobot's own rover mode
+        self.roverRate = None
+        # TelemetryLog that get and stream readings are recorded in, or None
+        self.telemetry = None
+        # Compiled plans, keyed by word tuple and line number tuple
+        self.planCache = {}
+        self.planCacheSize = 64
 
     def parseCommandList(self, words):
+        """
+        Compile and then run a list of command words
+        """
+        self.runPlan(self.compile(words))
+
+    def runPlan(self, plan):
+        """
+        Run a compiled plan, on the scheduler's timeline if one is set
+        """
+        if self.scheduler != None:
+            self.scheduler.run(plan)
+        else:
+            plan.execute()
+
+    def compile(self, words, lines=None):
+        """
+        Compile a list of command words into a CommandPlan in one pass,
+        validating every command and argument before anything is run.
+        lines optionally gives the script line number of each word.
+
+        Blocks of the form "repeat <count> ... end" and "loop ... end"
+        are repeated count times or forever.
+
+        Raises a CommandError giving the position of the first error.
+        """
+        # Steps record their script lines, so plans with different
+        # lines cannot be shared
+        key = (tuple(words), None if lines == None else tuple(lines))
+        plan = self.planCache.get(key)
+        if plan != None:
+            return plan
+
         objDict = {
             "controller" : self.controller,
             "self" : self
         }
-        while len(words) >= 1:
-            if not isinstance(words[0], str):
+        # Stack of (steps, repeat count, position) for open blocks
+        blocks = []
+        steps = []
+        position = 0
+        wordTotal = len(words)
+
+        def error(message, errorPosition):
+            line = lines[errorPosition] if lines != None else None
+            return CommandError(message, errorPosition, line)
+
+        while position < wordTotal:
+            word = words[position]
+            if not isinstance(word, str):
                 raise TypeError("words should be a list of strings")
-            commandTuple = self.commandTable.get(words[0])
+
+            if word == "repeat" or word == "loop":
+                count = None
+                wordCount = 1
+                if word == "repeat":
+                    if position + 1 >= wordTotal:
+                        raise error("Missing count for repeat", position)
+                    try:
+                        count = int(words[position + 1])
+                    except ValueError:
+                        raise error("Invalid repeat count: {0:s}".format(words[position + 1]), position + 1)
+                    if count < 0:
+                        raise error("Invalid repeat count: {0:s}".format(words[position + 1]), position + 1)
+                    wordCount = 2
+                blocks.append((steps, count, position))
+                steps = []
+                position += wordCount
+                continue
+
+            if word == "end":
+                if len(blocks) == 0:
+                    raise error("end without repeat or loop", position)
+                body = steps
+                steps, count, blockPosition = blocks.pop()
+                loop = PlanLoop(count, body)
+                steps.append(PlanStep(blockPosition, lines[blockPosition] if lines != None else None,
+                    words[blockPosition], loop.execute, None))
+                position += 1
+                continue
+
+            commandTuple = self.commandTable.get(word)
             if commandTuple == None:
-                raise RuntimeError("Unrecognised command: {0:s}".format(words[0]))
+                raise error("Unrecognised command: {0:s}".format(word), position)
 
             wordCount = commandTuple[0]
+            if position + wordCount > wordTotal:
+                raise error("Missing argument for {0:s}".format(word), position)
 
             targetObject = objDict.get(commandTuple[1])
             if targetObject == None:
-                raise RuntimeError("Unrecognised command type: {0:s}".format(commandTuple[1]))
+                raise error("Unrecognised command type: {0:s}".format(commandTuple[1]), position)
             targetMethod = getattr(targetObject, "cmd" + commandTuple[2])
 
-            if wordCount == 1:
-                targetMethod()
-            else:
-                args = words[1:wordCount]
-                targetMethod(args)
+            args = None
+            if wordCount > 1:
+                args = words[position + 1:position + wordCount]
+                validator = self.argumentTable.get(word)
+                if validator != None:
+                    try:
+                        args = getattr(self, "parse" + validator)(args)
+                    except (ValueError, KeyError) as exc:
+                        reason = str(exc.args[0]) if len(exc.args) > 0 else word
+                        raise error("Invalid argument for {0:s}: {1:s}".format(word, reason), position + 1)
+
+            steps.append(PlanStep(position, lines[position] if lines != None else None,
+                word, targetMethod, args))
+            position += wordCount
+
+        if len(blocks) > 0:
+            raise error("Missing end for {0:s}".format(words[blocks[-1][2]]), blocks[-1][2])
+
+        plan = CommandPlan(steps, list(words))
+        if len(self.planCache) >= self.planCacheSize:
+            self.planCache.clear()
+        self.planCache[key] = plan
+        return plan
+
+    def compileScript(self, path):
+        """
+        Compile a script file. Commands are separated by whitespace
+        and anything following a # on a line is ignored.
+        """
+        words = []
+        lines = []
+        with open(path, "r") as scriptFile:
+            for lineNumber, line in enumerate(scriptFile, 1):
+                for word in line.split("#", 1)[0].split():
+                    words.append(word)
+                    lines.append(lineNumber)
+        return self.compile(words, lines)
+
+    def parseDuration(self, args):
+        duration = float(args[0])
+        if duration < 0.0:
+            raise ValueError("negative duration {0:s}".format(args[0]))
+        return [duration]
 
-            words = words[wordCount:]
+    def parseProperty(self, args):
+        if args[0] not in self.propertyTable:
+            raise KeyError("Skoobot data property {0:s} not found.".format(args[0]))
+        return args
+
+    def parseCharacteristic(self, args):
+        if args[0] not in self.controller.uuids:
+            raise KeyError("Unknown characteristic {0:s}".format(args[0]))
+        return args
     
     def cmdWait(self, args):
         duration = float(args[0])
         time.sleep(duration)
 
     def cmdTest(self):
-        print("Testing...")
+        print("Testing...", file=self.output)
 
-        print("Right")
+        print("Right", file=self.output)
         self.parseCommandList(["right", "wait", "1"])
 
-        print("Left")
+        print("Left", file=self.output)
         self.parseCommandList(["left", "wait", "1"])
 
-        print("Forward")
+        print("Forward", file=self.output)
         self.parseCommandList(["forward", "wait", "1"])
 
-        print("Backward")
+        print("Backward", file=self.output)
         self.parseCommandList(["backward", "wait", "0.5"])
 
-        print("Stop")
+        print("Stop", file=self.output)
         self.parseCommandList(["stop", "wait", "1"])
 
-        print("Sleep")
+        print("Sleep", file=self.output)
         self.parseCommandList(["sleep"])
 
-        print("Finished testing")
+        print("Finished testing", file=self.output)
 
     def cmdGet(self, args):
         request = self.propertyTable.get(args[0])
@@ -234,7 +772,51 @@ class CommandParser:
             raise KeyError("Skoobot data property {0:s} not found.".format(args[0]))
         targetMethod = getattr(self.controller, "request" + request)
         data = targetMethod()
-        print("{0:s} = {1:d}".format(args[0], data))
+        if self.telemetry != None:
+            self.telemetry.append(self.controller.connectedSkoobot, args[0], data)
+        print("{0:s} = {1:d}".format(args[0], data), file=self.output)
+
+    def cmdStream(self, args):
+        """
+        Print samples from the named property as they arrive,
+        until interrupted
+        """
+        if args[0] not in self.propertyTable:
+            raise KeyError("Skoobot data property {0:s} not found.".format(args[0]))
+        stream = self.controller.stream(args[0], self.streamRate)
+        start = time.monotonic()
+        try:
+            for sample in stream:
+                if self.telemetry != None:
+                    self.telemetry.appendSample(self.controller.connectedSkoobot, sample)
+                print("{0:.3f}\t{1:s} = {2:d}".format(sample.timestamp - start, sample.channel, sample.value),
+                    file=self.output, flush=True)
+        except KeyboardInterrupt:
+            pass
+        finally:
+            stream.close()
+
+    def cmdRover(self):
+        """
+        Start rover mode. If roverRate is set, drive the obstacle
+        avoidance loop from the host at that rate until interrupted,
+        then print the loop timing.
+        """
+        if self.roverRate == None:
+            self.controller.cmdRoverMode()
+            return
+
+        from skoopy.controlloop import ControlLoop, RoverPolicy, formatReport
+
+        loop = ControlLoop(self.controller, RoverPolicy(), self.roverRate, telemetry=self.telemetry)
+        try:
+            loop.run()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            self.controller.cmdStop()
+        for line in formatReport(loop.report()):
+            print(line, file=self.output)
 
     def cmdList(self):
         """
@@ -242,7 +824,7 @@ class CommandParser:
         """
         "List of known characteristics:"
         for key, value in self.controller.uuids.items():
-            print("\t{0:s}\t: {1:s}".format(key, value))
+            print("\t{0:s}\t: {1:s}".format(key, value), file=self.output)
         
     def cmdRead(self, args):
         """
@@ -260,19 +842,19 @@ class CommandParser:
         """
         length = len(bytes)
         if length == 0:
-            print("<empty>")
+            print("<empty>", file=self.output)
         else:
             output =[] 
             width = 16
             for i in range(0, length, 2):
                 if i % width == 0 and i != 0:
-                    print(" ".join(output))
+                    print(" ".join(output), file=self.output)
                     output = []
                 if i + 1 < length:
                     output.append("0x{1:02x}{0:02x}".format(bytes[i], bytes[i + 1]))
                 else:
                     output.append("0x{0:02x}".format(bytes[i]))
-            print(" ".join(output))
+            print(" ".join(output), file=self.output)
 
 def control():
     argParser = argparse.ArgumentParser(description="Control a Skoobot")
@@ -280,27 +862,113 @@ def control():
     argParser.add_argument("--name", "-n", help="Skoobot name")
     # argParser.add_argument("--changedefault", "-c", action="store_true", help="Change the default Skoobot")
     # argParser.add_argument("--register", "-r", action="store_true", help="Register the Skoobot")
+    argParser.add_argument("--race", action="store_true", help="Try all addresses matching the name at once")
+    argParser.add_argument("--deadline", type=float, help="Time limit in seconds when racing connections")
+    argParser.add_argument("--rate", "-r", type=float, default=10.0, help="Samples per second for the stream command")
+    argParser.add_argument("--daemon", "-d", action="store_true", help="Send the commands via skoodaemon if it is running")
+    argParser.add_argument("--script", "-s", help="File of commands to run after any given on the command line")
+    argParser.add_argument("--fast", "-f", action="store_true", help="Send motion commands without waiting for each response")
+    argParser.add_argument("--timed", "-t", action="store_true", help="Run commands on a drift-free timeline and report lateness")
+    argParser.add_argument("--rover-rate", type=float,
+        help="Run the rover command on the host at this many iterations per second")
+    argParser.add_argument("--reconnect", action="store_true", help="Reconnect automatically if the link is lost")
+    argParser.add_argument("--metrics", "-m",
+        help="Write timing metrics to this file on exit: JSON if it ends in .json, otherwise Prometheus text")
+    argParser.add_argument("--telemetry", help="Append get and stream readings to this telemetry log")
+    argParser.add_argument("--telemetry-capacity", type=int,
+        help="Create the telemetry log as a ring holding at most this many readings")
+    argParser.add_argument("--record", help="Record every BLE operation to this trace file")
+    argParser.add_argument("--replay", help="Play back a trace file instead of using Bluetooth")
+    argParser.add_argument("--replay-fast", action="store_true", help="Play back the trace as fast as possible")
     argParser.add_argument("commands", nargs=argparse.REMAINDER, help="Commands to send to the Skoobot")
     args = argParser.parse_args()
 
-    controller = SkoobotController()
-
     name = getattr(args, "name", None)
     baddr = getattr(args, "baddr", None)
     changeDefault = getattr(args, "changedefault", False)
     doRegister = getattr(args, "register", False)
     commandList = getattr(args, "commands", None)
 
-    if commandList != 0:
-        addr = controller.connect(name, baddr)
+    if args.daemon:
+        # skoodaemon runs the commands on its own controller, which
+        # would silently ignore these
+        for option in ("fast", "timed", "record", "replay", "telemetry", "metrics"):
+            if getattr(args, option) not in (None, False):
+                argParser.error("--daemon cannot be used with --{0:s}".format(option))
+
+    if commandList and args.daemon and args.script == None:
+        from skoopy.daemon import sendToDaemon
+        try:
+            response = sendToDaemon(commandList, name, baddr)
+        except OSError:
+            response = None
+        if response != None:
+            print(response.get("output", ""), end="")
+            if not response["ok"]:
+                print(response["error"])
+                exit(1)
+            return
+
+    if args.metrics != None:
+        metrics.enable()
+
+    transport = None
+    if args.replay != None:
+        from skoopy.trace import ReplayTransport
+        transport = ReplayTransport(args.replay, realtime=not args.replay_fast)
+    elif args.record != None:
+        from skoopy.trace import RecordingTransport
+        from skoopy.transport import TransportBluepy
+        transport = RecordingTransport(TransportBluepy(), args.record)
+
+    controller = SkoobotController(transport)
+    controller.setFastMode(args.fast)
+    controller.setAutoReconnect(args.reconnect)
+    parser = CommandParser(controller)
+    parser.streamRate = args.rate
+    parser.roverRate = args.rover_rate
+    if args.telemetry != None:
+        from skoopy.telemetry import TelemetryLog
+        parser.telemetry = TelemetryLog(args.telemetry, args.telemetry_capacity)
+    if args.timed:
+        from skoopy.scheduler import TimedScheduler
+        parser.scheduler = TimedScheduler(parser)
+
+    # Compile everything first so that mistakes are reported
+    # before the Skoobot starts moving
+    plans = []
+    try:
+        plans.append(parser.compile(commandList))
+        if args.script != None:
+            plans.append(parser.compileScript(args.script))
+    except CommandError as exc:
+        print(exc)
+        exit(2)
+
+    if len(commandList) > 0 or args.script != None:
+        addr = controller.connect(name, baddr, args.race, args.deadline)
         if addr == None:
             print("Unable to connect to skoobot")
+            for attempt in controller.connectAttempts:
+                print("\t{0:s}\t{1:s} after {2:.3f}s".format(attempt.addr, attempt.outcome, attempt.duration))
             exit(1)
     
-        parser = CommandParser(controller)
-        parser.parseCommandList(commandList)
+        for plan in plans:
+            parser.runPlan(plan)
+            controller.sync()
+            if parser.scheduler != None:
+                report = parser.scheduler.report()
+                if report["count"] > 0:
+                    print("Lateness over {0:d} commands: mean {1:.1f}ms, p90 {2:.1f}ms, max {3:.1f}ms".format(
+                        report["count"], report["mean"] * 1000, report["p90"] * 1000, report["max"] * 1000))
 
         controller.disconnect()
+        if args.record != None:
+            controller.transport.close()
+        if parser.telemetry != None:
+            parser.telemetry.close()
+        if args.metrics != None:
+            metrics.registry.write(args.metrics)
     else:
         print("No commands")
 
@@ -0,0 +1,226 @@
+"""
+Fixed-rate closed-loop control of a Skoobot
+
+A ControlLoop reads a sensor, passes the reading to a policy and sends
+the command the policy returns, at a fixed rate on a monotonic timeline.
+
+Each iteration waits only for one read: the sensor request for the
+next iteration is sent without response at the end of this one, so the
+Skoobot measures while the loop sleeps, and the read acknowledges it
+together with this iteration's command. Motion commands are sent with
+the controller in fast mode, without waiting for a response.
+A sample that is older than maxAge by the time the policy would see it
+(after a slow read or a reconnection) is skipped rather than acted on.
+
+The loop records when each iteration started relative to its deadline,
+how long each reading took to turn into a command, and how many
+deadlines were missed.
+"""
+
+import time
+
+from skoopy import metrics
+from skoopy import stats
+from skoopy.controller import CMD_FORWARD, CMD_LEFT, CMD_RIGHT
+from skoopy.scheduler import sleepUntil
+from skoopy.stream import CHANNELS, Sample
+
+class RoverPolicy:
+    """
+    Obstacle avoidance: drive forwards until the distance reading is
+    below nearDistance, then turn until it is clear again.
+    Turns alternate direction if turn is None. A turn is a single
+    movement, so it is returned again for every reading that is still
+    near; forward is only returned when the Skoobot is not already
+    driving forwards.
+    """
+
+    def __init__(self, nearDistance=40, turn=None):
+        self.nearDistance = nearDistance
+        self.turn = turn
+        self.lastCommand = None
+        self.lastTurn = CMD_RIGHT
+
+    def __call__(self, sample):
+        if sample.value < self.nearDistance:
+            if self.turn != None:
+                command = self.turn
+            else:
+                # Keep turning the same way until clear
+                if self.lastCommand not in (CMD_LEFT, CMD_RIGHT):
+                    self.lastTurn = CMD_LEFT if self.lastTurn == CMD_RIGHT else CMD_RIGHT
+                command = self.lastTurn
+        else:
+            command = CMD_FORWARD
+        if command == CMD_FORWARD and self.lastCommand == CMD_FORWARD:
+            return None
+        self.lastCommand = command
+        return command
+
+class ControlLoop:
+    """
+    Runs policy(sample) at rate iterations per second.
+
+    The policy receives a skoopy.stream.Sample of the channel ("distance"
+    or "ambient") and returns the command byte to send, or None to send
+    nothing. Commands are sent with the controller's sendMotion(), in
+    fast mode while run() is running. maxAge is the oldest, in seconds
+    from the request, that a sample may be when the policy is called;
+    since each request is sent an iteration ahead, it defaults to two
+    periods.
+    Readings are appended to telemetry, a TelemetryLog, if given.
+    """
+
+    def __init__(self, controller, policy, rate=20.0, channel="distance", maxAge=None, telemetry=None):
+        if channel not in CHANNELS:
+            raise KeyError("Unknown sensor channel {0:s}".format(channel))
+        if rate <= 0.0:
+            raise ValueError("rate must be positive")
+        self.controller = controller
+        self.policy = policy
+        self.rate = rate
+        self.period = 1.0 / rate
+        self.channel = channel
+        self.request, self.charName = CHANNELS[channel]
+        self.maxAge = maxAge if maxAge != None else 2.0 * self.period
+        self.telemetry = telemetry
+        self.running = False
+        # When the sensor request in flight was sent, or None
+        self.requested = None
+        self.reset()
+
+    def reset(self):
+        self.iterations = 0
+        self.deadlineMisses = 0
+        self.skippedPeriods = 0
+        self.staleSamples = 0
+        self.commandsSent = 0
+        self.elapsed = 0.0
+        # Seconds each iteration started after its deadline
+        self.lateness = []
+        # Seconds from starting the sensor read to sending the command
+        self.latencies = []
+
+    def stop(self):
+        """
+        Stop the loop after the current iteration. May be called from
+        another thread or from the policy.
+        """
+        self.running = False
+
+    def step(self):
+        """
+        Run one iteration. Returns the command sent, or None.
+        """
+        controller = self.controller
+        begun = time.monotonic()
+        # Another thread's command must not come between the request and the read
+        with controller.lock:
+            if self.requested == None:
+                controller.sendCommand(self.request, False)
+                self.requested = begun
+            value = controller.readData(self.charName)
+            # The read is answered after every write before it
+            controller.acknowledge(time.monotonic())
+        sample = Sample(self.requested, self.channel, value)
+        self.requested = None
+        if self.telemetry != None:
+            self.telemetry.appendSample(controller.connectedSkoobot, sample)
+
+        command = None
+        if time.monotonic() - sample.timestamp > self.maxAge:
+            self.staleSamples += 1
+        else:
+            command = self.policy(sample)
+            if command != None:
+                controller.sendMotion(command)
+                self.commandsSent += 1
+            self.latencies.append(time.monotonic() - begun)
+        requested = time.monotonic()
+        with controller.lock:
+            controller.sendCommand(self.request, False)
+        self.requested = requested
+        return command
+
+    def run(self, duration=None, iterations=None):
+        """
+        Run until stop() is called, or for duration seconds or a number
+        of iterations if given. Returns report().
+        """
+        self.reset()
+        self.running = True
+        controller = self.controller
+        fastMode, fastWindow = controller.fastMode, controller.fastWindow
+        controller.setFastMode(True, fastWindow)
+        timed = metrics.enabled
+        start = time.monotonic()
+        deadline = start
+        try:
+            while self.running:
+                if iterations != None and self.iterations >= iterations:
+                    break
+                if duration != None and deadline - start >= duration:
+                    break
+                sleepUntil(deadline)
+                begun = time.monotonic()
+                self.lateness.append(begun - deadline)
+                self.step()
+                self.iterations += 1
+                finished = time.monotonic()
+                if timed:
+                    metrics.observe("skoopy_control_iteration_seconds", finished - begun)
+
+                deadline += self.period
+                if finished > deadline:
+                    self.deadlineMisses += 1
+                    if timed:
+                        metrics.increment("skoopy_control_deadline_misses_total")
+                    # Skip the periods that have already passed rather
+                    # than catching up with a burst
+                    missed = int((finished - deadline) / self.period)
+                    self.skippedPeriods += missed
+                    deadline += missed * self.period
+            if self.requested != None:
+                # Acknowledge the last request and command
+                self.requested = None
+                controller.sync()
+        finally:
+            self.running = False
+            self.requested = None
+            self.elapsed = time.monotonic() - start
+            controller.setFastMode(fastMode, fastWindow)
+        return self.report()
+
+    def report(self):
+        """
+        Return a dictionary describing the last run: achieved rate,
+        deadline misses and lateness and latency statistics in seconds
+        """
+        return {
+            "iterations" : self.iterations,
+            "elapsed" : self.elapsed,
+            "targetRate" : self.rate,
+            "rate" : self.iterations / self.elapsed if self.elapsed > 0.0 else 0.0,
+            "deadlineMisses" : self.deadlineMisses,
+            "skippedPeriods" : self.skippedPeriods,
+            "staleSamples" : self.staleSamples,
+            "commandsSent" : self.commandsSent,
+            "lateness" : stats.summarise(self.lateness),
+            "latency" : stats.summarise(self.latencies),
+        }
+
+def formatReport(report):
+    """
+    Return a ControlLoop report as lines of text
+    """
+    lines = [ "{0:d} iterations in {1:.2f}s: {2:.1f}Hz of {3:.1f}Hz target".format(report["iterations"],
+            report["elapsed"], report["rate"], report["targetRate"]),
+        "Deadline misses {0:d}, skipped periods {1:d}, stale samples {2:d}, commands sent {3:d}".format(
+            report["deadlineMisses"], report["skippedPeriods"], report["staleSamples"], report["commandsSent"]) ]
+    for name in ("latency", "lateness"):
+        summary = report[name]
+        if summary["count"] > 0:
+            lines.append("{0:s}: p50 {1:.1f}ms, p90 {2:.1f}ms, p99 {3:.1f}ms, max {4:.1f}ms".format(
+                name.capitalize(), summary["p50"] * 1000, summary["p90"] * 1000,
+                summary["p99"] * 1000, summary["max"] * 1000))
+    return lines
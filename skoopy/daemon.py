@@ -0,0 +1,275 @@
+#!/usr/env python3
+"""
+Persistent connection daemon for Skoobots
+
+skoodaemon keeps connections to Skoobots open and runs command lists
+sent by skoocontrol over a local Unix socket, so that each skoocontrol
+invocation skips the BLE connect and service discovery. Commands that
+run until interrupted, such as stream, are refused.
+
+The protocol is one JSON object per line in each direction. A request
+is {"name": ..., "addr": ..., "commands": [...]} and the response is
+{"ok": true, "addr": ..., "output": ...} or {"ok": false, "error": ...}.
+"""
+
+import argparse
+import io
+import json
+import os
+import socket
+import socketserver
+import threading
+import time
+
+from skoopy.controller import SkoobotController, CommandParser, CommandError
+from skoopy.plan import PlanLoop
+from skoopy.registry import SkoobotRegistry
+from skoopy.transport import TransportBluepy
+
+DEFAULT_IDLE_TIMEOUT = 300.0
+# Seconds sendToDaemon waits for a response; long enough for a
+# cold connect and a short command list
+DEFAULT_REQUEST_TIMEOUT = 60.0
+
+# Commands that run until interrupted, and so would hold a connection
+# and the skoocontrol request waiting on it indefinitely
+UNTIMED_COMMANDS = frozenset(("stream", "rover"))
+
+def defaultSocketPath():
+    runtimeDir = os.environ.get("XDG_RUNTIME_DIR")
+    if runtimeDir != None:
+        return os.path.join(runtimeDir, "skoodaemon.sock")
+    return os.path.expanduser("~/.skoodaemon.sock")
+
+def checkPlanSteps(steps):
+    """
+    Raise a CommandError for the first step of a compiled plan that
+    would never finish
+    """
+    for step in steps:
+        loop = getattr(step.method, "__self__", None)
+        if isinstance(loop, PlanLoop):
+            if loop.count == None:
+                raise CommandError("A loop without a count cannot be run by skoodaemon", step.position, step.line)
+            checkPlanSteps(loop.steps)
+        elif step.command in UNTIMED_COMMANDS:
+            raise CommandError("{0:s} cannot be run by skoodaemon".format(step.command), step.position, step.line)
+
+class DaemonConnection:
+    """
+    A warm connection to one Skoobot. Access is serialized by lock.
+    """
+    def __init__(self, controller):
+        self.controller = controller
+        self.parser = CommandParser(controller)
+        self.lock = threading.Lock()
+        self.lastUsed = time.monotonic()
+
+class SkoobotDaemon:
+    """
+    Holds warm connections to Skoobots and runs command lists on them.
+    Connections idle for longer than idleTimeout seconds are closed.
+    """
+
+    def __init__(self, registry=None, transport=None, idleTimeout=DEFAULT_IDLE_TIMEOUT):
+        if registry == None:
+            registry = SkoobotRegistry()
+        if transport == None:
+            transport = TransportBluepy()
+        self.registry = registry
+        self.transport = transport
+        self.idleTimeout = idleTimeout
+        # (name, addr) as requested : connected address
+        self.targets = {}
+        # connected address : DaemonConnection
+        self.connections = {}
+        # (name, addr) as requested : lock held while connecting to it
+        self.connectLocks = {}
+        # Guards the dictionaries above; never held during BLE operations
+        self.lock = threading.Lock()
+        self.server = None
+
+    def getConnection(self, name=None, addr=None):
+        """
+        Return the warm connection for the requested Skoobot,
+        connecting to it if necessary
+        """
+        target = (name, addr)
+        with self.lock:
+            connection = self.connections.get(self.targets.get(target))
+            if connection != None:
+                return connection
+            connectLock = self.connectLocks.setdefault(target, threading.Lock())
+
+        # Only requests for the same target wait for this connect
+        with connectLock:
+            with self.lock:
+                connection = self.connections.get(self.targets.get(target))
+            if connection != None:
+                return connection
+
+            controller = SkoobotController(self.transport.spawn(), self.registry)
+            try:
+                connectedAddr = controller.connect(name, addr)
+            except ValueError:
+                # The name may have been added by skooscan since we loaded
+                self.registry.load()
+                connectedAddr = controller.connect(name, addr)
+            if connectedAddr == None:
+                raise RuntimeError("Unable to connect to skoobot")
+            with self.lock:
+                connection = self.connections.get(connectedAddr)
+                duplicate = connection != None
+                if not duplicate:
+                    connection = DaemonConnection(controller)
+                    self.connections[connectedAddr] = connection
+                self.targets[target] = connectedAddr
+            if duplicate:
+                # Another target name resolved to the same Skoobot
+                controller.disconnect()
+            return connection
+
+    def dropConnection(self, addr):
+        with self.lock:
+            connection = self.connections.pop(addr, None)
+            for target in [ target for target, targetAddr in self.targets.items() if targetAddr == addr ]:
+                del self.targets[target]
+        if connection != None:
+            with connection.lock:
+                try:
+                    connection.controller.disconnect()
+                except connection.controller.transport.linkErrors:
+                    pass
+
+    def runCommands(self, name, addr, commands):
+        """
+        Run a command list on the requested Skoobot and return a
+        response dictionary
+        """
+        connection = self.getConnection(name, addr)
+        controller = connection.controller
+        connectedAddr = controller.connectedSkoobot
+        output = io.StringIO()
+        try:
+            with connection.lock:
+                parser = connection.parser
+                # Nothing is sent unless the whole list compiles
+                plan = parser.compile(list(commands))
+                checkPlanSteps(plan.steps)
+                parser.output = output
+                parser.runPlan(plan)
+                connection.lastUsed = time.monotonic()
+        except controller.transport.linkErrors:
+            # The connection is no longer usable
+            self.dropConnection(connectedAddr)
+            raise
+        return { "ok" : True, "addr" : connectedAddr, "output" : output.getvalue() }
+
+    def handleRequest(self, request):
+        try:
+            return self.runCommands(request.get("name"), request.get("addr"), request.get("commands", []))
+        except Exception as exc:
+            return { "ok" : False, "error" : "{0:s}: {1:s}".format(type(exc).__name__, str(exc)) }
+
+    def reapIdle(self):
+        """
+        Disconnect Skoobots that have been idle for too long
+        """
+        now = time.monotonic()
+        with self.lock:
+            idle = [ addr for addr, connection in self.connections.items()
+                if now - connection.lastUsed > self.idleTimeout ]
+        for addr in idle:
+            self.dropConnection(addr)
+
+    def reaper(self):
+        while self.server != None:
+            time.sleep(min(self.idleTimeout, 5.0))
+            self.reapIdle()
+
+    def serve(self, socketPath=None):
+        """
+        Serve requests on the Unix socket until shutdown() is called.
+        Raises a RuntimeError if another daemon is already serving on it.
+        """
+        if socketPath == None:
+            socketPath = defaultSocketPath()
+        if os.path.exists(socketPath):
+            with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+                try:
+                    sock.connect(socketPath)
+                    running = True
+                except OSError:
+                    # Left behind by a daemon that did not shut down
+                    running = False
+            if running:
+                raise RuntimeError("skoodaemon is already running on {0:s}".format(socketPath))
+            os.remove(socketPath)
+        daemon = self
+
+        class Handler(socketserver.StreamRequestHandler):
+            def handle(self):
+                for line in self.rfile:
+                    try:
+                        response = daemon.handleRequest(json.loads(line.decode()))
+                    except ValueError as exc:
+                        response = { "ok" : False, "error" : "Bad request: {0:s}".format(str(exc)) }
+                    self.wfile.write(json.dumps(response).encode() + b"\n")
+                    self.wfile.flush()
+
+        self.server = socketserver.ThreadingUnixStreamServer(socketPath, Handler)
+        self.server.daemon_threads = True
+        os.chmod(socketPath, 0o600)
+        threading.Thread(target=self.reaper, name="skoodaemon-reaper", daemon=True).start()
+        try:
+            self.server.serve_forever()
+        finally:
+            server = self.server
+            self.server = None
+            server.server_close()
+            os.remove(socketPath)
+            for addr in list(self.connections.keys()):
+                self.dropConnection(addr)
+
+    def shutdown(self):
+        if self.server != None:
+            self.server.shutdown()
+
+def sendToDaemon(commands, name=None, addr=None, socketPath=None, timeout=DEFAULT_REQUEST_TIMEOUT):
+    """
+    Send a command list to a running skoodaemon and return its
+    response dictionary. Raises OSError if the daemon is not running,
+    or socket.timeout if it does not respond within timeout seconds.
+    """
+    if socketPath == None:
+        socketPath = defaultSocketPath()
+    request = { "name" : name, "addr" : addr, "commands" : list(commands) }
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+        sock.settimeout(timeout)
+        sock.connect(socketPath)
+        with sock.makefile("rwb") as sockFile:
+            sockFile.write(json.dumps(request).encode() + b"\n")
+            sockFile.flush()
+            line = sockFile.readline()
+    if len(line) == 0:
+        raise ConnectionError("skoodaemon closed the connection")
+    return json.loads(line.decode())
+
+def daemon():
+    argParser = argparse.ArgumentParser(description="Keep Skoobot connections open for skoocontrol")
+    argParser.add_argument("--socket", "-s", help="Path of the Unix socket to listen on")
+    argParser.add_argument("--idle-timeout", "-i", type=float, default=DEFAULT_IDLE_TIMEOUT,
+        help="Seconds before an idle Skoobot is disconnected")
+    args = argParser.parse_args()
+
+    skooDaemon = SkoobotDaemon(idleTimeout=args.idle_timeout)
+    try:
+        skooDaemon.serve(args.socket)
+    except RuntimeError as exc:
+        print(exc)
+        exit(1)
+    except KeyboardInterrupt:
+        pass
+
+if __name__ == "__main__":
+    daemon()
@@ -0,0 +1,203 @@
+"""
+Vectorized sensor filtering
+
+Functions here work on batches of readings from many robots at once.
+A batch is a SampleBatch of two 2D arrays, timestamps and values, with
+one row per robot and one column per reading. Rows are padded with NaN
+where a robot has fewer readings than the others, and every filter
+treats NaN as a missing reading.
+
+Batches can be built from SensorStream samples with fromSamples() or
+from a TelemetryLog with fromTelemetry(). NumPy is required, and is
+imported when a batch is first built.
+"""
+
+import collections
+import warnings
+
+from skoopy.telemetry import numpy
+
+# robots - list of robot addresses (or ids), one per row
+# timestamps, values - float arrays of shape (robots, readings). Timestamps
+#   are in seconds, from time.monotonic() for Samples and time.time()
+#   for a TelemetryLog; filters only use the differences between them.
+SampleBatch = collections.namedtuple("SampleBatch", ["robots", "timestamps", "values"])
+
+def padRows(rows):
+    """
+    Stack a list of 1D sequences into a 2D float array, padding
+    short rows with NaN at the end
+    """
+    np = numpy()
+    width = max([ len(row) for row in rows ] + [0])
+    result = np.full((len(rows), width), np.nan)
+    for i, row in enumerate(rows):
+        result[i, :len(row)] = row
+    return result
+
+def fromSamples(samples):
+    """
+    Build a SampleBatch from a dictionary of robot address to a list
+    of skoopy.stream.Samples
+    """
+    robots = list(samples.keys())
+    return SampleBatch(robots,
+        padRows([ [ sample.timestamp for sample in samples[robot] ] for robot in robots ]),
+        padRows([ [ sample.value for sample in samples[robot] ] for robot in robots ]))
+
+def fromTelemetry(log, channel, robots=None):
+    """
+    Build a SampleBatch of one channel from a TelemetryLog.
+    robots is a list of addresses or robot ids, and defaults to every
+    robot in the log.
+    """
+    np = numpy()
+    from skoopy.telemetry import CHANNEL_IDS
+
+    if robots == None:
+        robots = log.robots()
+    channelId = CHANNEL_IDS[channel] if isinstance(channel, str) else channel
+    records = log.ordered()
+    records = records[records["channel"] == channelId]
+    timestampRows = []
+    valueRows = []
+    for robot in robots:
+        robotId = log.robotIds.get(robot, -1) if isinstance(robot, str) else robot
+        selected = records[records["robot"] == robotId]
+        timestampRows.append(selected["timestamp"])
+        valueRows.append(selected["value"].astype(np.float64))
+    return SampleBatch(list(robots), padRows(timestampRows), padRows(valueRows))
+
+def slidingWindows(values, window):
+    """
+    Return a view of shape (robots, readings, window) where [:, i, :]
+    is the window centred on reading i, edges padded with NaN
+    """
+    np = numpy()
+    half = window // 2
+    padded = np.pad(values, ((0, 0), (half, window - 1 - half)), constant_values=np.nan)
+    return np.lib.stride_tricks.sliding_window_view(padded, window, axis=1)
+
+def nanmedian(values, axis):
+    """
+    numpy.nanmedian without the warning for windows with no readings
+    """
+    with warnings.catch_warnings():
+        warnings.simplefilter("ignore", RuntimeWarning)
+        return numpy().nanmedian(values, axis=axis)
+
+def medianFilter(values, window=5):
+    """
+    Rolling median over window readings, ignoring missing readings
+    """
+    np = numpy()
+    result = nanmedian(slidingWindows(values, window), 2)
+    result[np.isnan(values)] = np.nan
+    return result
+
+def emaFilter(values, alpha=0.3):
+    """
+    Exponential moving average with smoothing factor alpha.
+    Missing readings hold the previous average.
+    """
+    np = numpy()
+    values = np.asarray(values, dtype=np.float64)
+    result = np.empty_like(values)
+    average = np.full(values.shape[0], np.nan)
+    for i in range(values.shape[1]):
+        column = values[:, i]
+        average = np.where(np.isnan(average), column,
+            np.where(np.isnan(column), average, average + alpha * (column - average)))
+        result[:, i] = average
+    return result
+
+def kalmanFilter(values, processVariance=4.0, measurementVariance=25.0):
+    """
+    Scalar Kalman filter with a constant-value model, run for every
+    robot at once. Missing readings skip the update step.
+    Returns (estimates, variances).
+    """
+    np = numpy()
+    values = np.asarray(values, dtype=np.float64)
+    estimates = np.empty_like(values)
+    variances = np.empty_like(values)
+    estimate = np.full(values.shape[0], np.nan)
+    variance = np.full(values.shape[0], np.nan)
+    for i in range(values.shape[1]):
+        column = values[:, i]
+        variance = variance + processVariance
+        first = np.isnan(estimate) & ~np.isnan(column)
+        estimate = np.where(first, column, estimate)
+        variance = np.where(first, measurementVariance, variance)
+        update = ~np.isnan(column) & ~first
+        gain = np.where(update, variance / (variance + measurementVariance), 0.0)
+        estimate = np.where(update, estimate + gain * (column - estimate), estimate)
+        variance = (1.0 - gain) * variance
+        estimates[:, i] = estimate
+        variances[:, i] = variance
+    return estimates, variances
+
+def rejectOutliers(values, window=7, threshold=3.5):
+    """
+    Replace readings that are more than threshold scaled median absolute
+    deviations from their rolling median with NaN.
+    Returns (cleaned values, outlier mask).
+    """
+    np = numpy()
+    windows = slidingWindows(values, window)
+    median = nanmedian(windows, 2)
+    deviation = nanmedian(np.abs(windows - median[:, :, np.newaxis]), 2)
+    # 1.4826 scales the MAD to the standard deviation of normal noise;
+    # the floor stops a run of identical readings rejecting everything
+    scale = np.maximum(1.4826 * deviation, 1.0)
+    with np.errstate(invalid="ignore"):
+        outliers = np.abs(values - median) > threshold * scale
+    cleaned = np.where(outliers, np.nan, values)
+    return cleaned, outliers
+
+def rateOfChange(timestamps, values):
+    """
+    Change in value per second between consecutive readings. The first
+    reading of each row, and readings after a gap, are NaN.
+    """
+    np = numpy()
+    rates = np.full(values.shape, np.nan)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        rates[:, 1:] = np.diff(values, axis=1) / np.diff(timestamps, axis=1)
+    rates[~np.isfinite(rates)] = np.nan
+    return rates
+
+def detectApproach(timestamps, distances, nearDistance=40.0, horizon=1.0, window=5):
+    """
+    Flag readings where a robot is near an obstacle or closing on one.
+    Distances are Skoobot distance readings, where smaller is closer.
+
+    A reading is flagged if the median-filtered distance is below
+    nearDistance, or if at the current closing speed the robot would
+    reach nearDistance within horizon seconds.
+    Returns (flags, timeToContact) where timeToContact is NaN when
+    the robot is not approaching.
+    """
+    np = numpy()
+    smoothed = medianFilter(distances, window)
+    rates = rateOfChange(timestamps, smoothed)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        timeToContact = np.where(rates < 0.0, (smoothed - nearDistance) / -rates, np.nan)
+    timeToContact = np.where(timeToContact < 0.0, 0.0, timeToContact)
+    with np.errstate(invalid="ignore"):
+        flags = (smoothed < nearDistance) | (timeToContact <= horizon)
+    return flags, timeToContact
+
+def latest(batch):
+    """
+    Return the last reading of each robot in a batch, or NaN if it has none
+    """
+    np = numpy()
+    values = batch.values
+    result = np.full(values.shape[0], np.nan)
+    present = ~np.isnan(values)
+    rows = present.any(axis=1)
+    if values.shape[1] > 0:
+        lastIndex = values.shape[1] - 1 - np.argmax(present[:, ::-1], axis=1)
+        result[rows] = values[rows, lastIndex[rows]]
+    return result
@@ -0,0 +1,219 @@
+"""
+Concurrent control of many Skoobots
+
+A SkoobotFleet holds one SkoobotController per robot and runs
+operations on all of them in parallel. Each robot has a worker thread
+of its own, so a sweep over the fleet takes as long as its slowest
+robot however many robots there are, and a robot that hangs holds up
+only its own worker.
+"""
+
+import collections
+import concurrent.futures
+import re
+import threading
+
+from skoopy.controller import SkoobotController
+from skoopy.registry import SkoobotRegistry
+from skoopy.transport import TransportBluepy
+
+# Result of a fleet-wide operation:
+#   values - dictionary of address to return value for robots that succeeded
+#   errors - dictionary of address (or requested name) to exception
+FleetResult = collections.namedtuple("FleetResult", ["values", "errors"])
+
+ADDRESS_PATTERN = re.compile(r"^([0-9a-fA-F]{2}:){5}[0-9a-fA-F]{2}$")
+
+class SkoobotFleet:
+    """
+    Drive a set of Skoobots concurrently.
+
+    Operations on different robots run in parallel; operations on the
+    same robot are serialized. A failure or timeout on one robot is
+    reported in the errors of the FleetResult and does not affect the
+    others.
+    """
+
+    def __init__(self, registry=None, transport=None, maxWorkers=None, timeout=None, presence=None):
+        """
+        registry and transport default to the user's registry and a
+        bluepy transport. Each robot is driven through its own transport
+        created with transport.spawn(). maxWorkers limits the number of
+        connections made at once; by default all are made together.
+        timeout is the default limit in seconds on any fleet-wide
+        operation. If presence is a PresenceTracker, Skoobots it has not
+        heard are not connected to.
+        """
+        if registry == None:
+            registry = SkoobotRegistry()
+        if transport == None:
+            transport = TransportBluepy()
+        self.registry = registry
+        self.transport = transport
+        self.timeout = timeout
+        self.presence = presence
+        self.maxWorkers = maxWorkers
+        self.controllers = {}
+        self.locks = {}
+        # Dictionary of address to the robot's single worker
+        self.workers = {}
+        # Addresses of robots still running an operation that timed out
+        self.busy = set()
+        self.busyLock = threading.Lock()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, excType, excValue, traceback):
+        self.close()
+
+    def addresses(self):
+        """
+        Return the addresses of the connected Skoobots
+        """
+        return list(self.controllers.keys())
+
+    def isAddress(self, nameAddr):
+        return len(self.registry.getSkoobotsByAddress(nameAddr)) > 0 or \
+            ADDRESS_PATTERN.match(nameAddr) != None
+
+    def connectOne(self, nameAddr):
+        controller = SkoobotController(self.transport.spawn(), self.registry)
+        controller.presence = self.presence
+        if self.isAddress(nameAddr):
+            addr = controller.connect(addr=nameAddr)
+        else:
+            addr = controller.connect(name=nameAddr)
+        if addr == None:
+            raise RuntimeError("Unable to connect to skoobot {0:s}".format(nameAddr))
+        return controller
+
+    def connect(self, namesAddrs, timeout=None):
+        """
+        Connect to the given Skoobot names and/or addresses in parallel.
+
+        Returns a FleetResult whose values map each requested name or
+        address to the connected address.
+        """
+        if timeout == None:
+            timeout = self.timeout
+        namesAddrs = list(namesAddrs)
+        if len(namesAddrs) == 0:
+            return FleetResult({}, {})
+        workers = len(namesAddrs) if self.maxWorkers == None else min(self.maxWorkers, len(namesAddrs))
+        executor = concurrent.futures.ThreadPoolExecutor(max_workers=workers, thread_name_prefix="skoopy-fleet")
+        futures = { nameAddr : executor.submit(self.connectOne, nameAddr) for nameAddr in namesAddrs }
+        concurrent.futures.wait(futures.values(), timeout)
+        # Connections that timed out finish in the background
+        executor.shutdown(wait=False)
+
+        values = {}
+        errors = {}
+        for nameAddr, future in futures.items():
+            if not future.done():
+                # The connection may still succeed later; make sure it is closed
+                future.add_done_callback(self.discardConnection)
+                errors[nameAddr] = TimeoutError("Timed out connecting to {0:s}".format(nameAddr))
+            elif future.exception() != None:
+                errors[nameAddr] = future.exception()
+            else:
+                controller = future.result()
+                addr = controller.connectedSkoobot
+                if addr in self.controllers:
+                    controller.disconnect()
+                else:
+                    self.controllers[addr] = controller
+                    self.locks[addr] = threading.Lock()
+                    self.workers[addr] = concurrent.futures.ThreadPoolExecutor(max_workers=1,
+                        thread_name_prefix="skoopy-fleet")
+                values[nameAddr] = addr
+        return FleetResult(values, errors)
+
+    def discardConnection(self, future):
+        if future.exception() == None:
+            future.result().disconnect()
+
+    def runLocked(self, addr, func, args):
+        with self.locks[addr]:
+            return func(self.controllers[addr], *args)
+
+    def run(self, func, *args, addrs=None, timeout=None):
+        """
+        Call func(controller, *args) for each connected Skoobot in parallel.
+        If addrs is given, only those Skoobots are targeted.
+
+        Returns a FleetResult keyed by address. A Skoobot that is still
+        busy with an operation that timed out is not given another one;
+        it is reported with a TimeoutError until that operation ends.
+        """
+        if addrs == None:
+            addrs = self.addresses()
+        if timeout == None:
+            timeout = self.timeout
+
+        values = {}
+        errors = {}
+        futures = {}
+        for addr in addrs:
+            if addr not in self.controllers:
+                errors[addr] = KeyError("Skoobot {0:s} is not connected".format(addr))
+            elif addr in self.busy:
+                errors[addr] = TimeoutError("Skoobot {0:s} is still busy with an operation that timed out".format(addr))
+            else:
+                futures[addr] = self.workers[addr].submit(self.runLocked, addr, func, args)
+        concurrent.futures.wait(futures.values(), timeout)
+
+        for addr, future in futures.items():
+            if not future.done():
+                if not future.cancel():
+                    self.markBusy(addr, future)
+                errors[addr] = TimeoutError("Timed out waiting for {0:s}".format(addr))
+            elif future.exception() != None:
+                errors[addr] = future.exception()
+            else:
+                values[addr] = future.result()
+        return FleetResult(values, errors)
+
+    def markBusy(self, addr, future):
+        with self.busyLock:
+            self.busy.add(addr)
+        def finished(future):
+            with self.busyLock:
+                self.busy.discard(addr)
+        future.add_done_callback(finished)
+
+    def broadcast(self, methodName, *args, addrs=None, timeout=None):
+        """
+        Call the named SkoobotController method, e.g. "cmdForward",
+        on each targeted Skoobot
+        """
+        method = getattr(SkoobotController, methodName)
+        return self.run(method, *args, addrs=addrs, timeout=timeout)
+
+    def sendCommand(self, data, waitForResponse=False, addrs=None, timeout=None):
+        return self.broadcast("sendCommand", data, waitForResponse, addrs=addrs, timeout=timeout)
+
+    def requestDistance(self, addrs=None, timeout=None):
+        return self.broadcast("requestDistance", addrs=addrs, timeout=timeout)
+
+    def requestAmbientLight(self, addrs=None, timeout=None):
+        return self.broadcast("requestAmbientLight", addrs=addrs, timeout=timeout)
+
+    def disconnect(self, addrs=None, timeout=None):
+        """
+        Disconnect the targeted Skoobots and remove them from the fleet
+        """
+        result = self.broadcast("disconnect", addrs=addrs, timeout=timeout)
+        for addr in result.values:
+            del self.controllers[addr]
+            del self.locks[addr]
+            self.workers.pop(addr).shutdown(wait=False)
+        return result
+
+    def close(self):
+        """
+        Disconnect all Skoobots and stop their workers
+        """
+        self.disconnect()
+        for worker in self.workers.values():
+            worker.shutdown(wait=False)
@@ -0,0 +1,186 @@
+"""
+Persistent GATT attribute cache
+
+Discovering a peripheral's services and characteristics takes many
+round trips, so the layout found on the first connection to each
+address is saved to disk and reused on later connections.
+
+Each entry records the services and characteristics with their handles,
+and a fingerprint read from the peripheral when the layout was
+discovered: the value of the GATT Database Hash characteristic (0x2B2A)
+if the peripheral has one, and otherwise the declaration of the
+characteristic with the highest handle. Adding or removing any attribute
+before that characteristic moves its declaration. A cached layout is used
+only if the fingerprint still matches, which costs one read instead of a
+full discovery. If an operation on a cached handle fails anyway, the
+caller should forgetLayout() and rediscover.
+"""
+
+import json
+import os
+import threading
+import time
+
+from skoopy import metrics
+
+from skoopy.storage import writeJsonAtomic
+
+DATABASE_HASH_UUID = "00002b2a-0000-1000-8000-00805f9b34fb"
+
+def defaultCachePath():
+    """
+    Return the path of the user's GATT cache file
+    """
+    # Imported here to avoid loading the registry with the transport
+    from skoopy.registry import defaultRegistryPath
+    return defaultRegistryPath("-gatt.json")
+
+def describeLayout(services, characteristics):
+    """
+    Build a cache entry from discovered services and characteristics.
+    Each characteristic is assigned to the service whose handle range
+    contains it.
+    """
+    layout = []
+    for service in services:
+        layout.append({
+            "uuid" : str(service.uuid).lower(),
+            "start" : service.hndStart,
+            "end" : service.hndEnd,
+            "characteristics" : [ {
+                    "uuid" : str(charac.uuid).lower(),
+                    "handle" : charac.handle,
+                    "valHandle" : charac.valHandle,
+                    "properties" : charac.properties,
+                } for charac in characteristics
+                if service.hndStart <= charac.handle <= service.hndEnd ],
+        })
+    entry = { "services" : layout, "fingerprint" : None, "fingerprintHandle" : None }
+    if len(characteristics) > 0:
+        # The declaration of the last characteristic
+        entry["fingerprintHandle"] = max(charac.handle for charac in characteristics)
+    for charac in characteristics:
+        if str(charac.uuid).lower() == DATABASE_HASH_UUID:
+            entry["fingerprintHandle"] = charac.valHandle
+    return entry
+
+class LayoutCacheMixin:
+    """
+    GATT layout caching shared by the transports.
+
+    The transport provides the attributes gattCache, services,
+    layoutCached and linkErrors, and the methods:
+        layoutAddr() - address of the connected peripheral, or None
+        readAttribute(handle) - read the value of any attribute as bytes
+        discoverLayout() - discover the services, calling cacheLayout()
+        servicesFromLayout(entry) - build services from a cache entry
+    """
+
+    def loadLayout(self):
+        """
+        Return the services of the connected peripheral, with their
+        characteristics. The layout is taken from the GATT cache if
+        its fingerprint still matches, and discovered otherwise.
+        """
+        if self.services == None:
+            start = time.perf_counter()
+            entry = None
+            if self.gattCache:
+                entry = self.gattCache.get(self.layoutAddr())
+            if entry != None and self.fingerprintMatches(entry):
+                self.services = self.servicesFromLayout(entry)
+                self.layoutCached = True
+            else:
+                self.services = self.discoverLayout()
+                self.layoutCached = False
+            if metrics.enabled:
+                metrics.observe("skoopy_transport_discover_seconds", time.perf_counter() - start,
+                    source="cache" if self.layoutCached else "peripheral")
+        return self.services
+
+    def cacheLayout(self, services, characteristics):
+        """
+        Save a discovered layout and its fingerprint in the GATT cache
+        """
+        if self.gattCache:
+            entry = describeLayout(services, characteristics)
+            if entry["fingerprintHandle"] != None:
+                entry["fingerprint"] = self.readAttribute(entry["fingerprintHandle"]).hex()
+            self.gattCache.put(self.layoutAddr(), entry)
+
+    def fingerprintMatches(self, entry):
+        handle = entry.get("fingerprintHandle")
+        if handle == None:
+            return False
+        try:
+            fingerprint = self.readAttribute(handle)
+        except self.linkErrors:
+            return False
+        return fingerprint.hex() == entry["fingerprint"]
+
+    def forgetLayout(self):
+        """
+        Drop the layout of the connected peripheral from the GATT cache,
+        so that it is rediscovered. Call this when an operation on a
+        cached handle fails.
+        """
+        addr = self.layoutAddr()
+        if self.gattCache and addr != None:
+            self.gattCache.forget(addr)
+        self.services = None
+        self.layoutCached = False
+
+class GattCache:
+    """
+    Address to GATT layout mapping, saved as JSON.
+
+    The cache may be shared by several transports, e.g. those
+    created with spawn(), and is safe to use from several threads.
+    """
+
+    def __init__(self, path=None):
+        self.path = path
+        self.entries = None
+        self.lock = threading.Lock()
+
+    def load(self):
+        if self.path == None:
+            self.path = defaultCachePath()
+        self.entries = {}
+        if os.path.isfile(self.path):
+            try:
+                with open(self.path, "r") as cacheFile:
+                    self.entries = json.load(cacheFile)
+            except ValueError:
+                # A corrupt cache only costs a rediscovery
+                self.entries = {}
+
+    def get(self, addr):
+        """
+        Return the cached entry for addr, or None
+        """
+        with self.lock:
+            if self.entries == None:
+                self.load()
+            return self.entries.get(addr.lower())
+
+    def put(self, addr, entry):
+        with self.lock:
+            if self.entries == None:
+                self.load()
+            self.entries[addr.lower()] = entry
+            self.save()
+
+    def forget(self, addr):
+        with self.lock:
+            if self.entries == None:
+                self.load()
+            if self.entries.pop(addr.lower(), None) != None:
+                self.save()
+
+    def save(self):
+        try:
+            writeJsonAtomic(self.path, self.entries)
+        except OSError:
+            # The cache is an optimisation; failing to save it is not an error
+            pass
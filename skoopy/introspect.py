@@ -0,0 +1,171 @@
+"""
+Bulk device introspection
+
+inspectDevices() connects to a list of scanned devices concurrently and
+returns a DeviceRecord for each, describing its advertising data,
+services and characteristics. formatText() and formatJson() render the
+records for display.
+"""
+
+import collections
+import json
+import queue
+import threading
+import time
+
+CharacteristicRecord = collections.namedtuple("CharacteristicRecord",
+    ["uuid", "handle", "properties"])
+
+ServiceRecord = collections.namedtuple("ServiceRecord",
+    ["uuid", "characteristics"])
+
+# services is None if the device was not connected to.
+# error is None, or a message if the device could not be inspected.
+# duration is the time in seconds spent connected and discovering.
+DeviceRecord = collections.namedtuple("DeviceRecord",
+    ["addr", "addrType", "connectable", "rssi", "scanData", "services", "error", "duration"])
+
+def characteristicRecord(rawCharacteristic):
+    return CharacteristicRecord(str(rawCharacteristic.uuid), rawCharacteristic.getHandle(),
+        rawCharacteristic.propertiesToString())
+
+def serviceRecord(transport, rawService):
+    return ServiceRecord(str(rawService.uuid), [ characteristicRecord(rawCharacteristic)
+        for rawCharacteristic in transport.getRawCharacteristicsForService(rawService) ])
+
+def scanRecord(rawDevice, services=None, error=None, duration=0.0):
+    return DeviceRecord(rawDevice.addr, rawDevice.addrType, rawDevice.connectable,
+        getattr(rawDevice, "rssi", None), [ tuple(scanRow) for scanRow in rawDevice.getScanData() ],
+        services, error, duration)
+
+def inspectDevice(transport, rawDevice):
+    """
+    Connect to a scanned device if it is connectable, record its
+    services and disconnect. Errors are reported in the record.
+    """
+    if not rawDevice.connectable:
+        return scanRecord(rawDevice)
+    start = time.monotonic()
+    try:
+        transport.connect(rawDevice.addr, rawDevice.addrType)
+        try:
+            services = [ serviceRecord(transport, rawService) for rawService in transport.getRawServices() ]
+        finally:
+            transport.disconnect()
+    except Exception as exc:
+        return scanRecord(rawDevice, error="{0:s}: {1!s}".format(type(exc).__name__, exc),
+            duration=time.monotonic() - start)
+    return scanRecord(rawDevice, services, duration=time.monotonic() - start)
+
+def inspectDevices(transport, rawDevices, maxWorkers=4, timeout=10.0):
+    """
+    Inspect several scanned devices concurrently, each on its own
+    transport created with transport.spawn().
+
+    At most maxWorkers devices are inspected at once. A device that
+    takes longer than timeout seconds is reported with an error, but its
+    slot is only given to the next device when the abandoned attempt
+    finishes and closes its connection.
+
+    Returns the DeviceRecords in the same order as rawDevices.
+    """
+    rawDevices = list(rawDevices)
+    records = [None] * len(rawDevices)
+    pending = collections.deque(range(len(rawDevices)))
+    # Index of device to deadline, for inspections in progress
+    running = {}
+    # Indexes of timed out inspections whose threads are still running
+    abandoned = set()
+    finished = queue.Queue()
+
+    def worker(index):
+        finished.put((index, inspectDevice(transport.spawn(), rawDevices[index])))
+
+    while len(pending) > 0 or len(running) > 0:
+        while len(pending) > 0 and len(running) + len(abandoned) < maxWorkers:
+            index = pending.popleft()
+            if not rawDevices[index].connectable:
+                records[index] = scanRecord(rawDevices[index])
+                continue
+            running[index] = time.monotonic() + timeout
+            threading.Thread(target=worker, args=(index,), daemon=True).start()
+        if len(running) == 0 and (len(pending) == 0 or len(abandoned) == 0):
+            continue
+
+        try:
+            wait = None
+            if len(running) > 0:
+                wait = max(0.0, min(running.values()) - time.monotonic())
+            index, record = finished.get(timeout=wait)
+            # Ignore results from attempts that have already timed out
+            abandoned.discard(index)
+            if index in running:
+                del running[index]
+                records[index] = record
+        except queue.Empty:
+            now = time.monotonic()
+            for index, deadline in list(running.items()):
+                if deadline <= now:
+                    del running[index]
+                    abandoned.add(index)
+                    records[index] = scanRecord(rawDevices[index],
+                        error="Timed out after {0:.1f}s".format(timeout), duration=timeout)
+    return records
+
+def deviceLines(record):
+    lines = [
+        "Address: {0:s}".format(record.addr),
+        "Address type: {0:s}".format(record.addrType),
+        "Connections?: {0:s}".format("yes" if record.connectable else "no"),
+        "Scan Data:",
+    ]
+    for scanRow in record.scanData:
+        lines.append("    {0:d}\t| {1:s}\t| {2:s}".format(*scanRow))
+    if record.error != None:
+        lines.append("Error: {0:s}".format(record.error))
+    if record.services != None:
+        lines.append("Services:")
+        for service in record.services:
+            lines.extend(serviceLines(service))
+    return lines
+
+def serviceLines(service):
+    lines = [
+        "    UUID: {0:s}".format(service.uuid),
+        "    Characteristics:",
+    ]
+    for characteristic in service.characteristics:
+        lines.extend(characteristicLines(characteristic))
+    return lines
+
+def characteristicLines(characteristic):
+    return [
+        "    -   UUID: {0:s}".format(characteristic.uuid),
+        "    -   Handle: {0:d} (0x{0:x})".format(characteristic.handle),
+        "    -   Properties: {0:s}".format(characteristic.properties),
+    ]
+
+def formatText(records):
+    """
+    Render DeviceRecords as indented text, one block per device
+    """
+    return "".join(line + "\n" for record in records for line in deviceLines(record))
+
+def recordDict(record):
+    """
+    Convert a DeviceRecord to plain dictionaries and lists
+    """
+    recordDict = record._asdict()
+    recordDict["scanData"] = [ list(scanRow) for scanRow in record.scanData ]
+    if record.services != None:
+        recordDict["services"] = [ {
+                "uuid" : service.uuid,
+                "characteristics" : [ characteristic._asdict() for characteristic in service.characteristics ],
+            } for service in record.services ]
+    return recordDict
+
+def formatJson(records, indent=4):
+    """
+    Render DeviceRecords as a JSON list
+    """
+    return json.dumps([ recordDict(record) for record in records ], indent=indent)
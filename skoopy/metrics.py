@@ -0,0 +1,203 @@
+"""
+Instrumentation for skoopy
+
+The transport, controller and command parser time their BLE operations,
+commands and plan steps into counters and latency histograms held in a
+MetricsRegistry. Instrumentation is off by default; instrumented code
+checks the module-level flag "enabled" before doing any work, so the
+cost when disabled is one attribute lookup per operation.
+
+    from skoopy import metrics
+    metrics.enable()
+    ...
+    print(metrics.registry.formatPrometheus())
+
+Setting the environment variable SKOOPY_METRICS to 1 enables
+instrumentation on import. Hooks added with addHook() receive every
+observation, e.g. to forward them to another monitoring system.
+"""
+
+import bisect
+import os
+import threading
+
+# Upper bounds in seconds of the histogram buckets
+DEFAULT_BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025,
+    0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+class Counter:
+    """
+    A count that only goes up
+    """
+    def __init__(self):
+        self.value = 0
+        self.lock = threading.Lock()
+
+    def increment(self, amount=1):
+        with self.lock:
+            self.value += amount
+
+class Histogram:
+    """
+    Counts of observations falling into fixed buckets, with their sum
+    """
+    def __init__(self, buckets=DEFAULT_BUCKETS):
+        self.buckets = tuple(buckets)
+        # One count per bucket plus one for values above the last bound
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.count = 0
+        self.sum = 0.0
+        self.lock = threading.Lock()
+
+    def observe(self, value):
+        index = bisect.bisect_left(self.buckets, value)
+        with self.lock:
+            self.counts[index] += 1
+            self.count += 1
+            self.sum += value
+
+    def cumulativeCounts(self):
+        """
+        Return (upper bound, count of observations <= bound) pairs,
+        ending with the "+Inf" bucket
+        """
+        total = 0
+        pairs = []
+        for bound, count in zip(self.buckets + ("+Inf",), self.counts):
+            total += count
+            pairs.append((bound, total))
+        return pairs
+
+def labelKey(labels):
+    return tuple(sorted(labels.items()))
+
+def formatLabels(labelPairs):
+    if len(labelPairs) == 0:
+        return ""
+    return "{" + ",".join('{0:s}="{1:s}"'.format(name, str(value).replace('"', '\\"'))
+        for name, value in labelPairs) + "}"
+
+class MetricsRegistry:
+    """
+    Named counters and histograms. Each name may have several label
+    sets, e.g. one histogram per command.
+    """
+
+    def __init__(self):
+        self.counters = {}
+        self.histograms = {}
+        self.hooks = []
+        self.lock = threading.Lock()
+
+    def counter(self, name, **labels):
+        key = (name, labelKey(labels))
+        counter = self.counters.get(key)
+        if counter == None:
+            with self.lock:
+                counter = self.counters.setdefault(key, Counter())
+        return counter
+
+    def histogram(self, name, **labels):
+        key = (name, labelKey(labels))
+        histogram = self.histograms.get(key)
+        if histogram == None:
+            with self.lock:
+                histogram = self.histograms.setdefault(key, Histogram())
+        return histogram
+
+    def reset(self):
+        with self.lock:
+            self.counters = {}
+            self.histograms = {}
+
+    def snapshot(self):
+        """
+        Return the current values as a dictionary suitable for JSON
+        """
+        counters = {}
+        for (name, labelPairs), counter in sorted(self.counters.items()):
+            counters.setdefault(name, []).append({ "labels" : dict(labelPairs), "value" : counter.value })
+        histograms = {}
+        for (name, labelPairs), histogram in sorted(self.histograms.items()):
+            histograms.setdefault(name, []).append({
+                "labels" : dict(labelPairs),
+                "count" : histogram.count,
+                "sum" : histogram.sum,
+                "mean" : histogram.sum / histogram.count if histogram.count > 0 else 0.0,
+                "buckets" : [ [str(bound), count] for bound, count in histogram.cumulativeCounts() ],
+            })
+        return { "counters" : counters, "histograms" : histograms }
+
+    def formatJson(self):
+        import json
+        return json.dumps(self.snapshot(), indent=4, sort_keys=True)
+
+    def formatPrometheus(self):
+        """
+        Return the metrics in the Prometheus text exposition format
+        """
+        lines = []
+        lastName = None
+        for (name, labelPairs), counter in sorted(self.counters.items()):
+            if name != lastName:
+                lines.append("# TYPE {0:s} counter".format(name))
+                lastName = name
+            lines.append("{0:s}{1:s} {2:d}".format(name, formatLabels(labelPairs), counter.value))
+        for (name, labelPairs), histogram in sorted(self.histograms.items()):
+            if name != lastName:
+                lines.append("# TYPE {0:s} histogram".format(name))
+                lastName = name
+            for bound, count in histogram.cumulativeCounts():
+                bucketLabels = labelPairs + (("le", bound),)
+                lines.append("{0:s}_bucket{1:s} {2:d}".format(name, formatLabels(bucketLabels), count))
+            lines.append("{0:s}_sum{1:s} {2:.9g}".format(name, formatLabels(labelPairs), histogram.sum))
+            lines.append("{0:s}_count{1:s} {2:d}".format(name, formatLabels(labelPairs), histogram.count))
+        return "".join(line + "\n" for line in lines)
+
+    def write(self, path):
+        """
+        Write the metrics to path atomically: as JSON if it ends in
+        .json, otherwise in Prometheus text format (for the node
+        exporter's textfile collector)
+        """
+        from skoopy.storage import writeJsonAtomic
+
+        if path.lower().endswith(".json"):
+            writeJsonAtomic(path, self.snapshot())
+            return
+        tempPath = path + ".tmp"
+        with open(tempPath, "w") as metricsFile:
+            metricsFile.write(self.formatPrometheus())
+        os.replace(tempPath, path)
+
+# The registry that skoopy's own instrumentation records into
+registry = MetricsRegistry()
+
+enabled = os.environ.get("SKOOPY_METRICS", "") not in ("", "0")
+
+def enable(enable=True):
+    global enabled
+    enabled = enable
+
+def disable():
+    enable(False)
+
+def addHook(hook):
+    """
+    Call hook(kind, name, labels, value) for every observation, where
+    kind is "counter" or "histogram"
+    """
+    registry.hooks.append(hook)
+
+def removeHook(hook):
+    registry.hooks.remove(hook)
+
+def increment(name, amount=1, **labels):
+    registry.counter(name, **labels).increment(amount)
+    for hook in registry.hooks:
+        hook("counter", name, labels, amount)
+
+def observe(name, value, **labels):
+    registry.histogram(name, **labels).observe(value)
+    for hook in registry.hooks:
+        hook("histogram", name, labels, value)
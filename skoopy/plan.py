@@ -0,0 +1,90 @@
+"""
+Compiled command plans
+
+A CommandPlan is the result of compiling a skoocontrol command list
+with CommandParser.compile(). Every command has been looked up, bound
+to its method and had its arguments parsed and validated, so executing
+the plan does no parsing and cannot fail half way through because of
+a mistake in the script.
+"""
+
+import collections
+import time
+
+from skoopy import metrics
+
+# One step of a plan:
+#   position - index of the command word in the word list
+#   line - line number in the script file, or None
+#   command - the command word
+#   method - bound method to call
+#   args - list of parsed arguments, or None if the method takes none
+PlanStep = collections.namedtuple("PlanStep", ["position", "line", "command", "method", "args"])
+
+class CommandError(RuntimeError):
+    """
+    Raised when a command list fails to compile.
+    position is the index of the offending word and line is its
+    line number if the commands came from a script file.
+    """
+    def __init__(self, message, position, line=None):
+        if line != None:
+            location = "line {0:d}, word {1:d}".format(line, position)
+        else:
+            location = "word {0:d}".format(position)
+        RuntimeError.__init__(self, "{0:s} (at {1:s})".format(message, location))
+        self.position = position
+        self.line = line
+
+class PlanLoop:
+    """
+    A block of steps repeated count times, or forever if count is None
+    """
+    def __init__(self, count, steps):
+        self.count = count
+        self.steps = steps
+
+    def execute(self):
+        if self.count == None:
+            while True:
+                executeSteps(self.steps)
+        else:
+            for i in range(self.count):
+                executeSteps(self.steps)
+
+def executeSteps(steps):
+    if metrics.enabled:
+        executeStepsTimed(steps)
+        return
+    for step in steps:
+        if step.args == None:
+            step.method()
+        else:
+            step.method(step.args)
+
+def executeStepsTimed(steps):
+    for step in steps:
+        start = time.perf_counter()
+        if step.args == None:
+            step.method()
+        else:
+            step.method(step.args)
+        metrics.observe("skoopy_parser_step_seconds", time.perf_counter() - start, command=step.command)
+
+class CommandPlan:
+    """
+    A compiled, validated list of commands. Plans can be kept and
+    executed any number of times.
+    """
+    def __init__(self, steps, words):
+        self.steps = steps
+        self.words = words
+
+    def execute(self):
+        executeSteps(self.steps)
+
+    def __iter__(self):
+        return iter(self.steps)
+
+    def __len__(self):
+        return len(self.steps)
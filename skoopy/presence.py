@@ -0,0 +1,134 @@
+"""
+Background Skoobot presence tracking
+
+A PresenceTracker scans continuously on a background thread and keeps
+a table of every Skoobot heard, with when it was last seen, its
+smoothed signal strength, address type and whether it accepts
+connections. Entries older than the TTL are treated as absent, so
+callers can skip robots that are switched off or out of range without
+waiting for a connection to time out.
+"""
+
+import collections
+import threading
+import time
+
+from skoopy.scanner import isSkoobot
+
+# One row of the presence table. lastSeen is from time.monotonic()
+PresenceEntry = collections.namedtuple("PresenceEntry",
+    ["addr", "lastSeen", "rssi", "addrType", "connectable"])
+
+class PresenceTracker:
+    """
+    Tracks which Skoobots are advertising.
+
+    The tracker needs a transport of its own for scanning. ttl is the
+    time in seconds after which a silent Skoobot is considered absent,
+    and smoothing is the weight given to each new RSSI reading.
+    """
+
+    def __init__(self, transport=None, ttl=10.0, smoothing=0.3, scanWindow=1.0):
+        if transport == None:
+            from skoopy.transport import TransportBluepy
+            transport = TransportBluepy()
+        self.transport = transport
+        self.ttl = ttl
+        self.smoothing = smoothing
+        self.scanWindow = scanWindow
+        self.table = {}
+        self.lock = threading.Lock()
+        self.running = False
+        self.thread = None
+        self.error = None
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, excType, excValue, traceback):
+        self.stop()
+
+    def start(self):
+        if not self.running:
+            self.running = True
+            self.error = None
+            self.thread = threading.Thread(target=self.run, name="skoopy-presence", daemon=True)
+            self.thread.start()
+        return self
+
+    def stop(self):
+        self.running = False
+        if self.thread != None:
+            self.thread.join()
+            self.thread = None
+
+    def run(self):
+        try:
+            while self.running:
+                # Scan in windows so that stop() is noticed promptly
+                devices = self.transport.discoverRawDevices(self.scanWindow)
+                try:
+                    for device in devices:
+                        if not self.running:
+                            break
+                        if isSkoobot(device):
+                            self.update(device)
+                finally:
+                    devices.close()
+        except Exception as exc:
+            self.error = exc
+            self.running = False
+
+    def isScanning(self):
+        """
+        Return True if the scan thread is running and has not failed.
+        Otherwise the table says nothing about which Skoobots are present.
+        """
+        return self.running and self.error == None
+
+    def update(self, device, now=None):
+        """
+        Record a sighting of a Skoobot scan entry
+        """
+        if now == None:
+            now = time.monotonic()
+        with self.lock:
+            entry = self.table.get(device.addr)
+            rssi = device.rssi
+            if entry != None and not self.expired(entry, now):
+                rssi = entry.rssi + self.smoothing * (device.rssi - entry.rssi)
+            self.table[device.addr] = PresenceEntry(device.addr, now, rssi,
+                device.addrType, device.connectable)
+
+    def expired(self, entry, now):
+        return now - entry.lastSeen > self.ttl
+
+    def get(self, addr):
+        """
+        Return the PresenceEntry for addr, or None if it is absent
+        """
+        entry = self.table.get(addr)
+        if entry == None or self.expired(entry, time.monotonic()):
+            return None
+        return entry
+
+    def isPresent(self, addr, connectable=True):
+        """
+        Return True if addr has been heard within the TTL and,
+        if connectable is True, accepts connections
+        """
+        entry = self.get(addr)
+        return entry != None and (entry.connectable or not connectable)
+
+    def entries(self):
+        """
+        Return the present Skoobots, strongest signal first.
+        Expired entries are removed from the table.
+        """
+        now = time.monotonic()
+        with self.lock:
+            for addr in [ addr for addr, entry in self.table.items() if self.expired(entry, now) ]:
+                del self.table[addr]
+            present = list(self.table.values())
+        present.sort(key=lambda entry: entry.rssi, reverse=True)
+        return present
@@ -0,0 +1,53 @@
+"""
+Reconnection policy for SkoobotController
+
+When automatic reconnection is enabled, a BLE operation that fails
+because the link was lost makes the controller reconnect, with
+exponential backoff and jitter between attempts, and then retry the
+operation if it is safe to do so.
+"""
+
+import random
+
+# What to do with a non-idempotent motion command (a turn) whose write
+# failed when the link was lost. The write may or may not have reached
+# the Skoobot before the link went down.
+MOTION_RETRY = "retry"
+MOTION_SKIP = "skip"
+MOTION_RAISE = "raise"
+
+class ReconnectPolicy:
+    """
+    Settings for automatic reconnection.
+
+    Up to maxAttempts connection attempts are made. The delay before
+    attempt n (counting from 0) is initialDelay * multiplier ** n,
+    capped at maxDelay and reduced by a random fraction of up to jitter
+    so that many clients do not retry in step. maxRetries limits how
+    often a single operation is retried after reconnecting.
+
+    motionPolicy is MOTION_RETRY to send a lost turn command again,
+    MOTION_SKIP to drop it, or MOTION_RAISE to reconnect and then
+    raise the original error.
+    """
+
+    def __init__(self, maxAttempts=6, initialDelay=0.05, maxDelay=2.0, multiplier=2.0,
+            jitter=0.5, maxRetries=3, motionPolicy=MOTION_RAISE, seed=None):
+        if motionPolicy not in (MOTION_RETRY, MOTION_SKIP, MOTION_RAISE):
+            raise ValueError("Unknown motion policy {0:s}".format(str(motionPolicy)))
+        self.maxAttempts = maxAttempts
+        self.initialDelay = initialDelay
+        self.maxDelay = maxDelay
+        self.multiplier = multiplier
+        self.jitter = jitter
+        self.maxRetries = maxRetries
+        self.motionPolicy = motionPolicy
+        self.random = random.Random(seed)
+
+    def delays(self):
+        """
+        Generator of the delays in seconds before each attempt
+        """
+        for attempt in range(self.maxAttempts):
+            delay = min(self.maxDelay, self.initialDelay * self.multiplier ** attempt)
+            yield delay * (1.0 - self.jitter * self.random.random())
@@ -3,39 +3,64 @@ Skoobot registry management
 """
 
 import os.path
-import json
 import random
 import platform
 
+from skoopy.storage import storageForPath
+
+def defaultRegistryPath(suffix):
+    """
+    Return the path of the user's registry file with the given suffix
+    """
+    if platform.system() == "Windows":
+        registryPath = "~/skoobot" + suffix
+    else:
+        # We need to use the logname instead of the user name
+        # in case this is run from sudo
+        logname = os.getlogin()
+        registryPath = "~{0:s}/.skoobots{1:s}".format(logname, suffix)
+    return os.path.expanduser(registryPath)
+
 class SkoobotRegistry:
     """
-    A register of Skoobots, backed by a JSON file
+    A register of Skoobots, backed by a JSON file or SQLite database
     """
-    def __init__(self, registryPath=None, debug=False):
+    def __init__(self, registryPath=None, debug=False, storage=None):
         """
         Construct a Skoobot registry and load it from its file.
         If the file does not yet exist, an empty registry will be created.
         A file will not be created until the save() method is called.
+
+        Paths ending in .db, .sqlite or .sqlite3 use SQLite storage.
+        The default is the user's SQLite registry if it exists, and the
+        JSON registry otherwise. storage overrides the backend chosen
+        from the path.
         """
         self.debug = debug
         if self.debug:
             print("SkoobotRegistry: debug on")
         if registryPath == None:
-            if platform.system() == "Windows":
-                registryPath = "~/skoobot.json"
-            else:
-                # We need to use the logname instead of the user name
-                # in case this is run from sudo
-                logname = os.getlogin()
-                registryPath = "~{0:s}/.skoobots.json".format(logname)
+            registryPath = defaultRegistryPath(".db")
+            if not os.path.isfile(registryPath):
+                registryPath = defaultRegistryPath(".json")
         self.registryPath = os.path.expanduser(registryPath)
+        if storage == None:
+            storage = storageForPath(self.registryPath)
+        self.storage = storage
         self.valid = True
-        if os.path.isfile(self.registryPath):
+        # Count of names generated with a numeric suffix
+        self.suffixCount = 0
+        # Addresses changed since the last load or save
+        self.changed = set()
+        # True if the default has been set since the last load or save
+        self.defaultChanged = False
+        if self.storage.exists():
             self.load()
         else:
             if self.debug:
                 print("No readable file")
             self.registry = {}
+            self.nameIndex = {}
             self.default = None
 
         self.skoobotNames = set((
@@ -73,11 +98,7 @@ class SkoobotRegistry:
         with 0 or 1 elements, unless two Skoobots have been
         given the same name.
         """
-        skoobotList = []
-        for addr, skooName in self.registry.items():
-            if skooName == name:
-                skoobotList.append((addr, skooName))
-        return skoobotList
+        return [ (addr, name) for addr in self.nameIndex.get(name, ()) ]
 
     def getSkoobotsByAddress(self, address):
         """
@@ -114,7 +135,49 @@ class SkoobotRegistry:
             if name == None:
                 name = self.generateName()
 
+        self.setName(addr, name)
+
+    def addSkoobots(self, skoobots, replace=True):
+        """
+        Add several Skoobots to the registry in one pass.
+        skoobots is an iterable of addresses or (address, name) tuples,
+        where name may be None. Validation is as for addSkoobot().
+        Returns a list of the (address, name) tuples added.
+        """
+        added = []
+        for skoobot in skoobots:
+            if isinstance(skoobot, tuple):
+                addr, name = skoobot
+            else:
+                addr, name = skoobot, None
+            self.addSkoobot(addr, name, replace)
+            added.append((addr, self.registry[addr]))
+        return added
+
+    def setName(self, addr, name):
+        """
+        Record the name of addr, keeping the name index up to date
+        """
+        oldName = self.registry.get(addr)
+        if oldName == name:
+            return
+        if oldName != None:
+            addrs = self.nameIndex[oldName]
+            del addrs[addr]
+            if len(addrs) == 0:
+                del self.nameIndex[oldName]
         self.registry[addr] = name
+        self.changed.add(addr)
+        # Dictionaries are used as insertion-ordered sets
+        self.nameIndex.setdefault(name, {})[addr] = None
+
+    def buildIndex(self):
+        """
+        Rebuild the name to addresses index from self.registry
+        """
+        self.nameIndex = {}
+        for addr, name in self.registry.items():
+            self.nameIndex.setdefault(name, {})[addr] = None
 
     def setDefault(self, nameAddr):
         """
@@ -126,8 +189,10 @@ class SkoobotRegistry:
             raise TypeError("nameAddr is not a String or None")
         if nameAddr in self.registry:
             nameAddr = self.registry[nameAddr]
-        if nameAddr != None and not nameAddr in self.registry.values():
+        if nameAddr != None and not nameAddr in self.nameIndex:
             raise ValueError("Default value does not match a Skoobot in the registry")
+        if nameAddr != self.default:
+            self.defaultChanged = True
         self.default = nameAddr
 
     def getDefaultName(self):
@@ -148,18 +213,21 @@ class SkoobotRegistry:
         if self.debug:
             print("Loading")
         try:
-            with open(self.registryPath, "r") as registryFile:
-                registryDict = json.load(registryFile)
-            self.registry = registryDict.get("skoobots", {})
+            self.registry, newDefault = self.storage.load()
+            self.buildIndex()
+            self.changed = set()
+            self.defaultChanged = False
             self.default = None
-            newDefault = registryDict.get("default", None)
-            if newDefault in self.registry.values():
+            if newDefault in self.nameIndex:
                 self.default = newDefault
             self.valid = True
         except:
             if self.debug:
                print("load(): exception")
             self.registry = {}
+            self.nameIndex = {}
+            self.changed = set()
+            self.defaultChanged = False
             self.default = None
             self.valid = False
             raise
@@ -170,17 +238,26 @@ class SkoobotRegistry:
         If the registry is invalid, do nothing
         """
         if self.valid:
-            registryDict = { "default" : self.default, "skoobots" : self.registry }
-            with open(self.registryPath, "w") as registryFile:
-                json.dump(registryDict, registryFile, sort_keys=True, indent=4)
+            self.storage.save(self.registry, self.default, self.changed, self.defaultChanged)
+            self.changed = set()
+            self.defaultChanged = False
 
     def generateName(self):
         """
-        Generate a Skoobot name that does not exist in the registry
+        Generate a Skoobot name that does not exist in the registry.
+        Names are chosen from self.skoobotNames until they run out,
+        then numeric suffixes are added (e.g. "alice2").
         """
-        namesUsed = set(self.registry.values())
-        namesAvailable = self.skoobotNames - namesUsed
-        if len(namesAvailable) == 0:
+        namesAvailable = [ name for name in self.skoobotNames if name not in self.nameIndex ]
+        if len(namesAvailable) > 0:
+            return random.choice(sorted(namesAvailable))
+
+        baseNames = sorted(self.skoobotNames)
+        if len(baseNames) == 0:
             raise KeyError("Run out of skoobot names")
-        return random.sample(namesAvailable, 1)[0]
-        
+        while True:
+            suffix, index = divmod(self.suffixCount, len(baseNames))
+            name = "{0:s}{1:d}".format(baseNames[index], suffix + 2)
+            if name not in self.nameIndex:
+                return name
+            self.suffixCount += 1
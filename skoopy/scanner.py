@@ -2,25 +2,80 @@
 
 from skoopy.transport import TransportBluepy
 from skoopy.registry import SkoobotRegistry
+import argparse
 import os, shutil
 
+def isSkoobot(device):
+    """
+    Return True if the scan entry has the Skoobot complete local name
+    """
+    for scanItem in device.getScanData():
+        if scanItem[0] == 9 and scanItem[2] == "Skoobot":
+            return True
+    return False
+
+def discover(transport, timeout=1.0, count=None, addr=None, name=None, registry=None):
+    """
+    Generator yielding each Skoobot's scan entry as soon as it is first
+    heard, until timeout seconds have passed.
+
+    Scanning stops early once count Skoobots have been found, or once
+    the Skoobot with address addr, or any Skoobot called name in the
+    registry, has been found.
+    """
+    targets = set()
+    if addr != None:
+        targets.add(addr.lower())
+    if name != None:
+        if registry == None:
+            registry = SkoobotRegistry()
+        targets.update(skooAddr.lower() for skooAddr, skooName in registry.getSkoobotsByName(name))
+        if len(targets) == 0 and addr == None:
+            raise ValueError("No Skoobot with name {0:s} found".format(name))
+
+    found = set()
+    devices = transport.discoverRawDevices(timeout)
+    try:
+        for device in devices:
+            if device.addr in found or not isSkoobot(device):
+                continue
+            found.add(device.addr)
+            yield device
+            if count != None and len(found) >= count:
+                break
+            if device.addr.lower() in targets:
+                break
+    finally:
+        devices.close()
+
+def findSkoobots(transport, timeout=1.0, count=None):
+    """
+    Scan for devices using the given transport and return
+    the ones that advertise themselves as Skoobots.
+    """
+    return list(discover(transport, timeout, count))
+
+def chownToUser(path):
+    """
+    Give a file written by the scanner, which runs as root, to the
+    logged in user
+    """
+    shutil.chown(path, os.getlogin())
+
 def scan():
+    argParser = argparse.ArgumentParser(description="Scan for Skoobots and add them to the registry")
+    argParser.add_argument("--count", "-c", type=int, help="Stop after finding this many Skoobots")
+    argParser.add_argument("--timeout", "-t", type=float, default=1.0, help="Maximum scan time in seconds")
+    argParser.add_argument("--inspect", "-i", action="store_true",
+        help="Connect to the Skoobots found and list their services and characteristics")
+    argParser.add_argument("--json", "-j", action="store_true", help="Print the inspection results as JSON")
+    args = argParser.parse_args()
+
     transport = TransportBluepy()
     registry = SkoobotRegistry()
 
-    rawDevices = transport.findRawDevices()
-    skoobots = []
-    for device in rawDevices:
-        scanList = device.getScanData()
-        for scanItem in scanList:
-            if scanItem[0] == 9 and scanItem[2] == "Skoobot":
-                skoobots.append(device)
-
-    for skoobot in skoobots:
-        # print(transport.rawDeviceInfoStr(skoobot))
-        addr = skoobot.addr
-        registry.addSkoobot(addr)
-        name = registry.getSkoobotsByAddress(addr)[0][1]
+    skoobots = findSkoobots(transport, args.timeout, args.count)
+    for addr, name in registry.addSkoobots([ skoobot.addr for skoobot in skoobots ]):
         if registry.getDefaultName() == None:
             registry.setDefault(name)
         defaultText = " (default)" if registry.getDefaultName() == name else ""
@@ -28,7 +83,20 @@ def scan():
         print(msg.format(addr, name, defaultText))
     print("Saving to list of Skoobots to registry {0:s}".format(registry.registryPath))
     registry.save()
-    shutil.chown(registry.registryPath, os.getlogin())
+    chownToUser(registry.registryPath)
+
+    if args.inspect or args.json:
+        from skoopy import introspect
+
+        records = introspect.inspectDevices(transport, skoobots)
+        # Inspection fills the GATT cache, which is written as root
+        cachePath = transport.gattCache.path if transport.gattCache else None
+        if cachePath != None and os.path.isfile(cachePath):
+            chownToUser(cachePath)
+        if args.json:
+            print(introspect.formatJson(records))
+        else:
+            print(introspect.formatText(records), end="")
 
 if __name__ == "__main__":
     scan()
@@ -0,0 +1,109 @@
+"""
+Drift-free timed execution of command plans
+
+In a TimedScheduler run, "wait" steps don't sleep. Instead they move a
+deadline along a monotonic timeline, and each command is issued when
+its deadline arrives. Time spent on BLE I/O therefore comes out of the
+following wait rather than adding to it, and a long script finishes at
+its planned time. The scheduler records how late each command was issued.
+"""
+
+import collections
+import time
+
+from skoopy import metrics
+from skoopy import stats
+from skoopy.plan import PlanLoop
+
+# Timing of one scheduled command:
+#   offset - planned issue time in seconds from the start of the run
+#   lateness - actual issue time minus planned issue time, in seconds
+#   duration - time taken by the command itself, in seconds
+StepTiming = collections.namedtuple("StepTiming", ["position", "command", "offset", "lateness", "duration"])
+
+# Sleeps shorter than this are done by spinning, for accuracy
+SPIN_THRESHOLD = 0.002
+
+def sleepUntil(deadline):
+    """
+    Sleep until time.monotonic() reaches deadline
+    """
+    while True:
+        remaining = deadline - time.monotonic()
+        if remaining <= 0.0:
+            return
+        if remaining > SPIN_THRESHOLD:
+            time.sleep(remaining - SPIN_THRESHOLD)
+
+class TimedScheduler:
+    """
+    Executes CommandPlans on an absolute timeline.
+
+    Plans run while a run is already in progress (for example by the
+    "test" command) continue on the same timeline.
+    """
+
+    def __init__(self, parser):
+        self.parser = parser
+        self.active = False
+        self.origin = None
+        self.deadline = None
+        self.timings = []
+
+    def run(self, plan):
+        """
+        Run a plan. Returns the list of StepTimings for a top-level run.
+        """
+        if self.active:
+            self.runSteps(plan.steps)
+            return self.timings
+
+        self.timings = []
+        self.origin = time.monotonic()
+        self.deadline = self.origin
+        self.active = True
+        try:
+            self.runSteps(plan.steps)
+            # Honour a trailing wait
+            sleepUntil(self.deadline)
+        finally:
+            self.active = False
+        return self.timings
+
+    def runSteps(self, steps):
+        waitMethod = self.parser.cmdWait
+        for step in steps:
+            if step.method == waitMethod:
+                self.deadline += step.args[0]
+                continue
+
+            loop = getattr(step.method, "__self__", None)
+            if isinstance(loop, PlanLoop):
+                if loop.count == None:
+                    while True:
+                        self.runSteps(loop.steps)
+                else:
+                    for i in range(loop.count):
+                        self.runSteps(loop.steps)
+                continue
+
+            sleepUntil(self.deadline)
+            start = time.monotonic()
+            if step.args == None:
+                step.method()
+            else:
+                step.method(step.args)
+            end = time.monotonic()
+            if metrics.enabled:
+                metrics.observe("skoopy_parser_step_seconds", end - start, command=step.command)
+            self.timings.append(StepTiming(step.position, step.command,
+                self.deadline - self.origin, start - self.deadline, end - start))
+
+    def report(self):
+        """
+        Return lateness statistics for the last run, in seconds
+        """
+        result = stats.summarise([ timing.lateness for timing in self.timings ])
+        if self.origin != None:
+            result["plannedDuration"] = self.deadline - self.origin
+        return result
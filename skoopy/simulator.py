@@ -0,0 +1,518 @@
+"""
+Simulated transport for skoopy
+
+Models a fleet of virtual Skoobots in-process so that the controller,
+command parser and scanner can be exercised without a Bluetooth adapter.
+The simulated transport has the same interface as TransportBluepy.
+"""
+
+import collections
+import heapq
+import random
+import threading
+import time
+
+from skoopy import metrics
+from skoopy.gattcache import LayoutCacheMixin
+
+# Firmware command codes (see controller.py)
+CMD_RIGHT = 0x10
+CMD_LEFT = 0x11
+CMD_FORWARD = 0x12
+CMD_BACKWARD = 0x13
+CMD_STOP = 0x14
+CMD_SLEEP = 0x15
+CMD_GET_AMBIENT = 0x21
+CMD_GET_DISTANCE = 0x22
+CMD_ROVER_MODE = 0x40
+
+SKOOBOT_SERVICE_UUID = "00001523-1212-efde-1523-785feabcd123"
+GENERIC_ATTRIBUTE_SERVICE_UUID = "00001801-0000-1000-8000-00805f9b34fb"
+DATABASE_HASH_UUID = "00002b2a-0000-1000-8000-00805f9b34fb"
+
+# Characteristics provided by the firmware:
+#   <name> : (<uuid>, <length in bytes>, <properties>)
+SKOOBOT_CHARACTERISTICS = {
+    "data" : ("00001524-1212-efde-1523-785feabcd123", 1, "READ NOTIFY"),
+    "cmd" : ("00001525-1212-efde-1523-785feabcd123", 1, "READ WRITE NO RESPONSE WRITE"),
+    "byte2" : ("00001526-1212-efde-1523-785feabcd123", 2, "READ NOTIFY"),
+    "byte128" : ("00001527-1212-efde-1523-785feabcd123", 128, "READ"),
+    "byte4" : ("00001528-1212-efde-1523-785feabcd123", 4, "READ"),
+}
+
+# Default per-operation latencies in seconds
+DEFAULT_LATENCY = {
+    "scan" : 0.0,
+    "connect" : 0.0,
+    "disconnect" : 0.0,
+    "discover" : 0.0,
+    "write" : 0.0,
+    "writeNoResponse" : 0.0,
+    "read" : 0.0,
+    "notify" : 0.0,
+}
+
+ADDR_TYPE_PUBLIC = "public"
+ADDR_TYPE_RANDOM = "random"
+
+class SimulatedLinkError(Exception):
+    """
+    Raised by the simulated transport when an operation fails,
+    either because of failure injection or a missing Skoobot.
+    """
+    pass
+
+# Characteristic property bits, as in a characteristic declaration
+PROPERTY_BITS = (
+    ("BROADCAST", 0x01),
+    ("READ", 0x02),
+    ("WRITE NO RESPONSE", 0x04),
+    ("WRITE", 0x08),
+    ("NOTIFY", 0x10),
+    ("INDICATE", 0x20),
+)
+
+def propertyBits(properties):
+    """
+    Convert a properties string such as "READ NOTIFY" to its bits
+    """
+    bits = 0
+    for name, bit in PROPERTY_BITS:
+        if name in properties:
+            bits |= bit
+            properties = properties.replace(name, "")
+    return bits
+
+class SimulatedSkoobot:
+    """
+    State of a single virtual Skoobot.
+
+    Distance is modelled in the range 0-255 (closer is smaller) and
+    changes with the time spent driving forwards or backwards.
+    Turning points the robot at a new, random obstacle distance and
+    changes the ambient light level.
+    """
+
+    def __init__(self, addr, distance=128, ambient=512, speed=40.0,
+                 rssi=-60, connectable=True, addrType=ADDR_TYPE_RANDOM, seed=None,
+                 advertiseDelay=0.0, advertiseInterval=0.1):
+        self.addr = addr
+        # Time after a scan starts when the Skoobot is first heard, and
+        # the time between advertisements. advertiseInterval None means
+        # the Skoobot is not advertising.
+        self.advertiseDelay = advertiseDelay
+        self.advertiseInterval = advertiseInterval
+        self.addrType = addrType
+        self.connectable = connectable
+        self.rssi = rssi
+        self.speed = speed
+        self.distance = float(distance)
+        self.ambient = ambient
+        self.motion = CMD_STOP
+        self.lastUpdate = time.monotonic()
+        self.commandLog = []
+        self.random = random.Random(seed)
+        self.lock = threading.Lock()
+        self.values = {}
+        for name, (uuid, length, properties) in SKOOBOT_CHARACTERISTICS.items():
+            self.values[name] = bytes(length)
+        # GATT layout. Changing handleBase moves the Skoobot's attributes,
+        # as a firmware update might. If databaseHash is set to a bytes
+        # value, a Database Hash characteristic is provided.
+        self.handleBase = 10
+        self.databaseHash = None
+        # Incremented by dropLinks(); connections made before then are dead
+        self.linkEpoch = 0
+
+    def dropLinks(self):
+        """
+        Break every connection to this Skoobot, as a radio glitch would
+        """
+        self.linkEpoch += 1
+
+    def layout(self):
+        """
+        Return the GATT layout as a list of
+        (service uuid, [(name, uuid, handle, properties), ...])
+        """
+        layout = []
+        if self.databaseHash != None:
+            layout.append((GENERIC_ATTRIBUTE_SERVICE_UUID,
+                [("databaseHash", DATABASE_HASH_UUID, 2, "READ")]))
+        characteristics = []
+        handle = self.handleBase
+        for name, (uuid, length, properties) in SKOOBOT_CHARACTERISTICS.items():
+            characteristics.append((name, uuid, handle, properties))
+            handle += 3
+        layout.append((SKOOBOT_SERVICE_UUID, characteristics))
+        return layout
+
+    def nameForHandle(self, handle):
+        """
+        Return the name of the characteristic declared at handle, or None
+        """
+        for serviceUuid, characteristics in self.layout():
+            for name, uuid, charHandle, properties in characteristics:
+                if charHandle == handle:
+                    return name
+        return None
+
+    def readAttribute(self, handle):
+        """
+        Return the value of the attribute at handle: a characteristic
+        declaration or value. Raises SimulatedLinkError for other handles.
+        """
+        for serviceUuid, characteristics in self.layout():
+            for name, uuid, charHandle, properties in characteristics:
+                if handle == charHandle:
+                    # Properties, value handle and UUID, little-endian
+                    return bytes((propertyBits(properties),)) + (charHandle + 1).to_bytes(2, byteorder="little") + \
+                        bytes.fromhex(uuid.replace("-", ""))[::-1]
+                if handle == charHandle + 1:
+                    if name == "databaseHash":
+                        return bytes(self.databaseHash)
+                    with self.lock:
+                        return bytes(self.values[name])
+        raise SimulatedLinkError("Invalid handle 0x{0:x}".format(handle))
+
+    def update(self, now=None):
+        """
+        Advance the simulated position to the current time
+        """
+        if now == None:
+            now = time.monotonic()
+        elapsed = now - self.lastUpdate
+        self.lastUpdate = now
+        if self.motion == CMD_FORWARD:
+            self.distance = max(0.0, self.distance - self.speed * elapsed)
+        elif self.motion == CMD_BACKWARD:
+            self.distance = min(255.0, self.distance + self.speed * elapsed)
+
+    def handleCommand(self, cmd):
+        """
+        Process a command byte written to the cmd characteristic.
+        Returns the name of the characteristic updated by a sensor
+        request, if any.
+        """
+        updated = None
+        with self.lock:
+            self.update()
+            self.commandLog.append(cmd)
+            if cmd in (CMD_FORWARD, CMD_BACKWARD, CMD_STOP):
+                self.motion = cmd
+            elif cmd in (CMD_LEFT, CMD_RIGHT):
+                self.motion = CMD_STOP
+                self.distance = float(self.random.randint(20, 255))
+                self.ambient = max(0, min(1023, self.ambient + self.random.randint(-64, 64)))
+            elif cmd in (CMD_SLEEP, CMD_ROVER_MODE):
+                self.motion = CMD_STOP
+            elif cmd == CMD_GET_DISTANCE:
+                self.values["data"] = int(self.distance).to_bytes(1, byteorder="little")
+                updated = "data"
+            elif cmd == CMD_GET_AMBIENT:
+                self.values["byte2"] = int(self.ambient).to_bytes(2, byteorder="little")
+                updated = "byte2"
+            self.values["cmd"] = cmd.to_bytes(1, byteorder="little")
+        return updated
+
+    def getScanData(self):
+        """
+        Advertising data in the same form as bluepy's ScanEntry.getScanData()
+        """
+        return [
+            (1, "Flags", "06"),
+            (9, "Complete Local Name", "Skoobot"),
+        ]
+
+class SimulatedScanEntry:
+    """
+    Scan result for a simulated Skoobot, mimicking bluepy's ScanEntry
+    """
+
+    def __init__(self, skoobot):
+        self.addr = skoobot.addr
+        self.addrType = skoobot.addrType
+        self.connectable = skoobot.connectable
+        self.rssi = skoobot.rssi
+        self.scanData = skoobot.getScanData()
+
+    def getScanData(self):
+        return self.scanData
+
+class SimulatedCharacteristic:
+    """
+    Characteristic of a simulated Skoobot, mimicking bluepy's Characteristic
+    """
+
+    def __init__(self, transport, skoobot, name, uuid, handle, properties):
+        self.transport = transport
+        self.skoobot = skoobot
+        self.name = name
+        self.uuid = uuid
+        self.handle = handle
+        self.valHandle = handle + 1
+        self.properties = properties
+
+    def checkHandle(self):
+        if not self.transport.isConnected():
+            raise SimulatedLinkError("Device disconnected")
+        if self.skoobot.nameForHandle(self.handle) != self.name:
+            raise SimulatedLinkError("Invalid handle 0x{0:x}".format(self.valHandle))
+
+    def read(self):
+        self.transport.operation("read")
+        self.checkHandle()
+        if self.name == "databaseHash":
+            return bytes(self.skoobot.databaseHash)
+        with self.skoobot.lock:
+            return bytes(self.skoobot.values[self.name])
+
+    def write(self, val, withResponse=False):
+        self.transport.operation("write" if withResponse else "writeNoResponse")
+        self.checkHandle()
+        if self.name == "cmd":
+            updated = self.skoobot.handleCommand(val[0])
+            if updated != None:
+                self.transport.notify(updated)
+        else:
+            with self.skoobot.lock:
+                self.skoobot.values[self.name] = bytes(val)
+
+    def getHandle(self):
+        return self.valHandle
+
+    def supportsRead(self):
+        return "READ" in self.properties.split()
+
+    def propertiesToString(self):
+        return self.properties
+
+class SimulatedService:
+    """
+    Service of a simulated Skoobot, mimicking bluepy's Service
+    """
+
+    def __init__(self, uuid, characteristics):
+        self.uuid = uuid
+        self.characteristics = characteristics
+        self.hndStart = min(charac.handle for charac in characteristics) - 1
+        self.hndEnd = max(charac.valHandle for charac in characteristics)
+
+    def getCharacteristics(self):
+        return self.characteristics
+
+class TransportSimulated(LayoutCacheMixin):
+    """
+    Transport connected to a fleet of in-process virtual Skoobots.
+
+    latency is a dictionary of per-operation delays in seconds
+    (see DEFAULT_LATENCY for the operation names), jitter is the maximum
+    extra random delay added to each operation and failureRate is a
+    dictionary of per-operation failure probabilities. If gattCache is
+    a GattCache, service layouts are cached in it as TransportBluepy does.
+    """
+
+    linkErrors = (SimulatedLinkError,)
+
+    def __init__(self, skoobots=None, latency=None, jitter=0.0, failureRate=None, seed=None, gattCache=None):
+        if skoobots == None:
+            skoobots = []
+        self.skoobots = {}
+        for skoobot in skoobots:
+            self.addSkoobot(skoobot)
+        self.latency = dict(DEFAULT_LATENCY)
+        if latency != None:
+            self.latency.update(latency)
+        self.jitter = jitter
+        self.failureRate = {}
+        if failureRate != None:
+            self.failureRate.update(failureRate)
+        self.random = random.Random(seed)
+        self.gattCache = gattCache
+        self.peripheral = None
+        self.services = None
+        self.layoutCached = False
+        self.subscriptions = {}
+        self.notifications = collections.deque()
+
+    def spawn(self):
+        """
+        Create a new, unconnected transport sharing the same virtual
+        Skoobots and latency model. Each concurrent connection needs
+        its own transport.
+        """
+        transport = TransportSimulated(latency=self.latency, jitter=self.jitter,
+            failureRate=self.failureRate, seed=self.random.random(), gattCache=self.gattCache)
+        transport.skoobots = self.skoobots
+        return transport
+
+    def addSkoobot(self, skoobot):
+        """
+        Add a SimulatedSkoobot, or create one from an address string
+        """
+        if isinstance(skoobot, str):
+            skoobot = SimulatedSkoobot(skoobot)
+        self.skoobots[skoobot.addr] = skoobot
+        return skoobot
+
+    def operation(self, opName):
+        """
+        Apply the latency, jitter and failure injection for one operation
+        """
+        delay = self.latency.get(opName, 0.0)
+        if self.jitter > 0.0:
+            delay += self.random.uniform(0.0, self.jitter)
+        if delay > 0.0:
+            time.sleep(delay)
+        failureRate = self.failureRate.get(opName, 0.0)
+        if failureRate > 0.0 and self.random.random() < failureRate:
+            raise SimulatedLinkError("Simulated {0:s} failure".format(opName))
+
+    def findRawDevices(self, timeout=1.0):
+        self.operation("scan")
+        return [ SimulatedScanEntry(skoobot) for skoobot in self.skoobots.values() ]
+
+    def discoverRawDevices(self, timeout=None, interval=0.05):
+        """
+        Generator yielding a scan entry each time a simulated Skoobot
+        advertises, until timeout seconds have passed (forever if None)
+        """
+        self.operation("scan")
+        start = time.monotonic()
+        deadline = None if timeout == None else start + timeout
+        # Heap of (due time, sequence, skoobot)
+        due = [ (start + skoobot.advertiseDelay, i, skoobot)
+            for i, skoobot in enumerate(list(self.skoobots.values()))
+            if skoobot.advertiseInterval != None ]
+        heapq.heapify(due)
+        while len(due) > 0 and (deadline == None or due[0][0] <= deadline):
+            dueTime, i, skoobot = heapq.heappop(due)
+            delay = dueTime - time.monotonic()
+            if delay > 0.0:
+                time.sleep(delay)
+            if skoobot.advertiseInterval != None:
+                yield SimulatedScanEntry(skoobot)
+                heapq.heappush(due, (dueTime + skoobot.advertiseInterval, i, skoobot))
+        if deadline != None:
+            delay = deadline - time.monotonic()
+            if delay > 0.0:
+                time.sleep(delay)
+
+    def connect(self, addr, addrType=ADDR_TYPE_RANDOM):
+        self.disconnect()
+        skoobot = self.skoobots.get(addr)
+        start = time.perf_counter()
+        self.operation("connect")
+        if skoobot == None or not skoobot.connectable:
+            raise SimulatedLinkError("Failed to connect to peripheral {0:s}".format(addr))
+        self.peripheral = skoobot
+        self.linkEpoch = skoobot.linkEpoch
+        if metrics.enabled:
+            metrics.observe("skoopy_transport_connect_seconds", time.perf_counter() - start)
+
+    def isConnected(self):
+        return self.peripheral != None and self.linkEpoch == self.peripheral.linkEpoch
+
+    def disconnect(self):
+        self.services = None
+        self.layoutCached = False
+        if self.peripheral != None:
+            self.peripheral = None
+            self.subscriptions = {}
+            self.notifications.clear()
+            self.operation("disconnect")
+
+    def enableNotifications(self, rawCharacteristic, callback):
+        if self.peripheral == None:
+            raise RuntimeError("BLE not connected")
+        if not "NOTIFY" in rawCharacteristic.properties.split():
+            raise SimulatedLinkError("Characteristic does not support notifications")
+        self.operation("write")
+        self.subscriptions[rawCharacteristic.name] = (rawCharacteristic.getHandle(), callback)
+
+    def disableNotifications(self, rawCharacteristic):
+        if self.peripheral != None:
+            self.operation("write")
+            self.subscriptions.pop(rawCharacteristic.name, None)
+
+    def notify(self, charName):
+        """
+        Queue a notification for the named characteristic if subscribed
+        """
+        subscription = self.subscriptions.get(charName)
+        if subscription != None:
+            with self.peripheral.lock:
+                value = bytes(self.peripheral.values[charName])
+            self.notifications.append((subscription, value))
+
+    def waitForNotifications(self, timeout):
+        if len(self.notifications) == 0:
+            if timeout > 0.0:
+                time.sleep(timeout)
+            return False
+        self.operation("notify")
+        (handle, callback), value = self.notifications.popleft()
+        callback(handle, value)
+        return True
+
+    def layoutAddr(self):
+        return self.peripheral.addr if self.peripheral != None else None
+
+    def readAttribute(self, handle):
+        self.operation("read")
+        if not self.isConnected():
+            raise SimulatedLinkError("Device disconnected")
+        return self.peripheral.readAttribute(handle)
+
+    def discoverLayout(self):
+        self.operation("discover")
+        services = []
+        for serviceUuid, characteristics in self.peripheral.layout():
+            services.append(SimulatedService(serviceUuid, [
+                SimulatedCharacteristic(self, self.peripheral, name, uuid, handle, properties)
+                for name, uuid, handle, properties in characteristics ]))
+        self.cacheLayout(services, [ charac for service in services
+            for charac in service.getCharacteristics() ])
+        return services
+
+    def servicesFromLayout(self, entry):
+        names = { uuid : name for name, (uuid, length, properties) in SKOOBOT_CHARACTERISTICS.items() }
+        names[DATABASE_HASH_UUID] = "databaseHash"
+        services = []
+        for serviceEntry in entry["services"]:
+            services.append(SimulatedService(serviceEntry["uuid"], [
+                SimulatedCharacteristic(self, self.peripheral, names.get(charEntry["uuid"]),
+                    charEntry["uuid"], charEntry["handle"], charEntry["properties"])
+                for charEntry in serviceEntry["characteristics"] ]))
+        return services
+
+    def getRawServices(self):
+        if self.peripheral == None:
+            return []
+        return self.loadLayout()
+
+    def getRawCharacteristicsForService(self, service):
+        return service.getCharacteristics()
+
+    def getRawCharacteristics(self):
+        results = []
+        if self.peripheral != None:
+            for service in self.loadLayout():
+                results.extend(service.getCharacteristics())
+        return results
+
+    def getRawCharacteristicsByUUID(self, uuid):
+        uuid = str(uuid).lower()
+        return [ charac for charac in self.getRawCharacteristics() if charac.uuid == uuid ]
+
+def makeSkoobots(count, seed=None, **kwargs):
+    """
+    Create a list of count SimulatedSkoobots with distinct addresses
+    """
+    rng = random.Random(seed)
+    skoobots = []
+    for i in range(count):
+        addr = "ee:00:00:00:{0:02x}:{1:02x}".format(i // 256, i % 256)
+        skoobots.append(SimulatedSkoobot(addr, distance=rng.randint(20, 255),
+            ambient=rng.randint(0, 1023), seed=rng.random(), **kwargs))
+    return skoobots
@@ -0,0 +1,30 @@
+"""
+Summary statistics for timing measurements
+"""
+
+def percentile(ordered, pct):
+    """
+    Return the pct percentile (0-100) of an already sorted list
+    using the nearest rank
+    """
+    count = len(ordered)
+    index = min(count - 1, int(round(pct / 100.0 * (count - 1))))
+    return ordered[index]
+
+def summarise(samples):
+    """
+    Summarise a list of measurements as a dictionary of statistics
+    """
+    ordered = sorted(samples)
+    count = len(ordered)
+    if count == 0:
+        return { "count" : 0 }
+    return {
+        "count" : count,
+        "mean" : sum(ordered) / count,
+        "min" : ordered[0],
+        "p50" : percentile(ordered, 50),
+        "p90" : percentile(ordered, 90),
+        "p99" : percentile(ordered, 99),
+        "max" : ordered[-1],
+    }
@@ -0,0 +1,161 @@
+#!/usr/env python3
+"""
+Storage backends for the Skoobot registry
+
+Each backend loads and saves the registry's address to name mapping
+and its default name.
+
+- JsonRegistryStorage: a JSON file, rewritten atomically on every save.
+  This is the default.
+- SqliteRegistryStorage: an SQLite database. Saves only upsert the
+  entries that changed, inside a transaction, and the database uses
+  write-ahead logging so that readers do not block writers. This is
+  safe for concurrent skooscan and skoocontrol processes.
+"""
+
+import argparse
+import json
+import os
+import tempfile
+
+SQLITE_SUFFIXES = (".db", ".sqlite", ".sqlite3")
+
+def writeJsonAtomic(path, data):
+    """
+    Write data as JSON to a temporary file and rename it over path,
+    so that readers never see a partly written file
+    """
+    directory = os.path.dirname(os.path.abspath(path))
+    tempFd, tempPath = tempfile.mkstemp(prefix=".skoobots", suffix=".tmp", dir=directory, text=True)
+    try:
+        with os.fdopen(tempFd, "w") as jsonFile:
+            json.dump(data, jsonFile, sort_keys=True, indent=4)
+            jsonFile.flush()
+            os.fsync(jsonFile.fileno())
+        if os.path.exists(path):
+            os.chmod(tempPath, os.stat(path).st_mode & 0o777)
+        else:
+            os.chmod(tempPath, 0o644)
+        os.replace(tempPath, path)
+    except:
+        os.remove(tempPath)
+        raise
+
+class JsonRegistryStorage:
+    """
+    Registry storage in a JSON file
+    """
+    def __init__(self, path):
+        self.path = path
+
+    def exists(self):
+        return os.path.isfile(self.path)
+
+    def load(self):
+        """
+        Returns (skoobots, default) where skoobots is a dictionary
+        of address to name
+        """
+        with open(self.path, "r") as registryFile:
+            registryDict = json.load(registryFile)
+        return registryDict.get("skoobots", {}), registryDict.get("default", None)
+
+    def save(self, skoobots, default, changed=None, defaultChanged=True):
+        """
+        Write the whole registry atomically.
+        changed and defaultChanged are ignored; the JSON file is always
+        rewritten in full.
+        """
+        registryDict = { "default" : default, "skoobots" : skoobots }
+        writeJsonAtomic(self.path, registryDict)
+
+class SqliteRegistryStorage:
+    """
+    Registry storage in an SQLite database
+    """
+    def __init__(self, path, timeout=10.0):
+        self.path = path
+        self.timeout = timeout
+
+    def exists(self):
+        return os.path.isfile(self.path)
+
+    def connect(self):
+        # Imported here so that JSON users do not pay for it
+        import sqlite3
+
+        connection = sqlite3.connect(self.path, timeout=self.timeout)
+        connection.execute("PRAGMA journal_mode=WAL")
+        with connection:
+            connection.execute("CREATE TABLE IF NOT EXISTS skoobots (addr TEXT PRIMARY KEY, name TEXT NOT NULL)")
+            connection.execute("CREATE INDEX IF NOT EXISTS skoobots_name ON skoobots (name)")
+            connection.execute("CREATE TABLE IF NOT EXISTS settings (key TEXT PRIMARY KEY, value TEXT)")
+        return connection
+
+    def load(self):
+        connection = self.connect()
+        try:
+            skoobots = dict(connection.execute("SELECT addr, name FROM skoobots"))
+            row = connection.execute("SELECT value FROM settings WHERE key = 'default'").fetchone()
+        finally:
+            connection.close()
+        return skoobots, (row[0] if row != None else None)
+
+    def write(self, connection, skoobots, default, changed, defaultChanged):
+        if changed == None:
+            changed = skoobots.keys()
+        with connection:
+            connection.executemany(
+                "INSERT INTO skoobots (addr, name) VALUES (?, ?) "
+                "ON CONFLICT (addr) DO UPDATE SET name = excluded.name",
+                [ (addr, skoobots[addr]) for addr in changed ])
+            if defaultChanged:
+                connection.execute(
+                    "INSERT INTO settings (key, value) VALUES ('default', ?) "
+                    "ON CONFLICT (key) DO UPDATE SET value = excluded.value", (default,))
+
+    def save(self, skoobots, default, changed=None, defaultChanged=True):
+        """
+        Upsert the changed addresses (all addresses if changed is None),
+        and the default if defaultChanged, in a single transaction.
+        Entries another process saved in the meantime are kept.
+        """
+        connection = self.connect()
+        try:
+            self.write(connection, skoobots, default, changed, defaultChanged)
+        finally:
+            connection.close()
+
+def storageForPath(path):
+    """
+    Choose a storage backend from the file name
+    """
+    if path.lower().endswith(SQLITE_SUFFIXES):
+        return SqliteRegistryStorage(path)
+    return JsonRegistryStorage(path)
+
+def migrateJsonToSqlite(jsonPath, sqlitePath):
+    """
+    Copy a JSON registry into an SQLite registry, replacing
+    any entries with the same address
+    """
+    skoobots, default = JsonRegistryStorage(jsonPath).load()
+    SqliteRegistryStorage(sqlitePath).save(skoobots, default)
+    return len(skoobots)
+
+def migrate():
+    # Imported here to avoid a circular import
+    from skoopy.registry import defaultRegistryPath
+
+    argParser = argparse.ArgumentParser(description="Move the Skoobot registry to SQLite storage")
+    argParser.add_argument("--json", "-j", help="JSON registry to read")
+    argParser.add_argument("--sqlite", "-s", help="SQLite registry to create or update")
+    args = argParser.parse_args()
+
+    jsonPath = args.json if args.json != None else defaultRegistryPath(".json")
+    sqlitePath = args.sqlite if args.sqlite != None else defaultRegistryPath(".db")
+    count = migrateJsonToSqlite(jsonPath, sqlitePath)
+    print("Copied {0:d} Skoobots from {1:s} to {2:s}".format(count, jsonPath, sqlitePath))
+
+if __name__ == "__main__":
+    migrate()
@@ -0,0 +1,197 @@
+"""
+Sensor streaming for Skoobots
+
+A SensorStream samples a Skoobot sensor on a background thread and
+delivers timestamped samples through a bounded buffer. When the
+firmware supports notifications on the sensor's characteristic the
+value is pushed by the robot; otherwise the stream falls back to a
+pipelined poller. It sends the request for the next sample without
+response as soon as it has read the current one, so the Skoobot
+measures while the stream waits for the next period, and each sample
+costs a single read. The read is only answered once the request has
+been processed, so it also acknowledges it.
+
+The stream's thread takes the controller's lock for each BLE operation,
+so the caller may keep sending commands while the stream runs.
+"""
+
+import asyncio
+import collections
+import threading
+import time
+
+# A single sensor reading. timestamp is from time.monotonic()
+Sample = collections.namedtuple("Sample", ["timestamp", "channel", "value"])
+
+# Sensor channels:
+#   <channel> : (<request command>, <characteristic name>)
+CHANNELS = {
+    "distance" : (0x22, "data"),
+    "ambient" : (0x21, "byte2"),
+}
+
+# Longest time in seconds the stream holds the controller's lock while
+# waiting for a notification
+NOTIFY_SLICE = 0.02
+
+class SensorStream:
+    """
+    Stream of samples from one sensor channel of a connected Skoobot.
+
+    Iterate over it (or use "async for") to receive samples. If the
+    consumer falls behind, the oldest buffered samples are dropped and
+    counted in self.dropped.
+    """
+
+    def __init__(self, controller, channel, rate=10.0, bufferSize=256, notify=True):
+        """
+        rate is the target number of samples per second, or None to
+        sample as fast as the link allows. If notify is False the
+        poller is always used.
+        """
+        if channel not in CHANNELS:
+            raise KeyError("Unknown sensor channel {0:s}".format(channel))
+        self.controller = controller
+        self.channel = channel
+        self.command, self.charName = CHANNELS[channel]
+        self.period = 0.0 if rate == None else 1.0 / rate
+        self.buffer = collections.deque(maxlen=bufferSize)
+        self.condition = threading.Condition()
+        self.dropped = 0
+        self.error = None
+        self.running = False
+        self.thread = None
+        self.notify = notify and controller.supportsNotify(self.charName)
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, excType, excValue, traceback):
+        self.close()
+
+    def start(self):
+        if not self.running:
+            self.running = True
+            self.thread = threading.Thread(target=self.run, name="skoopy-stream", daemon=True)
+            self.thread.start()
+        return self
+
+    def close(self):
+        """
+        Stop sampling and wait for the sampling thread to finish
+        """
+        self.running = False
+        if self.thread != None and self.thread is not threading.current_thread():
+            self.thread.join()
+        self.thread = None
+        with self.condition:
+            self.condition.notify_all()
+
+    def push(self, value):
+        sample = Sample(time.monotonic(), self.channel, value)
+        with self.condition:
+            if len(self.buffer) == self.buffer.maxlen:
+                self.dropped += 1
+            self.buffer.append(sample)
+            self.condition.notify()
+
+    def handleNotification(self, handle, data):
+        self.push(int.from_bytes(data, byteorder="little"))
+
+    def waitForNotification(self, transport, timeout):
+        """
+        Wait up to timeout seconds for a notification, in short slices
+        so that the caller's commands are not held up
+        """
+        deadline = time.monotonic() + timeout
+        while self.running:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0.0:
+                return False
+            with self.controller.lock:
+                if transport.waitForNotifications(min(remaining, NOTIFY_SLICE)):
+                    return True
+
+    def run(self):
+        controller = self.controller
+        transport = controller.transport
+        try:
+            with controller.lock:
+                charac = controller.getCharacteristic(self.charName)
+                if self.notify:
+                    transport.enableNotifications(charac, self.handleNotification)
+                else:
+                    # The first request; each later one is sent as soon
+                    # as the previous value has been read
+                    controller.sendCommand(self.command, False)
+            deadline = time.monotonic()
+            while self.running:
+                if self.notify:
+                    controller.sendCommand(self.command, True)
+                    self.waitForNotification(transport, max(self.period, 0.1))
+                else:
+                    with controller.lock:
+                        # The read is answered only after the request has
+                        # been processed, so it acknowledges every write
+                        value = controller.readData(self.charName)
+                        controller.acknowledge(time.monotonic())
+                        if self.running:
+                            # The Skoobot measures while the stream sleeps
+                            controller.sendCommand(self.command, False)
+                    self.push(value)
+                deadline += self.period
+                delay = deadline - time.monotonic()
+                if delay > 0.0:
+                    time.sleep(delay)
+                else:
+                    # Running behind; don't try to catch up with a burst
+                    deadline = time.monotonic()
+            with controller.lock:
+                if self.notify:
+                    transport.disableNotifications(charac)
+                else:
+                    controller.sync()
+        except Exception as exc:
+            self.error = exc
+        finally:
+            self.running = False
+            with self.condition:
+                self.condition.notify_all()
+
+    def get(self, timeout=None):
+        """
+        Return the next sample, waiting up to timeout seconds.
+        Returns None on timeout or when the stream has stopped.
+        Raises the sampling thread's exception if it failed.
+        """
+        with self.condition:
+            if len(self.buffer) == 0 and self.running:
+                self.condition.wait(timeout)
+            if len(self.buffer) > 0:
+                return self.buffer.popleft()
+        if self.error != None:
+            raise self.error
+        return None
+
+    def __iter__(self):
+        self.start()
+        while self.running or len(self.buffer) > 0:
+            sample = self.get(1.0)
+            if sample != None:
+                yield sample
+        if self.error != None:
+            raise self.error
+
+    def __aiter__(self):
+        self.start()
+        return self
+
+    async def __anext__(self):
+        loop = asyncio.get_running_loop()
+        while self.running or len(self.buffer) > 0:
+            sample = await loop.run_in_executor(None, self.get, 1.0)
+            if sample != None:
+                return sample
+        if self.error != None:
+            raise self.error
+        raise StopAsyncIteration
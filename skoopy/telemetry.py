@@ -0,0 +1,267 @@
+"""
+Memory-mapped telemetry log
+
+A TelemetryLog stores sensor readings as fixed-size binary records in a
+memory-mapped file, so hours of high-rate capture cost 16 bytes per
+reading and survive the process. Each record holds a timestamp, a robot
+id, a channel id and a value. Robot addresses are kept in a table in the
+file header.
+
+Timestamps are wall-clock time from time.time(), so that logs from
+different runs and machines can be lined up; the monotonic timestamps
+of skoopy.stream Samples are converted when they are added.
+
+In append mode the file grows as needed. In ring mode it holds at most
+capacity records and the oldest are overwritten.
+
+Readers can get the records as namedtuples, or as NumPy structured
+arrays that are views of the file, without copying. NumPy is only
+imported when a view is requested.
+"""
+
+import collections
+import mmap
+import os
+import struct
+import threading
+import time
+
+TELEMETRY_MAGIC = b"SKTELEM1"
+TELEMETRY_VERSION = 1
+
+# magic, version, record size, capacity (0 for append mode),
+# records written, number of robots
+HEADER = struct.Struct("<8sIIQQI")
+HEADER_SIZE = 64
+MAX_ROBOTS = 4096
+ROBOT_ENTRY_SIZE = 24
+DATA_OFFSET = HEADER_SIZE + MAX_ROBOTS * ROBOT_ENTRY_SIZE
+
+# timestamp (time.time()), robot id, channel id, value
+RECORD = struct.Struct("<dHHi")
+
+# Channel ids of the Skoobot sensors. Other ids may be used freely.
+CHANNEL_IDS = {
+    "distance" : 0,
+    "ambient" : 1,
+}
+CHANNEL_NAMES = { channelId : name for name, channelId in CHANNEL_IDS.items() }
+
+# Number of records added to an append mode file each time it fills
+GROW_RECORDS = 65536
+
+TelemetryRecord = collections.namedtuple("TelemetryRecord", ["timestamp", "robot", "channel", "value"])
+
+def numpy():
+    """
+    Import numpy on first use. It is an optional dependency, needed
+    only for views and by skoopy.filters.
+    """
+    try:
+        import numpy
+    except ImportError:
+        raise ImportError("NumPy is required for this; install it with: pip3 install skoopy[numpy]")
+    return numpy
+
+def recordDtype():
+    """
+    NumPy dtype matching RECORD
+    """
+    return numpy().dtype([("timestamp", "<f8"), ("robot", "<u2"), ("channel", "<u2"), ("value", "<i4")])
+
+class TelemetryLog:
+    """
+    Append-only log of sensor readings in a memory-mapped file.
+
+    Opening an existing file continues it. capacity is only used when
+    creating a file: None for append mode, or the ring size in records.
+    """
+
+    def __init__(self, path, capacity=None):
+        self.path = path
+        self.lock = threading.Lock()
+        # Added to a time.monotonic() timestamp to give time.time()
+        self.clockOffset = time.time() - time.monotonic()
+        exists = os.path.isfile(path) and os.path.getsize(path) >= DATA_OFFSET
+        self.file = open(path, "r+b" if exists else "w+b")
+        if exists:
+            self.map = mmap.mmap(self.file.fileno(), 0)
+            magic, version, recordSize, capacity, count, robotCount = HEADER.unpack_from(self.map, 0)
+            if magic != TELEMETRY_MAGIC or version != TELEMETRY_VERSION or recordSize != RECORD.size:
+                raise ValueError("{0:s} is not a skoopy telemetry log".format(path))
+            self.capacity = capacity if capacity > 0 else None
+            self.count = count
+            self.robotAddrs = [ self.map[self.robotOffset(i):self.robotOffset(i) + ROBOT_ENTRY_SIZE]
+                .rstrip(b"\0").decode() for i in range(robotCount) ]
+        else:
+            if capacity != None and capacity < 1:
+                raise ValueError("capacity must be at least 1")
+            self.capacity = capacity
+            self.count = 0
+            self.robotAddrs = []
+            slots = capacity if capacity != None else GROW_RECORDS
+            self.file.truncate(DATA_OFFSET + slots * RECORD.size)
+            self.map = mmap.mmap(self.file.fileno(), 0)
+            self.writeHeader()
+        self.robotIds = { addr : i for i, addr in enumerate(self.robotAddrs) }
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, excType, excValue, traceback):
+        self.close()
+
+    def __len__(self):
+        """
+        Number of records held
+        """
+        if self.capacity != None:
+            return min(self.count, self.capacity)
+        return self.count
+
+    def robotOffset(self, robotId):
+        return HEADER_SIZE + robotId * ROBOT_ENTRY_SIZE
+
+    def writeHeader(self):
+        HEADER.pack_into(self.map, 0, TELEMETRY_MAGIC, TELEMETRY_VERSION, RECORD.size,
+            self.capacity if self.capacity != None else 0, self.count, len(self.robotAddrs))
+
+    def slots(self):
+        """
+        Number of records the file currently has room for
+        """
+        return (len(self.map) - DATA_OFFSET) // RECORD.size
+
+    def robotId(self, addr):
+        """
+        Return the id of the robot with the given address,
+        adding it to the robot table if necessary
+        """
+        robotId = self.robotIds.get(addr)
+        if robotId == None:
+            with self.lock:
+                robotId = self.robotIds.get(addr)
+                if robotId == None:
+                    if len(self.robotAddrs) >= MAX_ROBOTS:
+                        raise ValueError("Telemetry log is limited to {0:d} robots".format(MAX_ROBOTS))
+                    robotId = len(self.robotAddrs)
+                    encoded = addr.encode()[:ROBOT_ENTRY_SIZE].ljust(ROBOT_ENTRY_SIZE, b"\0")
+                    offset = self.robotOffset(robotId)
+                    self.map[offset:offset + ROBOT_ENTRY_SIZE] = encoded
+                    self.robotAddrs.append(addr)
+                    self.robotIds[addr] = robotId
+                    self.writeHeader()
+        return robotId
+
+    def robots(self):
+        """
+        Return the robot addresses, indexed by robot id
+        """
+        return list(self.robotAddrs)
+
+    def grow(self):
+        # Views handed out keep the old map alive, so it is not closed
+        size = len(self.map) + GROW_RECORDS * RECORD.size
+        self.file.truncate(size)
+        self.map = mmap.mmap(self.file.fileno(), 0)
+
+    def append(self, robot, channel, value, timestamp=None):
+        """
+        Add a reading. robot is an address or robot id and channel is
+        a channel name or id. timestamp is in seconds since the epoch,
+        as from time.time(), which is the default.
+        """
+        if isinstance(robot, str):
+            robot = self.robotId(robot)
+        if isinstance(channel, str):
+            channel = CHANNEL_IDS[channel]
+        if timestamp == None:
+            timestamp = time.time()
+        with self.lock:
+            if self.capacity != None:
+                slot = self.count % self.capacity
+            else:
+                slot = self.count
+                if slot >= self.slots():
+                    self.grow()
+            RECORD.pack_into(self.map, DATA_OFFSET + slot * RECORD.size, timestamp, robot, channel, value)
+            # Publish the record only once it is complete
+            self.count += 1
+            self.writeHeader()
+
+    def appendSample(self, addr, sample):
+        """
+        Add a skoopy.stream.Sample from the robot with address addr,
+        converting its time.monotonic() timestamp to wall-clock time
+        """
+        self.append(addr, sample.channel, sample.value, sample.timestamp + self.clockOffset)
+
+    def firstSlot(self):
+        """
+        Slot holding the oldest record
+        """
+        if self.capacity != None and self.count > self.capacity:
+            return self.count % self.capacity
+        return 0
+
+    def records(self, start=0):
+        """
+        Return the records held, oldest first, as TelemetryRecords,
+        skipping the first start of them
+        """
+        with self.lock:
+            count = len(self)
+            first = self.firstSlot()
+            slots = self.capacity if self.capacity != None else count
+            return [ TelemetryRecord(*RECORD.unpack_from(self.map,
+                    DATA_OFFSET + ((first + i) % slots) * RECORD.size))
+                for i in range(start, count) ]
+
+    def view(self):
+        """
+        Return a NumPy structured array viewing the records in place,
+        with fields timestamp, robot, channel and value. The array is
+        not copied, so in ring mode it is in slot order: once the ring
+        has wrapped, the oldest record is at firstSlot(). See ordered().
+        Its length is fixed when it is made: a ring slot that is later
+        overwritten shows the new record, but records appended beyond
+        the end are not included, so call view() again to see them.
+        """
+        with self.lock:
+            return numpy().frombuffer(self.map, dtype=recordDtype(), count=len(self), offset=DATA_OFFSET)
+
+    def ordered(self):
+        """
+        Return the records as a NumPy structured array, oldest first.
+        This is a view unless the ring has wrapped.
+        """
+        view = self.view()
+        first = self.firstSlot()
+        if first == 0:
+            return view
+        return numpy().concatenate((view[first:], view[:first]))
+
+    def channel(self, robot, channel):
+        """
+        Return (timestamps, values) arrays for one robot and channel,
+        oldest first
+        """
+        if isinstance(robot, str):
+            robot = self.robotIds[robot]
+        if isinstance(channel, str):
+            channel = CHANNEL_IDS[channel]
+        records = self.ordered()
+        selected = records[(records["robot"] == robot) & (records["channel"] == channel)]
+        return selected["timestamp"], selected["value"]
+
+    def flush(self):
+        self.map.flush()
+
+    def close(self):
+        self.flush()
+        try:
+            self.map.close()
+        except BufferError:
+            # NumPy views still use the map; it is released with them
+            pass
+        self.file.close()
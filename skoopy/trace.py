@@ -0,0 +1,540 @@
+#!/usr/env python3
+"""
+GATT operation traces
+
+RecordingTransport wraps another transport and logs every scan result,
+connection, discovery, read, write and notification to a compact binary
+trace. ReplayTransport plays a trace back to a SkoobotController, either
+with the original timing or as fast as possible, so that real sessions
+can be profiled and regression-tested without robots.
+
+A trace file is the magic bytes b"SKTRACE1" followed by records. Each
+record is a fixed header (see RECORD_HEADER) followed by a key, such as
+an address or characteristic handle, and a payload. Timestamps are
+monotonic seconds from the start of the recording. Each transport
+created with spawn() records into its own stream of the same trace.
+"""
+
+import argparse
+import collections
+import json
+import struct
+import threading
+import time
+
+from skoopy import stats
+
+TRACE_MAGIC = b"SKTRACE1"
+
+# kind, outcome, stream, timestamp, duration, key length, payload length
+RECORD_HEADER = struct.Struct("<BBHddHI")
+
+# Record kinds
+KIND_SCAN = 1           # findRawDevices(): payload is a JSON list of entries
+KIND_ADVERT = 2         # one entry yielded by discoverRawDevices()
+KIND_SCAN_END = 3       # end of a discoverRawDevices() scan
+KIND_CONNECT = 4        # key is the address, payload the address type
+KIND_DISCONNECT = 5
+KIND_DISCOVER = 6       # key is "services", "characteristics" or a uuid
+KIND_WRITE = 7          # key is the value handle, payload the data
+KIND_WRITE_NO_RESPONSE = 8
+KIND_READ = 9           # key is the value handle, payload the value
+KIND_NOTIFY_ENABLE = 10
+KIND_NOTIFY_DISABLE = 11
+KIND_NOTIFICATION = 12  # key is the value handle, payload the value
+KIND_WAIT = 13          # waitForNotifications(); payload is b"1" if one arrived
+KIND_STATE = 14         # isConnected(); payload is b"1" if connected
+
+KIND_NAMES = {
+    KIND_SCAN : "scan",
+    KIND_ADVERT : "advert",
+    KIND_SCAN_END : "scanEnd",
+    KIND_CONNECT : "connect",
+    KIND_DISCONNECT : "disconnect",
+    KIND_DISCOVER : "discover",
+    KIND_WRITE : "write",
+    KIND_WRITE_NO_RESPONSE : "writeNoResponse",
+    KIND_READ : "read",
+    KIND_NOTIFY_ENABLE : "notifyEnable",
+    KIND_NOTIFY_DISABLE : "notifyDisable",
+    KIND_NOTIFICATION : "notification",
+    KIND_WAIT : "wait",
+    KIND_STATE : "state",
+}
+
+OUTCOME_OK = 0
+OUTCOME_ERROR = 1   # the payload is the error message
+
+# One record read from a trace
+TraceRecord = collections.namedtuple("TraceRecord",
+    ["kind", "outcome", "stream", "timestamp", "duration", "key", "payload"])
+
+class TraceMismatchError(RuntimeError):
+    """
+    Raised by ReplayTransport when the operations requested differ
+    from the ones in the trace
+    """
+    pass
+
+class ReplayLinkError(Exception):
+    """
+    Raised by ReplayTransport where the recorded operation failed
+    """
+    pass
+
+def scanEntryDict(rawDevice):
+    return {
+        "addr" : rawDevice.addr,
+        "addrType" : rawDevice.addrType,
+        "connectable" : rawDevice.connectable,
+        "rssi" : getattr(rawDevice, "rssi", None),
+        "scanData" : [ list(scanRow) for scanRow in rawDevice.getScanData() ],
+    }
+
+def characteristicDict(rawCharacteristic):
+    return {
+        "uuid" : str(rawCharacteristic.uuid).lower(),
+        "handle" : rawCharacteristic.handle,
+        "valHandle" : rawCharacteristic.getHandle(),
+        "properties" : rawCharacteristic.propertiesToString(),
+    }
+
+def encodeJson(value):
+    return json.dumps(value, separators=(",", ":")).encode()
+
+class TraceWriter:
+    """
+    Appends records to a trace file. Shared by a RecordingTransport
+    and the transports spawned from it.
+    """
+
+    def __init__(self, path):
+        self.file = open(path, "wb")
+        self.file.write(TRACE_MAGIC)
+        self.origin = time.monotonic()
+        self.lock = threading.Lock()
+        self.streams = 0
+
+    def newStream(self):
+        with self.lock:
+            stream = self.streams
+            self.streams += 1
+        return stream
+
+    def write(self, kind, stream, start, duration, key="", payload=b"", outcome=OUTCOME_OK):
+        keyBytes = key.encode()
+        header = RECORD_HEADER.pack(kind, outcome, stream, start - self.origin, duration,
+            len(keyBytes), len(payload))
+        with self.lock:
+            self.file.write(header + keyBytes + payload)
+
+    def close(self):
+        with self.lock:
+            self.file.close()
+
+def readTrace(path):
+    """
+    Generator yielding the TraceRecords in a trace file
+    """
+    with open(path, "rb") as traceFile:
+        if traceFile.read(len(TRACE_MAGIC)) != TRACE_MAGIC:
+            raise ValueError("{0:s} is not a skoopy trace".format(path))
+        while True:
+            header = traceFile.read(RECORD_HEADER.size)
+            if len(header) < RECORD_HEADER.size:
+                return
+            kind, outcome, stream, timestamp, duration, keyLength, payloadLength = RECORD_HEADER.unpack(header)
+            key = traceFile.read(keyLength).decode()
+            payload = traceFile.read(payloadLength)
+            yield TraceRecord(kind, outcome, stream, timestamp, duration, key, payload)
+
+class RecordingCharacteristic:
+    """
+    Wraps a characteristic so that its reads and writes are recorded
+    """
+
+    def __init__(self, transport, rawCharacteristic):
+        self.transport = transport
+        self.rawCharacteristic = rawCharacteristic
+
+    def __getattr__(self, name):
+        return getattr(self.rawCharacteristic, name)
+
+    def read(self):
+        return self.transport.record(KIND_READ, str(self.rawCharacteristic.getHandle()),
+            self.rawCharacteristic.read, lambda value: bytes(value))
+
+    def write(self, val, withResponse=False):
+        kind = KIND_WRITE if withResponse else KIND_WRITE_NO_RESPONSE
+        return self.transport.record(kind, str(self.rawCharacteristic.getHandle()),
+            lambda: self.rawCharacteristic.write(val, withResponse), lambda result: bytes(val))
+
+class RecordingService:
+    def __init__(self, uuid, characteristics):
+        self.uuid = uuid
+        self.characteristics = characteristics
+
+    def getCharacteristics(self):
+        return self.characteristics
+
+class RecordingTransport:
+    """
+    Transport wrapper that records every operation to a trace file.
+    Attributes not handled here are passed to the wrapped transport.
+    Call close() to finish the trace.
+    """
+
+    def __init__(self, transport, path=None, writer=None):
+        if writer == None:
+            writer = TraceWriter(path)
+        self.transport = transport
+        self.writer = writer
+        self.stream = writer.newStream()
+
+    def __getattr__(self, name):
+        return getattr(self.transport, name)
+
+    def spawn(self):
+        return RecordingTransport(self.transport.spawn(), writer=self.writer)
+
+    def close(self):
+        self.writer.close()
+
+    def record(self, kind, key, operation, encode=None):
+        """
+        Call operation(), record it and return its result. encode
+        converts the result to the payload bytes.
+        """
+        start = time.monotonic()
+        try:
+            result = operation()
+        except Exception as exc:
+            self.writer.write(kind, self.stream, start, time.monotonic() - start, key,
+                str(exc).encode(), OUTCOME_ERROR)
+            raise
+        payload = encode(result) if encode != None else b""
+        self.writer.write(kind, self.stream, start, time.monotonic() - start, key, payload)
+        return result
+
+    def findRawDevices(self, timeout=1.0):
+        return self.record(KIND_SCAN, "", lambda: self.transport.findRawDevices(timeout),
+            lambda devices: encodeJson([ scanEntryDict(device) for device in devices ]))
+
+    def discoverRawDevices(self, timeout=None, interval=0.05):
+        devices = self.transport.discoverRawDevices(timeout, interval)
+        start = time.monotonic()
+        try:
+            for device in devices:
+                now = time.monotonic()
+                self.writer.write(KIND_ADVERT, self.stream, now, 0.0, device.addr,
+                    encodeJson(scanEntryDict(device)))
+                yield device
+        finally:
+            devices.close()
+            self.writer.write(KIND_SCAN_END, self.stream, start, time.monotonic() - start)
+
+    def connect(self, addr, addrType="random"):
+        self.record(KIND_CONNECT, addr, lambda: self.transport.connect(addr, addrType),
+            lambda result: addrType.encode())
+
+    def disconnect(self):
+        self.record(KIND_DISCONNECT, "", self.transport.disconnect)
+
+    def isConnected(self):
+        return self.record(KIND_STATE, "", self.transport.isConnected,
+            lambda connected: b"1" if connected else b"0")
+
+    def discover(self, key, operation):
+        def encode(characteristics):
+            return encodeJson({
+                "cached" : bool(getattr(self.transport, "layoutCached", False)),
+                "characteristics" : [ characteristicDict(charac) for charac in characteristics ],
+            })
+        characteristics = self.record(KIND_DISCOVER, key, operation, encode)
+        return [ RecordingCharacteristic(self, charac) for charac in characteristics ]
+
+    def getRawServices(self):
+        def discoverServices():
+            return [ (rawService.uuid, self.transport.getRawCharacteristicsForService(rawService))
+                for rawService in self.transport.getRawServices() ]
+
+        def encode(services):
+            return encodeJson({
+                "cached" : bool(getattr(self.transport, "layoutCached", False)),
+                "services" : [ {
+                        "uuid" : str(uuid).lower(),
+                        "characteristics" : [ characteristicDict(charac) for charac in characteristics ],
+                    } for uuid, characteristics in services ],
+            })
+
+        services = self.record(KIND_DISCOVER, "services", discoverServices, encode)
+        return [ RecordingService(uuid, [ RecordingCharacteristic(self, charac) for charac in characteristics ])
+            for uuid, characteristics in services ]
+
+    def getRawCharacteristicsForService(self, service):
+        return service.getCharacteristics()
+
+    def getRawCharacteristics(self):
+        return self.discover("characteristics", self.transport.getRawCharacteristics)
+
+    def getRawCharacteristicsByUUID(self, uuid):
+        return self.discover(str(uuid).lower(), lambda: self.transport.getRawCharacteristicsByUUID(uuid))
+
+    def enableNotifications(self, rawCharacteristic, callback):
+        handle = rawCharacteristic.getHandle()
+
+        def recordingCallback(cHandle, data):
+            now = time.monotonic()
+            self.writer.write(KIND_NOTIFICATION, self.stream, now, 0.0, str(cHandle), bytes(data))
+            callback(cHandle, data)
+
+        inner = getattr(rawCharacteristic, "rawCharacteristic", rawCharacteristic)
+        self.record(KIND_NOTIFY_ENABLE, str(handle),
+            lambda: self.transport.enableNotifications(inner, recordingCallback))
+
+    def disableNotifications(self, rawCharacteristic):
+        inner = getattr(rawCharacteristic, "rawCharacteristic", rawCharacteristic)
+        self.record(KIND_NOTIFY_DISABLE, str(rawCharacteristic.getHandle()),
+            lambda: self.transport.disableNotifications(inner))
+
+    def waitForNotifications(self, timeout):
+        return self.record(KIND_WAIT, "", lambda: self.transport.waitForNotifications(timeout),
+            lambda received: b"1" if received else b"0")
+
+class ReplayScanEntry:
+    def __init__(self, entry):
+        self.addr = entry["addr"]
+        self.addrType = entry["addrType"]
+        self.connectable = entry["connectable"]
+        self.rssi = entry["rssi"]
+        self.scanData = [ tuple(scanRow) for scanRow in entry["scanData"] ]
+
+    def getScanData(self):
+        return self.scanData
+
+class ReplayCharacteristic:
+    def __init__(self, transport, entry):
+        self.transport = transport
+        self.uuid = entry["uuid"]
+        self.handle = entry["handle"]
+        self.valHandle = entry["valHandle"]
+        self.properties = entry["properties"]
+
+    def getHandle(self):
+        return self.valHandle
+
+    def supportsRead(self):
+        return "READ" in self.properties.split()
+
+    def propertiesToString(self):
+        return self.properties
+
+    def read(self):
+        return self.transport.replay(KIND_READ, str(self.valHandle)).payload
+
+    def write(self, val, withResponse=False):
+        kind = KIND_WRITE if withResponse else KIND_WRITE_NO_RESPONSE
+        record = self.transport.replay(kind, str(self.valHandle))
+        if record.payload != bytes(val):
+            raise TraceMismatchError("Wrote {0!r} to handle {1:d}; trace has {2!r}".format(
+                bytes(val), self.valHandle, record.payload))
+
+class ReplayService:
+    def __init__(self, uuid, characteristics):
+        self.uuid = uuid
+        self.characteristics = characteristics
+
+    def getCharacteristics(self):
+        return self.characteristics
+
+class ReplayState:
+    """
+    Records of a trace, by stream, shared by a ReplayTransport
+    and the transports spawned from it
+    """
+
+    def __init__(self, path, realtime):
+        self.streams = collections.defaultdict(collections.deque)
+        for record in readTrace(path):
+            self.streams[record.stream].append(record)
+        self.realtime = realtime
+        self.origin = None
+        self.nextStream = 0
+        self.lock = threading.Lock()
+
+    def newStream(self):
+        with self.lock:
+            stream = self.nextStream
+            self.nextStream += 1
+        return stream
+
+    def waitUntil(self, timestamp):
+        """
+        With original timing, sleep until timestamp seconds after the
+        start of the replay. The replay starts at the first operation.
+        """
+        if not self.realtime:
+            return
+        with self.lock:
+            if self.origin == None:
+                self.origin = time.monotonic() - timestamp
+        # Imported here as the scheduler is not otherwise needed
+        from skoopy.scheduler import sleepUntil
+        sleepUntil(self.origin + timestamp)
+
+class ReplayTransport:
+    """
+    Transport that plays back a trace made by RecordingTransport.
+
+    Each operation must match the next record of the transport's stream,
+    otherwise a TraceMismatchError is raised. Recorded failures are
+    raised as ReplayLinkError. If realtime is True each operation takes
+    as long as it did when recorded and the gaps between operations are
+    kept; otherwise the trace is played as fast as possible.
+    """
+
+    linkErrors = (ReplayLinkError,)
+
+    def __init__(self, path=None, realtime=True, state=None):
+        if state == None:
+            state = ReplayState(path, realtime)
+        self.state = state
+        self.stream = state.newStream()
+        self.records = state.streams[self.stream]
+        self.layoutCached = False
+        self.callbacks = {}
+
+    def spawn(self):
+        return ReplayTransport(state=self.state)
+
+    def nextRecord(self, kind):
+        if len(self.records) == 0:
+            raise TraceMismatchError("Trace ended; expected {0:s}".format(KIND_NAMES[kind]))
+        record = self.records.popleft()
+        if record.kind != kind:
+            raise TraceMismatchError("Expected {0:s}; trace has {1:s}".format(
+                KIND_NAMES[kind], KIND_NAMES.get(record.kind, str(record.kind))))
+        return record
+
+    def deliverNotifications(self):
+        """
+        Pass any notification records at the head of the stream to their
+        callbacks. bluepy can dispatch a notification while it waits for
+        the response to another operation, so it may be recorded before
+        the operation that it arrived during.
+        """
+        while len(self.records) > 0 and self.records[0].kind == KIND_NOTIFICATION:
+            record = self.records.popleft()
+            self.state.waitUntil(record.timestamp)
+            callback = self.callbacks.get(int(record.key))
+            if callback != None:
+                callback(int(record.key), record.payload)
+
+    def replay(self, kind, key=None):
+        """
+        Deliver pending notifications, then consume the next record,
+        which must be of the given kind and key, and return it once its
+        recorded duration has passed
+        """
+        self.deliverNotifications()
+        record = self.nextRecord(kind)
+        if key != None and record.key != key:
+            raise TraceMismatchError("{0:s} of {1:s}; trace has {2:s}".format(
+                KIND_NAMES[kind], key, record.key))
+        self.state.waitUntil(record.timestamp + record.duration)
+        if record.outcome == OUTCOME_ERROR:
+            raise ReplayLinkError(record.payload.decode(errors="replace"))
+        return record
+
+    def findRawDevices(self, timeout=1.0):
+        record = self.replay(KIND_SCAN)
+        return [ ReplayScanEntry(entry) for entry in json.loads(record.payload) ]
+
+    def discoverRawDevices(self, timeout=None, interval=0.05):
+        while len(self.records) > 0 and self.records[0].kind == KIND_ADVERT:
+            yield ReplayScanEntry(json.loads(self.replay(KIND_ADVERT).payload))
+        self.replay(KIND_SCAN_END)
+
+    def connect(self, addr, addrType="random"):
+        self.callbacks = {}
+        self.replay(KIND_CONNECT, addr)
+
+    def disconnect(self):
+        self.callbacks = {}
+        self.layoutCached = False
+        self.replay(KIND_DISCONNECT)
+
+    def isConnected(self):
+        return self.replay(KIND_STATE).payload == b"1"
+
+    def forgetLayout(self):
+        self.layoutCached = False
+
+    def discover(self, key):
+        discovered = json.loads(self.replay(KIND_DISCOVER, key).payload)
+        self.layoutCached = discovered["cached"]
+        return [ ReplayCharacteristic(self, entry) for entry in discovered["characteristics"] ]
+
+    def getRawServices(self):
+        discovered = json.loads(self.replay(KIND_DISCOVER, "services").payload)
+        self.layoutCached = discovered["cached"]
+        return [ ReplayService(service["uuid"], [ ReplayCharacteristic(self, entry)
+                for entry in service["characteristics"] ])
+            for service in discovered["services"] ]
+
+    def getRawCharacteristicsForService(self, service):
+        return service.getCharacteristics()
+
+    def getRawCharacteristics(self):
+        return self.discover("characteristics")
+
+    def getRawCharacteristicsByUUID(self, uuid):
+        return self.discover(str(uuid).lower())
+
+    def enableNotifications(self, rawCharacteristic, callback):
+        self.replay(KIND_NOTIFY_ENABLE, str(rawCharacteristic.getHandle()))
+        self.callbacks[rawCharacteristic.getHandle()] = callback
+
+    def disableNotifications(self, rawCharacteristic):
+        self.replay(KIND_NOTIFY_DISABLE, str(rawCharacteristic.getHandle()))
+        self.callbacks.pop(rawCharacteristic.getHandle(), None)
+
+    def waitForNotifications(self, timeout):
+        return self.replay(KIND_WAIT).payload == b"1"
+
+def summariseTrace(path):
+    """
+    Return timing statistics for each kind of operation in a trace
+    """
+    durations = collections.defaultdict(list)
+    errors = collections.Counter()
+    for record in readTrace(path):
+        name = KIND_NAMES.get(record.kind, str(record.kind))
+        durations[name].append(record.duration)
+        if record.outcome == OUTCOME_ERROR:
+            errors[name] += 1
+    summary = {}
+    for name, samples in durations.items():
+        summary[name] = stats.summarise(samples)
+        summary[name]["errors"] = errors[name]
+    return summary
+
+def traceInfo():
+    argParser = argparse.ArgumentParser(description="Summarise a skoopy GATT operation trace")
+    argParser.add_argument("trace", help="Trace file recorded with skoocontrol --record")
+    argParser.add_argument("--json", "-j", action="store_true", help="Print the summary as JSON")
+    args = argParser.parse_args()
+
+    summary = summariseTrace(args.trace)
+    if args.json:
+        print(json.dumps(summary, indent=4, sort_keys=True))
+        return
+    for name, result in sorted(summary.items()):
+        if result["count"] == 0:
+            continue
+        print("{0:16s} n={1:<6d} p50 {2:8.3f}ms  p90 {3:8.3f}ms  max {4:8.3f}ms  errors {5:d}".format(
+            name, result["count"], result["p50"] * 1000, result["p90"] * 1000,
+            result["max"] * 1000, result["errors"]))
+
+if __name__ == "__main__":
+    traceInfo()
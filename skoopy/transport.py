@@ -6,81 +6,253 @@ In theory this should allow for multiple bluetooth libraries
 in the future.
 """
 
-import bluepy
+import collections
+import time
 import uuid
-from bluepy.btle import Scanner, Peripheral, Characteristic
 
-class TransportBluepy():
+from skoopy import metrics
+from skoopy.gattcache import LayoutCacheMixin
+
+# UUID of the Client Characteristic Configuration Descriptor
+CCCD_UUID = 0x2902
+
+# Address types, as used by bluepy
+ADDR_TYPE_PUBLIC = "public"
+ADDR_TYPE_RANDOM = "random"
+
+def btle():
+    """
+    Import bluepy.btle on first use, so that importing skoopy
+    does not pay for it
+    """
+    import bluepy.btle
+    return bluepy.btle
+
+class NotificationDelegate():
+    """
+    Dispatches notifications to per-handle callbacks.
+    Implements the bluepy DefaultDelegate interface.
+    """
+    def __init__(self):
+        self.callbacks = {}
+
+    def handleDiscovery(self, scanEntry, isNewDev, isNewData):
+        pass
+
+    def handleNotification(self, cHandle, data):
+        callback = self.callbacks.get(cHandle)
+        if callback != None:
+            callback(cHandle, data)
+
+class ScanDelegate():
+    """
+    Queues scan entries as advertisements are received.
+    Implements the bluepy DefaultDelegate interface.
+    """
     def __init__(self):
+        self.entries = collections.deque()
+
+    def handleDiscovery(self, scanEntry, isNewDev, isNewData):
+        self.entries.append(scanEntry)
+
+    def handleNotification(self, cHandle, data):
+        pass
+
+class TransportBluepy(LayoutCacheMixin):
+    @property
+    def linkErrors(self):
+        """
+        Exceptions raised by this transport when a BLE operation fails
+        """
+        return (btle().BTLEException,)
+
+    def __init__(self, gattCache=None):
+        """
+        gattCache is the GattCache used to save each peripheral's
+        service layout between connections. It defaults to the user's
+        cache file; pass False to discover on every connection.
+        """
+        if gattCache == None:
+            from skoopy.gattcache import GattCache
+            gattCache = GattCache()
+        self.gattCache = gattCache
         self.devices = []
         self.peripheral = None
+        self.delegate = None
+        self.addr = None
+        # Services of the connected peripheral, once loaded
+        self.services = None
+        # True if the services came from the GATT cache
+        self.layoutCached = False
+
+    def spawn(self):
+        """
+        Create a new, unconnected transport of the same kind.
+        Each concurrent connection needs its own transport.
+        The GATT cache is shared.
+        """
+        return TransportBluepy(self.gattCache)
 
     def findRawDevices(self, timeout=1.0):
         rawDevices = []
-        scanner = Scanner()
+        scanner = btle().Scanner()
         rawDevices = scanner.scan(timeout)
 
         return rawDevices
 
+    def discoverRawDevices(self, timeout=None, interval=0.05):
+        """
+        Generator yielding scan entries as advertisements arrive,
+        until timeout seconds have passed (forever if None) or the
+        generator is closed. A device is yielded again each time
+        it advertises.
+        """
+        delegate = ScanDelegate()
+        scanner = btle().Scanner().withDelegate(delegate)
+        scanner.clear()
+        scanner.start()
+        try:
+            deadline = None if timeout == None else time.monotonic() + timeout
+            while True:
+                wait = interval
+                if deadline != None:
+                    wait = min(interval, deadline - time.monotonic())
+                    if wait <= 0.0:
+                        break
+                scanner.process(wait)
+                while len(delegate.entries) > 0:
+                    yield delegate.entries.popleft()
+        finally:
+            scanner.stop()
+
     def rawDeviceInfoStr(self, rawDevice):
         """
         Convert the raw device into an info string.
 
         The format of the string is transport-specific.
+        To inspect many devices concurrently, see skoopy.introspect.
         """
-        info = "Address: {0:s}\n".format(rawDevice.addr)
-        info += "Address type: {0:s}\n".format("public" if rawDevice.addrType == bluepy.btle.ADDR_TYPE_PUBLIC else "random")
-        info += "Connections?: {0:s}\n".format("yes" if rawDevice.connectable else "no")
-        info += "Scan Data:\n"
-        scanData = rawDevice.getScanData()
-        for scanRow in scanData:
-            info += "    {0:d}\t| {1:s}\t| {2:s}\n".format(scanRow[0], scanRow[1], scanRow[2])
-        if rawDevice.connectable:
-            self.connect(rawDevice.addr, rawDevice.addrType)
-            info += "Services:\n"
-            rawServices = self.getRawServices()
-            for rawService in rawServices:
-                info += "{0:s}".format(self.rawServiceInfoStr(rawService))
-            self.disconnect()
-        
-        return info
+        from skoopy import introspect
+        return introspect.formatText([introspect.inspectDevice(self, rawDevice)])
 
     def rawServiceInfoStr(self, rawService):
-        info = "    UUID: {0:s}\n".format(str(rawService.uuid))
-        info += "    Characteristics:\n"
-        rawCharacteristics = self.getRawCharacteristicsForService(rawService) 
-        for rawCharacteristic in rawCharacteristics:
-            info += "{0:s}".format(self.rawCharacteristicInfoStr(rawCharacteristic))
-        return info
+        from skoopy import introspect
+        return "".join(line + "\n" for line in
+            introspect.serviceLines(introspect.serviceRecord(self, rawService)))
 
     def rawCharacteristicInfoStr(self, rawCharacteristic):
-        info = "    -   UUID: {0:s}\n".format(str(rawCharacteristic.uuid))
-        info += "    -   Handle: {0:d} (0x{0:x})\n".format(rawCharacteristic.getHandle())
-        info += "    -   Properties: {0:s}\n".format(rawCharacteristic.propertiesToString())
-        return info
-        
-    def connect(self, addr, addrType=bluepy.btle.ADDR_TYPE_RANDOM):
+        from skoopy import introspect
+        return "".join(line + "\n" for line in
+            introspect.characteristicLines(introspect.characteristicRecord(rawCharacteristic)))
+
+    def connect(self, addr, addrType=ADDR_TYPE_RANDOM):
         self.disconnect()
-        self.peripheral = Peripheral(addr, addrType)
-        
+        start = time.perf_counter()
+        self.peripheral = btle().Peripheral(addr, addrType)
+        if metrics.enabled:
+            metrics.observe("skoopy_transport_connect_seconds", time.perf_counter() - start)
+        self.delegate = NotificationDelegate()
+        self.peripheral.setDelegate(self.delegate)
+        self.addr = addr
+
     def disconnect(self):
         if self.peripheral != None:
             self.peripheral.disconnect()
             self.peripheral = None
+            self.delegate = None
+        self.addr = None
+        self.services = None
+        self.layoutCached = False
+
+    def isConnected(self):
+        """
+        Return True if the link to the peripheral is up
+        """
+        if self.peripheral == None:
+            return False
+        try:
+            return self.peripheral.getState() == "conn"
+        except btle().BTLEException:
+            return False
+
+    def layoutAddr(self):
+        return self.addr
+
+    def readAttribute(self, handle):
+        return self.peripheral.readCharacteristic(handle)
+
+    def discoverLayout(self):
+        services = list(self.peripheral.getServices())
+        characteristics = self.peripheral.getCharacteristics()
+        for service in services:
+            service.chars = [ charac for charac in characteristics
+                if service.hndStart <= charac.handle <= service.hndEnd ]
+        self.cacheLayout(services, characteristics)
+        return services
+
+    def servicesFromLayout(self, entry):
+        services = []
+        for serviceEntry in entry["services"]:
+            service = btle().Service(self.peripheral, serviceEntry["uuid"],
+                serviceEntry["start"], serviceEntry["end"])
+            service.chars = [ btle().Characteristic(self.peripheral, charEntry["uuid"],
+                    charEntry["handle"], charEntry["properties"], charEntry["valHandle"])
+                for charEntry in serviceEntry["characteristics"] ]
+            services.append(service)
+        return services
+
+    def setNotifications(self, rawCharacteristic, enable):
+        descriptors = rawCharacteristic.getDescriptors(forUUID=CCCD_UUID)
+        if len(descriptors) > 0:
+            cccdHandle = descriptors[0].handle
+        else:
+            cccdHandle = rawCharacteristic.getHandle() + 1
+        value = b"\x01\x00" if enable else b"\x00\x00"
+        self.peripheral.writeCharacteristic(cccdHandle, value, True)
+
+    def enableNotifications(self, rawCharacteristic, callback):
+        """
+        Subscribe to notifications from the characteristic.
+        callback(handle, data) is called from waitForNotifications().
+        """
+        if self.peripheral == None:
+            raise RuntimeError("BLE not connected")
+        self.delegate.callbacks[rawCharacteristic.getHandle()] = callback
+        self.setNotifications(rawCharacteristic, True)
+
+    def disableNotifications(self, rawCharacteristic):
+        if self.peripheral != None:
+            self.delegate.callbacks.pop(rawCharacteristic.getHandle(), None)
+            self.setNotifications(rawCharacteristic, False)
+
+    def waitForNotifications(self, timeout):
+        """
+        Wait up to timeout seconds for a notification.
+        Returns True if one was received.
+        """
+        if self.peripheral == None:
+            return False
+        return self.peripheral.waitForNotifications(timeout)
 
     def getRawServices(self):
         if self.peripheral == None:
-            print("Not connected.\n")
             return {}
-        rawServices = self.peripheral.getServices()
-        print("Found {0:d} services\n".format(len(rawServices)))
-        return rawServices
+        return self.loadLayout()
 
     def getRawCharacteristicsForService(self, service):
         return service.getCharacteristics()
 
-    def getRawCharacteristicsByUUID(self, uuid):
+    def getRawCharacteristics(self):
+        """
+        Return all characteristics of the connected peripheral,
+        discovered in a single pass or taken from the GATT cache.
+        """
         results = []
         if self.peripheral != None:
-            results = self.peripheral.getCharacteristics(uuid=uuid)
+            for service in self.loadLayout():
+                results.extend(service.getCharacteristics())
         return results
+
+    def getRawCharacteristicsByUUID(self, uuid):
+        uuid = str(uuid).lower()
+        return [ charac for charac in self.getRawCharacteristics() if str(charac.uuid).lower() == uuid ]
@@ -0,0 +1,29 @@
+"""
+Shared fixtures for the skoopy test cases
+"""
+
+import unittest
+import os
+import tempfile
+
+from skoopy.registry import SkoobotRegistry
+
+class RegistryTestCase(unittest.TestCase):
+    """
+    Base test case providing a temporary directory, self.tempDir, and
+    an empty SkoobotRegistry saved in it, self.registry, so that tests
+    never touch the user's own registry
+    """
+
+    def setUp(self):
+        self.tempDir = tempfile.TemporaryDirectory(prefix="skoobot_test")
+        self.registry = SkoobotRegistry(self.tempPath("skoobots.json"))
+
+    def tearDown(self):
+        self.tempDir.cleanup()
+
+    def tempPath(self, name):
+        """
+        Return the path of a file called name in the temporary directory
+        """
+        return os.path.join(self.tempDir.name, name)
@@ -0,0 +1,92 @@
+"""
+Test cases for the skoopy.asynccontroller module, using the simulated transport
+"""
+
+import unittest
+import sys
+import asyncio
+import concurrent.futures
+import time
+
+# If this test is being executed standalone, add '..' to the path
+# to start searching for packages from the top level of the app.
+if __name__ == "__main__":
+    sys.path.insert(0, '..')
+
+from helpers import RegistryTestCase
+from skoopy.asynccontroller import AsyncSkoobotController
+from skoopy.controller import SkoobotController, CMD_FORWARD, CMD_STOP, CMD_GET_DISTANCE
+from skoopy.simulator import TransportSimulated, makeSkoobots
+
+class TestAsyncSkoobotController(RegistryTestCase):
+    """
+    Test case for the AsyncSkoobotController class
+    """
+
+    def setUp(self):
+        RegistryTestCase.setUp(self)
+        self.skoobots = makeSkoobots(4, seed=1)
+        self.transport = TransportSimulated(self.skoobots, latency={ "write" : 0.05, "read" : 0.05 }, seed=1)
+        self.executor = concurrent.futures.ThreadPoolExecutor(max_workers=4)
+
+    def tearDown(self):
+        self.executor.shutdown()
+        RegistryTestCase.tearDown(self)
+
+    def makeSkoobot(self, skoobot):
+        controller = SkoobotController(self.transport.spawn(), self.registry)
+        return AsyncSkoobotController(addr=skoobot.addr, controller=controller, executor=self.executor)
+
+    def testCommands(self):
+        """
+        Commands and requests run on the connected Skoobot, which is
+        disconnected when the context ends
+        """
+        async def drive():
+            async with self.makeSkoobot(self.skoobots[0]) as skoobot:
+                self.assertEqual(self.skoobots[0].addr, skoobot.connectedSkoobot)
+                await skoobot.cmdForward()
+                distance = await skoobot.requestDistance()
+                await skoobot.cmdStop()
+            self.assertEqual(None, skoobot.connectedSkoobot)
+            return distance
+
+        distance = asyncio.run(drive())
+        self.assertEqual([CMD_FORWARD, CMD_GET_DISTANCE, CMD_STOP], self.skoobots[0].commandLog)
+        self.assertLessEqual(distance, 255)
+
+    def testConcurrency(self):
+        """
+        Calls on different Skoobots overlap, calls on one Skoobot are
+        serialized and the event loop keeps running meanwhile
+        """
+        async def sweep():
+            skoobots = [ self.makeSkoobot(skoobot) for skoobot in self.skoobots ]
+            await asyncio.gather(*[ skoobot.connect(addr=skoobot.addr) for skoobot in skoobots ])
+
+            ticks = []
+            async def ticker():
+                for i in range(5):
+                    ticks.append(time.monotonic())
+                    await asyncio.sleep(0.01)
+            start = time.monotonic()
+            results = await asyncio.gather(ticker(), *[ skoobot.requestDistance() for skoobot in skoobots ])
+            parallel = time.monotonic() - start
+
+            start = time.monotonic()
+            await asyncio.gather(*[ skoobots[0].cmdStop() for i in range(3) ])
+            serial = time.monotonic() - start
+
+            await asyncio.gather(*[ skoobot.disconnect() for skoobot in skoobots ])
+            return results[1:], parallel, serial, ticks
+
+        distances, parallel, serial, ticks = asyncio.run(sweep())
+        self.assertEqual([ int(skoobot.distance) for skoobot in self.skoobots ], distances)
+        # Serially the sweep would take 4 * 0.1s
+        self.assertLess(parallel, 0.2)
+        self.assertGreaterEqual(serial, 0.15)
+        self.assertEqual(5, len(ticks))
+        self.assertLess(ticks[-1] - ticks[0], 0.1)
+
+if __name__ == "__main__":
+    unittest.main()
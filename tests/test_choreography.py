@@ -0,0 +1,135 @@
+"""
+Test cases for the skoopy.choreography module, using the simulated transport
+"""
+
+import unittest
+import sys
+
+# If this test is being executed standalone, add '..' to the path
+# to start searching for packages from the top level of the app.
+if __name__ == "__main__":
+    sys.path.insert(0, '..')
+
+from helpers import RegistryTestCase
+from skoopy.choreography import Choreography, flattenPlan
+from skoopy.controller import SkoobotController, CommandParser, CommandError
+from skoopy.controller import CMD_FORWARD, CMD_BACKWARD, CMD_LEFT, CMD_STOP
+from skoopy.fleet import SkoobotFleet
+from skoopy.simulator import TransportSimulated, makeSkoobots
+
+class TestChoreography(RegistryTestCase):
+    """
+    Test case for the Choreography class
+    """
+
+    def setUp(self):
+        RegistryTestCase.setUp(self)
+        self.skoobots = makeSkoobots(12, seed=1)
+        self.transport = TransportSimulated(self.skoobots,
+            latency={ "write" : 0.01, "writeNoResponse" : 0.002, "read" : 0.01, "connect" : 0.02 },
+            jitter=0.005, seed=1)
+        self.fleet = SkoobotFleet(self.registry, self.transport, maxWorkers=12)
+
+    def tearDown(self):
+        self.fleet.close()
+        RegistryTestCase.tearDown(self)
+
+    def testFlatten(self):
+        """
+        Waits become offsets and repeat blocks are unrolled
+        """
+        parser = CommandParser(SkoobotController(self.transport, self.registry))
+        plan = parser.compile(["forward", "wait", "0.5", "repeat", "2", "left", "wait", "0.25", "end", "stop"])
+        timeline, duration = flattenPlan(plan, parser)
+        self.assertEqual(["forward", "left", "left", "stop"], [ step.command for step in timeline ])
+        self.assertEqual([0.0, 0.5, 0.75, 1.0], [ step.offset for step in timeline ])
+        self.assertEqual(1.0, duration)
+
+        for words in (["loop", "left", "end"], ["stream", "distance"]):
+            with self.assertRaises(ValueError):
+                flattenPlan(parser.compile(words), parser)
+
+    def testScriptFile(self):
+        """
+        Scripts may be given as files, and errors give their line
+        """
+        addr = self.skoobots[0].addr
+        path = self.tempPath("dance.txt")
+        with open(path, "w") as scriptFile:
+            scriptFile.write("forward wait 0.05  # go\nstop\n")
+        choreography = Choreography(self.fleet, leadTime=0.05)
+        choreography.prepare({ addr : path })
+        self.assertEqual(["forward", "stop"], [ step.command for step in choreography.timelines[addr] ])
+
+        with open(path, "w") as scriptFile:
+            scriptFile.write("forward\n\nwait -1\n")
+        with self.assertRaisesRegex(CommandError, "line 3"):
+            choreography.prepare({ addr : path })
+
+        with open(path, "w") as scriptFile:
+            scriptFile.write("forward\nloop\nleft\nend\n")
+        with self.assertRaisesRegex(ValueError, "line 2"):
+            choreography.prepare({ addr : path })
+
+    def testRun(self):
+        """
+        Every robot runs its own timeline, in step with the others
+        """
+        scripts = {}
+        for i, skoobot in enumerate(self.skoobots):
+            motion = "forward" if i % 2 == 0 else "backward"
+            scripts[skoobot.addr] = ["repeat", "3", motion, "wait", "0.05", "left", "wait", "0.05", "end", "stop"]
+        scripts["ee:00:00:00:99:99"] = ["stop"]
+
+        choreography = Choreography(self.fleet, leadTime=0.05)
+        result = choreography.prepare(scripts)
+        self.assertEqual(["ee:00:00:00:99:99"], list(result.errors.keys()))
+        report = choreography.run()
+        self.assertEqual({}, report["errors"])
+        self.assertEqual(7, len(report["steps"]))
+        self.assertAlmostEqual(0.3, report["plannedDuration"])
+        for step in report["steps"]:
+            self.assertEqual(12, step["robots"])
+            self.assertLess(step["skew"], 0.02)
+        self.assertEqual(["backward", "forward"], report["steps"][0]["commands"])
+
+        for i, skoobot in enumerate(self.skoobots):
+            motion = CMD_FORWARD if i % 2 == 0 else CMD_BACKWARD
+            self.assertEqual([motion, CMD_LEFT] * 3 + [CMD_STOP], skoobot.commandLog[:7])
+            # Fast mode is restored after the run
+            self.assertFalse(self.fleet.controllers[skoobot.addr].fastMode)
+
+    def testFailure(self):
+        """
+        A robot that fails drops out without stopping the others
+        """
+        scripts = { skoobot.addr : ["forward", "wait", "0.05", "stop"] for skoobot in self.skoobots[:3] }
+        choreography = Choreography(self.fleet, leadTime=0.05)
+        choreography.prepare(scripts)
+        self.skoobots[0].dropLinks()
+        report = choreography.run()
+        self.assertEqual([self.skoobots[0].addr], list(report["errors"].keys()))
+        self.assertEqual(2, report["steps"][0]["robots"])
+        self.assertEqual([CMD_FORWARD, CMD_STOP], self.skoobots[1].commandLog)
+
+    def testSkewFromCompletion(self):
+        """
+        Skew is measured from when each robot's write completed, not
+        from when it was started
+        """
+        slow, fast = self.skoobots[:2]
+        scripts = { skoobot.addr : ["forward", "wait", "0.1", "stop"] for skoobot in (slow, fast) }
+        choreography = Choreography(self.fleet, leadTime=0.05, fast=False)
+        choreography.prepare(scripts)
+        transport = self.fleet.controllers[slow.addr].transport
+        transport.latency = dict(transport.latency, write=0.06)
+        transport.jitter = 0.0
+        report = choreography.run()
+        self.assertEqual({}, report["errors"])
+        for step in report["steps"]:
+            self.assertEqual(2, step["robots"])
+            self.assertGreater(step["skew"], 0.03)
+            self.assertLess(step["maxLateness"], 0.03)
+
+if __name__ == "__main__":
+    unittest.main()
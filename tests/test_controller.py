@@ -0,0 +1,230 @@
+"""
+Test cases for the skoopy.controller module, using the simulated transport
+"""
+
+import unittest
+import sys
+import io
+import threading
+import time
+
+# If this test is being executed standalone, add '..' to the path
+# to start searching for packages from the top level of the app.
+if __name__ == "__main__":
+    sys.path.insert(0, '..')
+
+from helpers import RegistryTestCase
+from skoopy.controller import SkoobotController, CommandParser, CommandError
+from skoopy.controller import CMD_FORWARD, CMD_LEFT, CMD_STOP, CMD_GET_DISTANCE
+from skoopy.reconnect import ReconnectPolicy, MOTION_SKIP
+from skoopy.scheduler import TimedScheduler
+from skoopy.simulator import TransportSimulated, SimulatedLinkError, makeSkoobots
+
+class TestSkoobotController(RegistryTestCase):
+    """
+    Test case for the SkoobotController and CommandParser classes
+    """
+
+    def setUp(self):
+        RegistryTestCase.setUp(self)
+        self.skoobots = makeSkoobots(3, seed=1)
+        self.skooName = "TestSkoobot"
+        for skoobot in self.skoobots:
+            self.registry.addSkoobot(skoobot.addr, self.skooName)
+        self.transport = TransportSimulated(self.skoobots, seed=1)
+        self.controller = SkoobotController(self.transport, self.registry)
+
+    def testLazyRegistry(self):
+        """
+        The default registry is not loaded until it is used
+        """
+        controller = SkoobotController(self.transport)
+        self.assertEqual(None, controller._registry)
+        controller.connect(addr=self.skoobots[0].addr)
+        self.assertEqual(None, controller._registry)
+
+    def testCharacteristicCache(self):
+        """
+        Characteristics are discovered once per connection
+        """
+        addr = self.controller.connect(addr=self.skoobots[0].addr)
+        self.assertEqual(self.skoobots[0].addr, addr)
+        self.assertEqual(1, self.controller.stats["cacheMisses"])
+
+        self.controller.cmdForward()
+        self.controller.requestDistance()
+        self.assertEqual(1, self.controller.stats["cacheMisses"])
+        self.assertEqual(3, self.controller.stats["cacheHits"])
+        self.assertEqual([CMD_FORWARD, CMD_GET_DISTANCE], self.skoobots[0].commandLog)
+
+        self.controller.disconnect()
+        self.assertEqual({}, self.controller.characteristics)
+        with self.assertRaises(RuntimeError):
+            self.controller.cmdStop()
+
+    def testConnectByName(self):
+        """
+        Connecting by a duplicated name skips unreachable Skoobots,
+        serially or racing
+        """
+        self.skoobots[0].connectable = False
+        for race in (False, True):
+            with self.subTest(race=race):
+                addr = self.controller.connect(self.skooName, race=race)
+                self.assertIn(addr, (self.skoobots[1].addr, self.skoobots[2].addr))
+                outcomes = [ attempt.outcome for attempt in self.controller.connectAttempts
+                    if attempt.addr == self.skoobots[0].addr ]
+                self.assertIn("failed", outcomes)
+                self.controller.requestDistance()
+
+        with self.assertRaises(ValueError):
+            self.controller.connect("nobody")
+
+    def testRaceDeadline(self):
+        """
+        Attempts still running at the deadline are recorded once, as
+        abandoned, and their late results are not recorded anywhere
+        """
+        transport = TransportSimulated(self.skoobots, latency={ "connect" : 0.2 }, seed=1)
+        controller = SkoobotController(transport, self.registry)
+        self.assertEqual(None, controller.connect(self.skooName, race=True, deadline=0.05))
+        self.assertEqual(["abandoned"] * 3, [ attempt.outcome for attempt in controller.connectAttempts ])
+        attempts = controller.connectAttempts
+        time.sleep(0.3)
+        self.assertEqual(3, len(attempts))
+
+        transport.latency["connect"] = 0.0
+        addr = controller.connect(self.skooName, race=True)
+        self.assertNotEqual(None, addr)
+        self.assertIsNot(transport, controller.transport)
+        self.assertEqual(1, len([ attempt for attempt in controller.connectAttempts
+            if attempt.outcome == "connected" ]))
+        controller.disconnect()
+        self.assertIs(transport, controller.transport)
+
+    def testFastMode(self):
+        """
+        In fast mode, at most window motion commands in a row are unacknowledged
+        """
+        self.controller.connect(addr=self.skoobots[0].addr)
+        self.controller.setFastMode(True, window=4)
+        for i in range(8):
+            self.controller.cmdLeft()
+        # Four unacknowledged, one acknowledged, then three more
+        self.assertEqual(7, self.controller.stats["commandsUnacknowledged"])
+        self.assertEqual(8, self.controller.stats["commandsSent"])
+        self.assertEqual(3, self.controller.unacknowledged)
+        self.assertEqual(5, self.controller.commandsAcknowledged)
+        self.controller.sync()
+        self.assertEqual(0, self.controller.unacknowledged)
+        self.assertEqual(8, self.controller.commandsAcknowledged)
+        elapsed = self.controller.lastAckTime - self.controller.firstSendTime
+        self.assertAlmostEqual(8 / elapsed, self.controller.stats["commandsPerSecond"])
+        self.assertEqual([CMD_LEFT] * 8, self.skoobots[0].commandLog)
+
+    def testAutoReconnect(self):
+        """
+        A lost link is reconnected and reads and idempotent commands
+        retried; turns follow the motion policy
+        """
+        skoobot = self.skoobots[0]
+        self.controller.connect(addr=skoobot.addr)
+        skoobot.dropLinks()
+        with self.assertRaises(SimulatedLinkError):
+            self.controller.cmdStop()
+
+        self.controller.connect(addr=skoobot.addr)
+        self.controller.setAutoReconnect(True, ReconnectPolicy(initialDelay=0.01, seed=1))
+        skoobot.dropLinks()
+        self.assertEqual(int(skoobot.distance), self.controller.requestDistance())
+        skoobot.dropLinks()
+        with self.assertRaises(SimulatedLinkError):
+            self.controller.cmdLeft()
+        self.controller.cmdStop()
+        self.assertEqual([CMD_GET_DISTANCE, CMD_STOP], skoobot.commandLog)
+        self.assertEqual(2, self.controller.stats["reconnects"])
+
+        # Skoobot out of range for a while
+        self.controller.reconnectPolicy.motionPolicy = MOTION_SKIP
+        skoobot.connectable = False
+        skoobot.dropLinks()
+        threading.Timer(0.1, setattr, (skoobot, "connectable", True)).start()
+        self.controller.cmdLeft()
+        self.assertEqual(3, self.controller.stats["reconnects"])
+        self.assertGreaterEqual(self.controller.stats["downtime"], 0.1)
+
+        # Out of range for good
+        skoobot.connectable = False
+        skoobot.dropLinks()
+        with self.assertRaises(SimulatedLinkError):
+            self.controller.readBytes()
+        self.assertEqual(1, self.controller.stats["reconnectFailures"])
+        self.assertEqual(None, self.controller.connectedSkoobot)
+        self.assertEqual(4, self.controller.stats["linkLosses"])
+
+    def testLinkUpFailure(self):
+        """
+        A failure on a live link without a cached layout is raised
+        """
+        self.controller.connect(addr=self.skoobots[0].addr)
+        self.transport.failureRate["write"] = 1.0
+        with self.assertRaisesRegex(SimulatedLinkError, "Simulated write failure"):
+            self.controller.sendCommand(CMD_STOP, True)
+        self.assertEqual(self.skoobots[0].addr, self.controller.connectedSkoobot)
+
+    def testCompile(self):
+        """
+        Command lists are validated before anything is run
+        """
+        self.controller.connect(addr=self.skoobots[0].addr)
+        parser = CommandParser(self.controller)
+        parser.output = io.StringIO()
+
+        badLists = (
+            (["forward", "wait"], 1),
+            (["forward", "wait", "soon"], 2),
+            (["get", "colour"], 1),
+            (["repeat", "2", "left"], 0),
+            (["left", "end"], 1),
+            (["jump"], 0),
+        )
+        for words, position in badLists:
+            with self.subTest(words=words):
+                with self.assertRaises(CommandError) as context:
+                    parser.parseCommandList(words)
+                self.assertEqual(position, context.exception.position)
+        self.assertEqual([], self.skoobots[0].commandLog)
+
+        parser.parseCommandList(["repeat", "2", "forward", "repeat", "2", "left", "end", "end", "stop", "get", "distance"])
+        self.assertEqual([CMD_FORWARD, CMD_LEFT, CMD_LEFT] * 2 + [CMD_STOP, CMD_GET_DISTANCE],
+            self.skoobots[0].commandLog)
+        self.assertTrue(parser.output.getvalue().startswith("distance = "))
+
+        words = ["forward", "stop"]
+        self.assertIs(parser.compile(words), parser.compile(words))
+        # A script's plan keeps its own line numbers
+        scriptPath = self.tempPath("script.txt")
+        with open(scriptPath, "w") as scriptFile:
+            scriptFile.write("\n\nforward\nstop\n")
+        self.assertEqual([3, 4], [ step.line for step in parser.compileScript(scriptPath).steps ])
+
+    def testTimedScheduler(self):
+        """
+        Waits are absolute offsets, so command latency does not add up
+        """
+        transport = TransportSimulated(self.skoobots, latency={ "write" : 0.02 })
+        controller = SkoobotController(transport, self.registry)
+        controller.connect(addr=self.skoobots[0].addr)
+        parser = CommandParser(controller)
+        parser.scheduler = TimedScheduler(parser)
+
+        start = time.monotonic()
+        parser.parseCommandList(["repeat", "5", "left", "wait", "0.05", "end"])
+        elapsed = time.monotonic() - start
+        self.assertLess(elapsed, 0.25 + 0.05)
+        report = parser.scheduler.report()
+        self.assertEqual(5, report["count"])
+        self.assertAlmostEqual(0.25, report["plannedDuration"])
+
+if __name__ == "__main__":
+    unittest.main()
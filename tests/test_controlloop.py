@@ -0,0 +1,87 @@
+"""
+Test cases for the skoopy.controlloop module, using the simulated transport
+"""
+
+import unittest
+import sys
+
+# If this test is being executed standalone, add '..' to the path
+# to start searching for packages from the top level of the app.
+if __name__ == "__main__":
+    sys.path.insert(0, '..')
+
+from helpers import RegistryTestCase
+from skoopy.controller import SkoobotController, CommandParser
+from skoopy.controller import CMD_FORWARD, CMD_LEFT, CMD_RIGHT, CMD_GET_DISTANCE, CMD_ROVER_MODE
+from skoopy.controlloop import ControlLoop, RoverPolicy, formatReport
+from skoopy.simulator import TransportSimulated, SimulatedSkoobot
+
+class TestControlLoop(RegistryTestCase):
+    """
+    Test case for the ControlLoop class
+    """
+
+    def setUp(self):
+        RegistryTestCase.setUp(self)
+        self.skoobot = SimulatedSkoobot("ee:00:00:00:00:01", distance=60, speed=400.0, seed=1)
+        self.transport = TransportSimulated([self.skoobot],
+            latency={ "read" : 0.002, "write" : 0.002, "writeNoResponse" : 0.0005 })
+        self.controller = SkoobotController(self.transport, self.registry)
+        self.controller.connect(addr=self.skoobot.addr)
+
+    def testRover(self):
+        """
+        The rover drives forward, turns at obstacles and keeps to the rate
+        """
+        loop = ControlLoop(self.controller, RoverPolicy(nearDistance=40), rate=50.0)
+        report = loop.run(iterations=40)
+        self.assertEqual(40, report["iterations"])
+        self.assertAlmostEqual(50.0, report["rate"], delta=5.0)
+        # A busy host may delay the odd iteration
+        self.assertLess(report["staleSamples"], 4)
+        self.assertLess(report["deadlineMisses"], 4)
+        # Only the read is waited for, well inside the period
+        self.assertLess(report["latency"]["p50"], 0.015)
+
+        commands = [ cmd for cmd in self.skoobot.commandLog if cmd != CMD_GET_DISTANCE ]
+        self.assertEqual(CMD_FORWARD, commands[0])
+        turned = [ index for index, cmd in enumerate(commands) if cmd in (CMD_LEFT, CMD_RIGHT) ]
+        self.assertTrue(len(turned) > 0)
+        # Each turn is a single movement, after which the rover drives on
+        self.assertIn(CMD_FORWARD, commands[turned[0]:])
+        # The request for the next iteration is always in flight
+        self.assertEqual(41, self.skoobot.commandLog.count(CMD_GET_DISTANCE))
+        # Forward is only sent when not already driving forwards
+        for previous, command in zip(commands, commands[1:]):
+            self.assertFalse(previous == CMD_FORWARD and command == CMD_FORWARD)
+        self.assertEqual(report["commandsSent"], len(commands))
+        # Everything is acknowledged, and fast mode is restored after the run
+        self.assertEqual(0, self.controller.unacknowledged)
+        self.assertFalse(self.controller.fastMode)
+        self.assertEqual(4, len(formatReport(report)))
+
+    def testStaleSamples(self):
+        """
+        Readings that arrive after maxAge are not acted on, and the
+        loop skips periods rather than catching up
+        """
+        self.transport.latency["read"] = 0.03
+        calls = []
+        loop = ControlLoop(self.controller, calls.append, rate=100.0, maxAge=0.02)
+        report = loop.run(duration=0.2)
+        self.assertEqual(0, len(calls))
+        self.assertEqual(report["iterations"], report["staleSamples"])
+        self.assertEqual(report["iterations"], report["deadlineMisses"])
+        self.assertGreater(report["skippedPeriods"], 0)
+        self.assertLess(report["iterations"], 10)
+
+    def testParserRover(self):
+        """
+        Without a rover rate, the rover command uses the Skoobot's rover mode
+        """
+        parser = CommandParser(self.controller)
+        parser.parseCommandList(["rover"])
+        self.assertEqual([CMD_ROVER_MODE], self.skoobot.commandLog)
+
+if __name__ == "__main__":
+    unittest.main()
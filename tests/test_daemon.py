@@ -0,0 +1,185 @@
+"""
+Test cases for the skoopy.daemon module, using the simulated transport
+"""
+
+import unittest
+import sys
+import os
+import threading
+import time
+
+# If this test is being executed standalone, add '..' to the path
+# to start searching for packages from the top level of the app.
+if __name__ == "__main__":
+    sys.path.insert(0, '..')
+
+from helpers import RegistryTestCase
+from skoopy.controller import CMD_LEFT, CMD_STOP
+from skoopy.daemon import SkoobotDaemon, sendToDaemon
+from skoopy.simulator import TransportSimulated, makeSkoobots
+
+class TestSkoobotDaemon(RegistryTestCase):
+    """
+    Test case for the SkoobotDaemon class
+    """
+
+    def setUp(self):
+        RegistryTestCase.setUp(self)
+        self.skoobots = makeSkoobots(2, seed=1)
+        self.registry.addSkoobot(self.skoobots[0].addr, "alice")
+        self.registry.addSkoobot(self.skoobots[1].addr, "bob")
+        self.transport = TransportSimulated(self.skoobots, latency={ "connect" : 0.3 }, seed=1)
+        self.daemon = SkoobotDaemon(self.registry, self.transport, idleTimeout=60.0)
+
+    def tearDown(self):
+        for addr in list(self.daemon.connections.keys()):
+            self.daemon.dropConnection(addr)
+        RegistryTestCase.tearDown(self)
+
+    def testWarmConnection(self):
+        """
+        The second request reuses the connection made by the first
+        """
+        response = self.daemon.handleRequest({ "name" : "alice", "commands" : ["stop"] })
+        self.assertTrue(response["ok"])
+        self.assertEqual(self.skoobots[0].addr, response["addr"])
+        connection = self.daemon.connections[self.skoobots[0].addr]
+
+        start = time.monotonic()
+        response = self.daemon.handleRequest({ "name" : "alice", "commands" : ["left"] })
+        self.assertLess(time.monotonic() - start, 0.1)
+        self.assertTrue(response["ok"])
+        self.assertIs(connection, self.daemon.connections[self.skoobots[0].addr])
+        self.assertEqual([CMD_STOP, CMD_LEFT], self.skoobots[0].commandLog)
+
+    def testInvalidCommand(self):
+        """
+        An invalid command list is rejected before anything is sent
+        """
+        response = self.daemon.handleRequest({ "name" : "alice", "commands" : ["left", "dance"] })
+        self.assertFalse(response["ok"])
+        self.assertIn("dance", response["error"])
+        self.assertEqual([], self.skoobots[0].commandLog)
+
+    def testUntimedCommands(self):
+        """
+        Commands that would never finish are refused
+        """
+        for commands in (["left", "stream", "distance"], ["rover"], ["loop", "left", "end"],
+                ["repeat", "2", "loop", "left", "end", "end"]):
+            response = self.daemon.handleRequest({ "name" : "alice", "commands" : commands })
+            self.assertFalse(response["ok"])
+            self.assertIn("CommandError", response["error"])
+        self.assertEqual([], self.skoobots[0].commandLog)
+        response = self.daemon.handleRequest({ "name" : "alice", "commands" : ["repeat", "2", "left", "end"] })
+        self.assertTrue(response["ok"])
+
+    def testSerialization(self):
+        """
+        Requests for the same Skoobot run one at a time, while a cold
+        connect to another Skoobot does not hold up a warm one
+        """
+        self.daemon.handleRequest({ "name" : "alice", "commands" : ["stop"] })
+
+        responses = []
+        def request(name, commands):
+            responses.append(self.daemon.handleRequest({ "name" : name, "commands" : commands }))
+
+        threads = [ threading.Thread(target=request, args=("alice", ["left", "wait", "0.1", "stop"]))
+            for i in range(2) ]
+        start = time.monotonic()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertGreaterEqual(time.monotonic() - start, 0.2)
+        self.assertEqual([CMD_STOP] + [CMD_LEFT, CMD_STOP] * 2, self.skoobots[0].commandLog)
+
+        coldThread = threading.Thread(target=request, args=("bob", ["stop"]))
+        coldThread.start()
+        time.sleep(0.05)
+        start = time.monotonic()
+        request("alice", ["stop"])
+        self.assertLess(time.monotonic() - start, 0.1)
+        coldThread.join()
+        self.assertTrue(all(response["ok"] for response in responses))
+        self.assertEqual([CMD_STOP], self.skoobots[1].commandLog)
+
+    def testReconnect(self):
+        """
+        A connection that has dropped is discarded and made again
+        """
+        self.daemon.handleRequest({ "name" : "alice", "commands" : ["stop"] })
+        self.skoobots[0].dropLinks()
+        response = self.daemon.handleRequest({ "name" : "alice", "commands" : ["left"] })
+        self.assertFalse(response["ok"])
+        self.assertEqual({}, self.daemon.connections)
+
+        response = self.daemon.handleRequest({ "name" : "alice", "commands" : ["left"] })
+        self.assertTrue(response["ok"])
+        self.assertEqual([CMD_STOP, CMD_LEFT], self.skoobots[0].commandLog)
+
+    def testIdleTimeout(self):
+        """
+        Idle connections are closed by the reaper
+        """
+        self.daemon.idleTimeout = 0.05
+        self.daemon.handleRequest({ "name" : "alice", "commands" : ["stop"] })
+        self.daemon.reapIdle()
+        self.assertEqual(1, len(self.daemon.connections))
+        time.sleep(0.1)
+        self.daemon.reapIdle()
+        self.assertEqual({}, self.daemon.connections)
+        self.assertEqual({}, self.daemon.targets)
+
+    def testSocket(self):
+        """
+        Requests are served over the Unix socket
+        """
+        socketPath = self.tempPath("skoodaemon.sock")
+        thread = threading.Thread(target=self.daemon.serve, args=(socketPath,), daemon=True)
+        thread.start()
+        while not os.path.exists(socketPath):
+            time.sleep(0.01)
+        try:
+            response = sendToDaemon(["get", "distance"], addr=self.skoobots[1].addr, socketPath=socketPath)
+        finally:
+            self.daemon.shutdown()
+            thread.join()
+        self.assertTrue(response["ok"])
+        self.assertTrue(response["output"].startswith("distance = "))
+
+    def testSocketInUse(self):
+        """
+        A second daemon refuses a socket that is being served, but
+        replaces one left behind
+        """
+        socketPath = self.tempPath("skoodaemon.sock")
+        thread = threading.Thread(target=self.daemon.serve, args=(socketPath,), daemon=True)
+        thread.start()
+        while not os.path.exists(socketPath):
+            time.sleep(0.01)
+        try:
+            with self.assertRaises(RuntimeError):
+                SkoobotDaemon(self.registry, self.transport).serve(socketPath)
+            response = sendToDaemon(["stop"], name="alice", socketPath=socketPath)
+        finally:
+            self.daemon.shutdown()
+            thread.join()
+        self.assertTrue(response["ok"])
+
+        with open(socketPath, "w"):
+            pass
+        thread = threading.Thread(target=self.daemon.serve, args=(socketPath,), daemon=True)
+        thread.start()
+        while self.daemon.server == None:
+            time.sleep(0.01)
+        try:
+            response = sendToDaemon(["left"], name="alice", socketPath=socketPath)
+        finally:
+            self.daemon.shutdown()
+            thread.join()
+        self.assertTrue(response["ok"])
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,97 @@
+"""
+Test cases for the skoopy.filters module
+"""
+
+import unittest
+import sys
+import os
+import tempfile
+
+# If this test is being executed standalone, add '..' to the path
+# to start searching for packages from the top level of the app.
+if __name__ == "__main__":
+    sys.path.insert(0, '..')
+
+from skoopy.stream import Sample
+from skoopy.telemetry import TelemetryLog
+
+try:
+    import numpy
+    from skoopy import filters
+except ImportError:
+    numpy = None
+
+@unittest.skipIf(numpy == None, "numpy is not installed")
+class TestFilters(unittest.TestCase):
+    """
+    Test case for the batch filters
+    """
+
+    def setUp(self):
+        # Robot 0 drives towards an obstacle, robot 1 is parked and
+        # robot 2 stops reporting half way
+        rng = numpy.random.default_rng(1)
+        self.timestamps = numpy.tile(numpy.arange(50) * 0.1, (3, 1))
+        self.truth = numpy.vstack([ 200.0 - 60.0 * self.timestamps[0],
+            numpy.full(50, 150.0), 100.0 + 10.0 * self.timestamps[2] ])
+        self.values = self.truth + rng.normal(0.0, 2.0, self.truth.shape)
+        self.values[0, 20] = 5.0
+        self.values[1, 10] = 255.0
+        self.values[2, 30:] = numpy.nan
+
+    def testSmoothing(self):
+        """
+        Filters follow the signal, ignore spikes and keep gaps
+        """
+        median = filters.medianFilter(self.values)
+        self.assertLess(numpy.nanmax(numpy.abs(median - self.truth)), 10.0)
+        self.assertTrue(numpy.isnan(median[2, 30:]).all())
+
+        cleaned, outliers = filters.rejectOutliers(self.values)
+        self.assertTrue(outliers[0, 20] and outliers[1, 10])
+        self.assertTrue(numpy.isnan(cleaned[1, 10]))
+
+        ema = filters.emaFilter(cleaned, alpha=0.5)
+        self.assertLess(abs(ema[1, -1] - 150.0), 5.0)
+        self.assertEqual(ema[2, 29], ema[2, -1])
+
+        estimates, variances = filters.kalmanFilter(cleaned)
+        self.assertLess(abs(estimates[1, -1] - 150.0), 5.0)
+        self.assertLess(variances[1, -1], variances[1, 0])
+        self.assertGreater(variances[2, -1], variances[2, 29])
+
+    def testApproach(self):
+        """
+        Only the robot closing on an obstacle is flagged, before it is near
+        """
+        rates = filters.rateOfChange(self.timestamps, filters.medianFilter(self.values))
+        self.assertLess(abs(numpy.nanmedian(rates[0]) + 60.0), 10.0)
+
+        flags, timeToContact = filters.detectApproach(self.timestamps, self.values, nearDistance=40.0, horizon=1.0)
+        self.assertEqual([True, False, False], list(flags.any(axis=1)))
+        firstFlag = numpy.argmax(flags[0])
+        self.assertLess(abs(firstFlag - 17), 3)
+
+    def testAdapters(self):
+        """
+        Batches are built from samples and telemetry logs
+        """
+        batch = filters.fromSamples({
+            "ee:00:00:00:00:01" : [ Sample(0.0, "distance", 5), Sample(1.0, "distance", 6) ],
+            "ee:00:00:00:00:02" : [ Sample(0.5, "distance", 7) ],
+        })
+        self.assertEqual((2, 2), batch.values.shape)
+        self.assertEqual([6.0, 7.0], list(filters.latest(batch)))
+
+        with tempfile.TemporaryDirectory(prefix="skoobot_test") as tempDir:
+            with TelemetryLog(os.path.join(tempDir, "telemetry.log"), capacity=16) as log:
+                for i in range(20):
+                    log.append("ee:00:00:00:00:0{0:d}".format(i % 2), "distance", i, float(i))
+                log.append("ee:00:00:00:00:00", "ambient", 999)
+                batch = filters.fromTelemetry(log, "distance")
+                self.assertEqual(["ee:00:00:00:00:00", "ee:00:00:00:00:01"], batch.robots)
+                self.assertEqual([18.0, 19.0], list(filters.latest(batch)))
+                self.assertEqual(5.0, batch.values[1, 0])
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,154 @@
+"""
+Test cases for the skoopy.fleet module, using the simulated transport
+"""
+
+import unittest
+import sys
+import threading
+import time
+
+# If this test is being executed standalone, add '..' to the path
+# to start searching for packages from the top level of the app.
+if __name__ == "__main__":
+    sys.path.insert(0, '..')
+
+from helpers import RegistryTestCase
+from skoopy.controller import CMD_STOP
+from skoopy.fleet import SkoobotFleet
+from skoopy.simulator import TransportSimulated, makeSkoobots
+
+class TestSkoobotFleet(RegistryTestCase):
+    """
+    Test case for the SkoobotFleet class
+    """
+
+    def setUp(self):
+        RegistryTestCase.setUp(self)
+        self.skoobots = makeSkoobots(8, seed=1)
+        self.addrs = [ skoobot.addr for skoobot in self.skoobots ]
+        self.transport = TransportSimulated(self.skoobots, latency={ "write" : 0.05, "read" : 0.05 }, seed=1)
+        self.fleet = SkoobotFleet(self.registry, self.transport)
+
+    def tearDown(self):
+        self.fleet.close()
+        RegistryTestCase.tearDown(self)
+
+    def testParallelSweep(self):
+        """
+        A sensor sweep over the fleet takes about as long as one robot
+        """
+        result = self.fleet.connect(self.addrs)
+        self.assertEqual({}, result.errors)
+        self.assertEqual(sorted(self.addrs), sorted(self.fleet.addresses()))
+
+        start = time.monotonic()
+        result = self.fleet.requestDistance()
+        elapsed = time.monotonic() - start
+        # Serially this would take 8 * 0.1s
+        self.assertLess(elapsed, 0.3)
+        self.assertEqual({}, result.errors)
+        for skoobot in self.skoobots:
+            self.assertEqual(int(skoobot.distance), result.values[skoobot.addr])
+
+    def testLargeFleet(self):
+        """
+        A sweep over more robots than connections made at once still
+        takes about as long as one robot
+        """
+        skoobots = makeSkoobots(20, seed=2)
+        transport = TransportSimulated(skoobots, latency={ "write" : 0.05, "read" : 0.05 }, seed=1)
+        with SkoobotFleet(self.registry, transport, maxWorkers=4) as fleet:
+            result = fleet.connect([ skoobot.addr for skoobot in skoobots ])
+            self.assertEqual({}, result.errors)
+            start = time.monotonic()
+            result = fleet.requestDistance()
+            elapsed = time.monotonic() - start
+        self.assertEqual({}, result.errors)
+        self.assertEqual(20, len(result.values))
+        # With 8 workers this would take 3 * 0.1s
+        self.assertLess(elapsed, 0.2)
+
+    def testHungRobot(self):
+        """
+        A robot that hangs is reported as busy on later calls, without
+        holding up the others
+        """
+        self.fleet.connect(self.addrs)
+        release = threading.Event()
+        def operation(controller):
+            if controller.connectedSkoobot == self.addrs[0]:
+                release.wait()
+            return controller.connectedSkoobot
+
+        try:
+            for i in range(10):
+                result = self.fleet.run(operation, timeout=0.1)
+                self.assertEqual([self.addrs[0]], list(result.errors.keys()))
+                self.assertIsInstance(result.errors[self.addrs[0]], TimeoutError)
+                self.assertEqual(7, len(result.values))
+        finally:
+            release.set()
+        time.sleep(0.05)
+        result = self.fleet.run(operation, timeout=0.1)
+        self.assertEqual({}, result.errors)
+        self.assertEqual(8, len(result.values))
+
+    def testFailureIsolation(self):
+        """
+        Failures and timeouts on one robot are reported without
+        affecting the others
+        """
+        self.skoobots[0].connectable = False
+        result = self.fleet.connect(self.addrs)
+        self.assertEqual([self.addrs[0]], list(result.errors.keys()))
+        self.assertEqual(7, len(self.fleet.addresses()))
+
+        self.skoobots[1].dropLinks()
+        result = self.fleet.broadcast("cmdStop")
+        self.assertEqual([self.addrs[1]], list(result.errors.keys()))
+        self.assertEqual(6, len(result.values))
+        for skoobot in self.skoobots[2:]:
+            self.assertEqual([CMD_STOP], skoobot.commandLog)
+
+        def slowOnThird(controller):
+            if controller.connectedSkoobot == self.addrs[2]:
+                time.sleep(0.5)
+            return controller.connectedSkoobot
+        result = self.fleet.run(slowOnThird, addrs=self.addrs[2:], timeout=0.2)
+        self.assertIsInstance(result.errors[self.addrs[2]], TimeoutError)
+        self.assertEqual(5, len(result.values))
+
+        result = self.fleet.run(slowOnThird, addrs=[self.addrs[0]])
+        self.assertIsInstance(result.errors[self.addrs[0]], KeyError)
+
+    def testPerRobotLocking(self):
+        """
+        Operations on the same robot never overlap
+        """
+        self.fleet.connect(self.addrs[:2])
+        lock = threading.Lock()
+        active = { addr : 0 for addr in self.addrs[:2] }
+        overlaps = []
+
+        def operation(controller):
+            addr = controller.connectedSkoobot
+            with lock:
+                active[addr] += 1
+                if active[addr] > 1:
+                    overlaps.append(addr)
+            time.sleep(0.02)
+            with lock:
+                active[addr] -= 1
+
+        threads = [ threading.Thread(target=self.fleet.run, args=(operation,)) for i in range(4) ]
+        start = time.monotonic()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual([], overlaps)
+        # Four operations on each robot run one after another
+        self.assertGreaterEqual(time.monotonic() - start, 0.08)
+
+if __name__ == "__main__":
+    unittest.main()
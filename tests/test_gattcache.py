@@ -0,0 +1,101 @@
+"""
+Test cases for the skoopy.gattcache module, using the simulated transport
+"""
+
+import unittest
+import sys
+import os
+
+# If this test is being executed standalone, add '..' to the path
+# to start searching for packages from the top level of the app.
+if __name__ == "__main__":
+    sys.path.insert(0, '..')
+
+from helpers import RegistryTestCase
+from skoopy.controller import SkoobotController, CMD_STOP, CMD_GET_DISTANCE
+from skoopy.gattcache import GattCache
+from skoopy.simulator import TransportSimulated, makeSkoobots
+
+class TestGattCache(RegistryTestCase):
+    """
+    Test case for the GattCache class and its use by the transport
+    """
+
+    def setUp(self):
+        RegistryTestCase.setUp(self)
+        self.cachePath = self.tempPath("gatt.json")
+        self.skoobot = makeSkoobots(1, seed=1)[0]
+        self.transport = TransportSimulated([self.skoobot], gattCache=GattCache(self.cachePath))
+        self.controller = SkoobotController(self.transport, self.registry)
+
+    def reconnect(self):
+        self.controller.disconnect()
+        self.controller.connect(addr=self.skoobot.addr)
+
+    def testReuse(self):
+        """
+        The layout is discovered once and reused, also from a new cache
+        object reading the same file
+        """
+        self.controller.connect(addr=self.skoobot.addr)
+        self.assertFalse(self.transport.layoutCached)
+        self.assertTrue(os.path.isfile(self.cachePath))
+        self.reconnect()
+        self.assertTrue(self.transport.layoutCached)
+
+        self.transport.gattCache = GattCache(self.cachePath)
+        self.reconnect()
+        self.assertTrue(self.transport.layoutCached)
+        self.controller.cmdStop()
+        self.assertEqual([CMD_STOP], self.skoobot.commandLog)
+
+    def testFingerprintMismatch(self):
+        """
+        A changed Database Hash causes rediscovery
+        """
+        self.skoobot.databaseHash = bytes(range(16))
+        self.controller.connect(addr=self.skoobot.addr)
+        self.reconnect()
+        self.assertTrue(self.transport.layoutCached)
+
+        self.skoobot.databaseHash = bytes(16)
+        self.skoobot.handleBase = 40
+        self.reconnect()
+        self.assertFalse(self.transport.layoutCached)
+        self.controller.cmdStop()
+        self.assertEqual([CMD_STOP], self.skoobot.commandLog)
+
+    def testLayoutChanged(self):
+        """
+        Without a Database Hash, a layout moved by a firmware update is
+        detected by its last characteristic declaration and rediscovered
+        """
+        self.controller.connect(addr=self.skoobot.addr)
+        self.skoobot.handleBase = 40
+        self.reconnect()
+        self.assertFalse(self.transport.layoutCached)
+        self.controller.cmdStop()
+        self.reconnect()
+        self.assertTrue(self.transport.layoutCached)
+        self.controller.cmdStop()
+        self.assertEqual([CMD_STOP, CMD_STOP], self.skoobot.commandLog)
+
+    def testFailedHandle(self):
+        """
+        A failed operation on a stale handle causes rediscovery and
+        the operation succeeds
+        """
+        self.controller.connect(addr=self.skoobot.addr)
+        self.reconnect()
+        self.assertTrue(self.transport.layoutCached)
+        self.skoobot.handleBase = 40
+
+        self.assertEqual(self.skoobot.distance, self.controller.requestDistance())
+        self.assertEqual([CMD_GET_DISTANCE], self.skoobot.commandLog)
+        self.assertFalse(self.transport.layoutCached)
+        self.reconnect()
+        self.assertTrue(self.transport.layoutCached)
+        self.controller.cmdStop()
+
+if __name__ == "__main__":
+    unittest.main()
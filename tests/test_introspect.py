@@ -0,0 +1,75 @@
+"""
+Test cases for the skoopy.introspect module, using the simulated transport
+"""
+
+import unittest
+import sys
+import json
+import time
+
+# If this test is being executed standalone, add '..' to the path
+# to start searching for packages from the top level of the app.
+if __name__ == "__main__":
+    sys.path.insert(0, '..')
+
+from skoopy import introspect
+from skoopy.simulator import TransportSimulated, makeSkoobots, SKOOBOT_SERVICE_UUID
+
+class TestIntrospect(unittest.TestCase):
+    """
+    Test case for inspectDevices and the renderers
+    """
+
+    def setUp(self):
+        self.skoobots = makeSkoobots(6, seed=1)
+        self.skoobots[1].connectable = False
+        self.transport = TransportSimulated(self.skoobots, latency={ "connect" : 0.1 })
+        self.rawDevices = self.transport.findRawDevices()
+
+    def testInspectDevices(self):
+        """
+        Devices are inspected concurrently and reported in order
+        """
+        start = time.monotonic()
+        records = introspect.inspectDevices(self.transport, self.rawDevices, maxWorkers=5)
+        self.assertLess(time.monotonic() - start, 0.3)
+
+        self.assertEqual([ skoobot.addr for skoobot in self.skoobots ], [ record.addr for record in records ])
+        self.assertEqual(None, records[1].services)
+        for record in records[:1] + records[2:]:
+            self.assertEqual(None, record.error)
+            self.assertEqual([SKOOBOT_SERVICE_UUID], [ service.uuid for service in record.services ])
+            self.assertEqual(5, len(record.services[0].characteristics))
+
+        text = introspect.formatText(records)
+        self.assertEqual(6, text.count("Address: "))
+        self.assertEqual(5, text.count("Services:"))
+        decoded = json.loads(introspect.formatJson(records))
+        self.assertEqual(records[0].services[0].characteristics[0].handle,
+            decoded[0]["services"][0]["characteristics"][0]["handle"])
+
+    def testTimeout(self):
+        """
+        Slow devices are reported as timed out
+        """
+        self.transport.latency["connect"] = 0.5
+        start = time.monotonic()
+        records = introspect.inspectDevices(self.transport, self.rawDevices[:2], timeout=0.1)
+        self.assertLess(time.monotonic() - start, 0.3)
+        self.assertTrue(records[0].error.startswith("Timed out"))
+        self.assertEqual(None, records[1].error)
+
+    def testAbandonedWorkers(self):
+        """
+        A timed out inspection keeps its slot until its thread finishes
+        """
+        self.transport.latency["connect"] = 0.3
+        start = time.monotonic()
+        records = introspect.inspectDevices(self.transport, self.rawDevices[2:5], maxWorkers=1, timeout=0.1)
+        # Each device waits for the one before it to give up its connection
+        self.assertGreaterEqual(time.monotonic() - start, 0.6)
+        for record in records:
+            self.assertTrue(record.error.startswith("Timed out"))
+
+if __name__ == "__main__":
+    unittest.main()
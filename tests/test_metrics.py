@@ -0,0 +1,109 @@
+"""
+Test cases for the skoopy.metrics module, using the simulated transport
+"""
+
+import unittest
+import sys
+import io
+import json
+
+# If this test is being executed standalone, add '..' to the path
+# to start searching for packages from the top level of the app.
+if __name__ == "__main__":
+    sys.path.insert(0, '..')
+
+from helpers import RegistryTestCase
+from skoopy import metrics
+from skoopy.controller import SkoobotController, CommandParser
+from skoopy.simulator import TransportSimulated, makeSkoobots
+
+class TestMetrics(RegistryTestCase):
+    """
+    Test case for the metrics registry, exporters and instrumentation
+    """
+
+    def setUp(self):
+        RegistryTestCase.setUp(self)
+        self.skoobot = makeSkoobots(1, seed=1)[0]
+        self.controller = SkoobotController(TransportSimulated([self.skoobot]), self.registry)
+        self.parser = CommandParser(self.controller)
+        self.parser.output = io.StringIO()
+        metrics.registry.reset()
+
+    def tearDown(self):
+        metrics.disable()
+        metrics.registry.reset()
+        RegistryTestCase.tearDown(self)
+
+    def testDisabled(self):
+        """
+        Nothing is recorded while instrumentation is disabled
+        """
+        metrics.disable()
+        self.controller.connect(addr=self.skoobot.addr)
+        self.parser.parseCommandList(["forward", "stop"])
+        self.assertEqual({ "counters" : {}, "histograms" : {} }, metrics.registry.snapshot())
+
+    def testInstrumentation(self):
+        """
+        Connection, discovery, commands and parser steps are timed
+        """
+        observations = []
+        hook = lambda kind, name, labels, value: observations.append(name)
+        metrics.enable()
+        metrics.addHook(hook)
+        try:
+            self.controller.connect(addr=self.skoobot.addr)
+            self.parser.parseCommandList(["forward", "stop", "read", "data"])
+        finally:
+            metrics.removeHook(hook)
+
+        histograms = metrics.registry.snapshot()["histograms"]
+        for name in ("skoopy_transport_connect_seconds", "skoopy_transport_discover_seconds",
+                "skoopy_transport_write_seconds", "skoopy_transport_read_seconds",
+                "skoopy_controller_send_command_seconds", "skoopy_controller_read_bytes_seconds",
+                "skoopy_parser_step_seconds"):
+            self.assertIn(name, histograms)
+            self.assertIn(name, observations)
+        steps = { entry["labels"]["command"] : entry["count"] for entry in histograms["skoopy_parser_step_seconds"] }
+        self.assertEqual({ "forward" : 1, "stop" : 1, "read" : 1 }, steps)
+
+        text = metrics.registry.formatPrometheus()
+        self.assertIn("# TYPE skoopy_parser_step_seconds histogram", text)
+        self.assertIn('skoopy_parser_step_seconds_bucket{command="stop",le="+Inf"} 1', text)
+        self.assertIn('skoopy_parser_step_seconds_count{command="stop"} 1', text)
+
+        jsonPath = self.tempPath("metrics.json")
+        metrics.registry.write(jsonPath)
+        with open(jsonPath) as jsonFile:
+            self.assertEqual(2, json.load(jsonFile)["histograms"]["skoopy_transport_write_seconds"][0]["count"])
+
+    def testRecoveryNotTimed(self):
+        """
+        Transport timings cover only the successful attempt, and
+        recoveries are counted separately
+        """
+        from skoopy.reconnect import ReconnectPolicy, MOTION_RETRY
+
+        self.controller.connect(addr=self.skoobot.addr)
+        self.controller.setAutoReconnect(True, ReconnectPolicy(initialDelay=0.1, jitter=0.0,
+            motionPolicy=MOTION_RETRY))
+        metrics.enable()
+        self.skoobot.dropLinks()
+        self.controller.cmdStop()
+        self.skoobot.dropLinks()
+        self.controller.readBytes("data")
+
+        snapshot = metrics.registry.snapshot()
+        recoveries = { entry["labels"]["operation"] : entry["value"]
+            for entry in snapshot["counters"]["skoopy_controller_recoveries_total"] }
+        self.assertEqual({ "write" : 1, "read" : 1 }, recoveries)
+        for name in ("skoopy_transport_write_seconds", "skoopy_transport_read_seconds"):
+            histogram = snapshot["histograms"][name][0]
+            self.assertEqual(1, histogram["count"])
+            self.assertLess(histogram["sum"], 0.1)
+        # The backoff is still part of the controller's own timing
+        self.assertGreaterEqual(snapshot["histograms"]["skoopy_controller_send_command_seconds"][0]["sum"], 0.1)
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,88 @@
+"""
+Test cases for the skoopy.presence module, using the simulated transport
+"""
+
+import unittest
+import sys
+import os
+import tempfile
+import time
+
+# If this test is being executed standalone, add '..' to the path
+# to start searching for packages from the top level of the app.
+if __name__ == "__main__":
+    sys.path.insert(0, '..')
+
+from skoopy.controller import SkoobotController
+from skoopy.presence import PresenceTracker
+from skoopy.registry import SkoobotRegistry
+from skoopy.simulator import TransportSimulated, makeSkoobots
+
+class TestPresenceTracker(unittest.TestCase):
+    """
+    Test case for the PresenceTracker class
+    """
+
+    def setUp(self):
+        self.skoobots = makeSkoobots(3, seed=1, advertiseInterval=0.02)
+        self.skoobots[1].rssi = -40
+        self.skoobots[2].advertiseInterval = None
+        self.transport = TransportSimulated(self.skoobots, seed=1)
+
+    def testPresence(self):
+        """
+        Only advertising Skoobots are present, strongest first,
+        and they expire after the TTL
+        """
+        tracker = PresenceTracker(self.transport.spawn(), ttl=0.2, scanWindow=0.05)
+        with tracker:
+            time.sleep(0.1)
+            entries = tracker.entries()
+            self.assertEqual([self.skoobots[1].addr, self.skoobots[0].addr],
+                [ entry.addr for entry in entries ])
+            self.assertTrue(tracker.isPresent(self.skoobots[0].addr))
+            self.assertFalse(tracker.isPresent(self.skoobots[2].addr))
+            self.assertEqual(None, tracker.get(self.skoobots[2].addr))
+
+            self.skoobots[0].advertiseInterval = None
+            time.sleep(0.3)
+            self.assertFalse(tracker.isPresent(self.skoobots[0].addr))
+            self.assertTrue(tracker.isPresent(self.skoobots[1].addr))
+        self.assertEqual(None, tracker.error)
+
+    def testConnectSkipsAbsent(self):
+        """
+        The controller does not try to connect to absent Skoobots
+        """
+        with tempfile.TemporaryDirectory(prefix="skoobot_test") as tempDir:
+            registry = SkoobotRegistry(os.path.join(tempDir, "skoobots.json"))
+            for skoobot in self.skoobots:
+                registry.addSkoobot(skoobot.addr, "TestSkoobot")
+            controller = SkoobotController(self.transport, registry)
+            with PresenceTracker(self.transport.spawn(), scanWindow=0.05) as tracker:
+                controller.presence = tracker
+                time.sleep(0.1)
+                self.assertEqual(None, controller.connect(addr=self.skoobots[2].addr))
+                self.assertEqual("absent", controller.connectAttempts[0].outcome)
+                self.assertIn(controller.connect("TestSkoobot"),
+                    (self.skoobots[0].addr, self.skoobots[1].addr))
+
+    def testFailedTracker(self):
+        """
+        The controller connects as usual if the tracker's scan has failed
+        """
+        scanTransport = self.transport.spawn()
+        scanTransport.failureRate["scan"] = 1.0
+        with tempfile.TemporaryDirectory(prefix="skoobot_test") as tempDir:
+            registry = SkoobotRegistry(os.path.join(tempDir, "skoobots.json"))
+            controller = SkoobotController(self.transport, registry)
+            with PresenceTracker(scanTransport, scanWindow=0.05) as tracker:
+                controller.presence = tracker
+                tracker.thread.join()
+                self.assertIsNotNone(tracker.error)
+                self.assertFalse(tracker.isScanning())
+                self.assertEqual(self.skoobots[2].addr, controller.connect(addr=self.skoobots[2].addr))
+                self.assertEqual("connected", controller.connectAttempts[0].outcome)
+
+if __name__ == "__main__":
+    unittest.main()
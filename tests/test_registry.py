@@ -315,11 +315,38 @@ class TestSkootbotRegistry(unittest.TestCase):
             self.assertEqual(altSkooName, name)
 
         with self.subTest("Names all used"):
+            # Once the names run out, a numeric suffix is added
             registry.skoobotNames = set([altSkooName])
             registry.addSkoobot(altSkooAddr)
+            name = registry.generateName()
+            self.assertEqual(altSkooName + "2", name)
+
+        with self.subTest("No names"):
+            registry.skoobotNames = set()
             with self.assertRaises(KeyError):
                 name = registry.generateName()
 
+    def testLargeRegistry(self):
+        """
+        Tests that unique names keep being generated beyond the
+        size of the name list, and that the name index stays correct
+        """
+        registry = SkoobotRegistry(self.tempPath)
+        addrs = [ "ff:ff:ff:ff:{0:02x}:{1:02x}".format(i // 256, i % 256) for i in range(200) ]
+        added = registry.addSkoobots(addrs)
+        self.assertEqual(200, len(added))
+        self.assertEqual(203, len(registry.registry))
+
+        names = [ name for addr, name in added ]
+        self.assertEqual(200, len(set(names)))
+        for addr, name in added:
+            self.assertEqual([(addr, name)], registry.getSkoobotsByName(name))
+
+        with self.subTest("Rename"):
+            registry.addSkoobots([(addrs[0], self.skooDupName)])
+            self.assertEqual([], registry.getSkoobotsByName(names[0]))
+            self.assertEqual(3, len(registry.getSkoobotsByName(self.skooDupName)))
+
     def testBug8(self):
         """
         Tests the resolution of bug #8
@@ -0,0 +1,53 @@
+"""
+Test cases for the skoopy.scanner module, using the simulated transport
+"""
+
+import unittest
+import sys
+import time
+
+# If this test is being executed standalone, add '..' to the path
+# to start searching for packages from the top level of the app.
+if __name__ == "__main__":
+    sys.path.insert(0, '..')
+
+from skoopy.scanner import discover, findSkoobots
+from skoopy.simulator import TransportSimulated, makeSkoobots
+
+class TestDiscover(unittest.TestCase):
+    """
+    Test case for the discover() generator
+    """
+
+    def setUp(self):
+        self.skoobots = makeSkoobots(5, seed=1)
+        for i, skoobot in enumerate(self.skoobots):
+            skoobot.advertiseDelay = 0.05 * i
+            skoobot.advertiseInterval = 0.02
+        self.transport = TransportSimulated(self.skoobots)
+
+    def testFullScan(self):
+        """
+        Each Skoobot is reported once, however often it advertises
+        """
+        skoobots = findSkoobots(self.transport, timeout=0.3)
+        self.assertEqual([skoobot.addr for skoobot in self.skoobots],
+            [skoobot.addr for skoobot in skoobots])
+
+    def testEarlyExit(self):
+        """
+        Scanning stops as soon as the count or target address is reached
+        """
+        with self.subTest("count"):
+            start = time.monotonic()
+            self.assertEqual(2, len(findSkoobots(self.transport, timeout=5.0, count=2)))
+            self.assertLess(time.monotonic() - start, 1.0)
+
+        with self.subTest("addr"):
+            start = time.monotonic()
+            addrs = [ device.addr for device in discover(self.transport, 5.0, addr=self.skoobots[1].addr) ]
+            self.assertEqual(self.skoobots[1].addr, addrs[-1])
+            self.assertLess(time.monotonic() - start, 1.0)
+
+if __name__ == "__main__":
+    unittest.main()
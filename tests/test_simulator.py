@@ -0,0 +1,95 @@
+"""
+Test cases for the skoopy.simulator module
+"""
+
+import unittest
+import sys
+import time
+
+# If this test is being executed standalone, add '..' to the path
+# to start searching for packages from the top level of the app.
+if __name__ == "__main__":
+    sys.path.insert(0, '..')
+
+from skoopy.simulator import TransportSimulated, SimulatedSkoobot, SimulatedLinkError
+from skoopy.simulator import makeSkoobots, SKOOBOT_CHARACTERISTICS
+from skoopy.simulator import CMD_FORWARD, CMD_STOP, CMD_GET_DISTANCE, CMD_GET_AMBIENT
+
+class TestTransportSimulated(unittest.TestCase):
+    """
+    Test case for the TransportSimulated class
+    """
+
+    def setUp(self):
+        self.skooAddr = "00:44:00:bb:55:ff"
+        self.skoobot = SimulatedSkoobot(self.skooAddr, distance=200, ambient=300, speed=1000.0)
+        self.transport = TransportSimulated([self.skoobot], seed=1)
+
+    def getCharacteristic(self, name):
+        uuid = SKOOBOT_CHARACTERISTICS[name][0]
+        return self.transport.getRawCharacteristicsByUUID(uuid)[0]
+
+    def testFindRawDevices(self):
+        """
+        Scanning returns one entry per simulated Skoobot with
+        the Skoobot complete local name
+        """
+        transport = TransportSimulated(makeSkoobots(5, seed=1))
+        devices = transport.findRawDevices()
+        self.assertEqual(5, len(devices))
+        for device in devices:
+            self.assertIn((9, "Complete Local Name", "Skoobot"), device.getScanData())
+
+    def testConnect(self):
+        """
+        Connecting to a known address succeeds and an unknown one fails
+        """
+        self.assertEqual([], self.transport.getRawCharacteristics())
+        self.transport.connect(self.skooAddr)
+        self.assertEqual(len(SKOOBOT_CHARACTERISTICS), len(self.transport.getRawCharacteristics()))
+        self.assertEqual(1, len(self.transport.getRawServices()))
+
+        with self.assertRaises(SimulatedLinkError):
+            self.transport.connect("nomatch")
+        self.assertEqual(None, self.transport.peripheral)
+
+    def testSensors(self):
+        """
+        Sensor request commands update the data characteristics and
+        motion commands change the simulated distance
+        """
+        self.transport.connect(self.skooAddr)
+        cmd = self.getCharacteristic("cmd")
+
+        cmd.write(CMD_GET_DISTANCE.to_bytes(1, "little"), True)
+        self.assertEqual(200, int.from_bytes(self.getCharacteristic("data").read(), "little"))
+
+        cmd.write(CMD_GET_AMBIENT.to_bytes(1, "little"), True)
+        self.assertEqual(300, int.from_bytes(self.getCharacteristic("byte2").read(), "little"))
+
+        cmd.write(CMD_FORWARD.to_bytes(1, "little"), True)
+        time.sleep(0.05)
+        cmd.write(CMD_STOP.to_bytes(1, "little"), True)
+        cmd.write(CMD_GET_DISTANCE.to_bytes(1, "little"), True)
+        self.assertLess(int.from_bytes(self.getCharacteristic("data").read(), "little"), 200)
+        self.assertEqual([CMD_GET_DISTANCE, CMD_GET_AMBIENT, CMD_FORWARD, CMD_STOP, CMD_GET_DISTANCE],
+            self.skoobot.commandLog)
+
+    def testLatencyAndFailures(self):
+        """
+        Configured latency delays operations and failure injection
+        raises SimulatedLinkError
+        """
+        transport = TransportSimulated([self.skoobot], latency={"connect" : 0.02})
+        start = time.monotonic()
+        transport.connect(self.skooAddr)
+        self.assertGreaterEqual(time.monotonic() - start, 0.02)
+
+        transport = TransportSimulated([self.skoobot], failureRate={"read" : 1.0})
+        transport.connect(self.skooAddr)
+        data = transport.getRawCharacteristicsByUUID(SKOOBOT_CHARACTERISTICS["data"][0])[0]
+        with self.assertRaises(SimulatedLinkError):
+            data.read()
+
+if __name__ == "__main__":
+    unittest.main()
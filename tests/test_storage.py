@@ -0,0 +1,112 @@
+"""
+Test cases for the skoopy.storage module
+"""
+
+import unittest
+import sys
+import os
+import tempfile
+import json
+
+# If this test is being executed standalone, add '..' to the path
+# to start searching for packages from the top level of the app.
+if __name__ == "__main__":
+    sys.path.insert(0, '..')
+
+from skoopy.registry import SkoobotRegistry
+from skoopy.storage import JsonRegistryStorage, SqliteRegistryStorage, migrateJsonToSqlite
+
+class TestRegistryStorage(unittest.TestCase):
+    """
+    Test case for the registry storage backends
+    """
+
+    def setUp(self):
+        self.tempDir = tempfile.TemporaryDirectory(prefix="skoobot_test")
+        self.jsonPath = os.path.join(self.tempDir.name, "skoobots.json")
+        self.sqlitePath = os.path.join(self.tempDir.name, "skoobots.db")
+        self.skooName = "TestSkoobot"
+        self.skooAddr = "00:44:00:bb:55:ff"
+        self.registryDict = {
+            "default" : self.skooName,
+            "skoobots" : {
+                self.skooAddr : self.skooName,
+                "00:00:00:00:00:01" : "DuplicateSkoobot",
+                "00:00:00:00:00:02" : "DuplicateSkoobot",
+            }
+        }
+        with open(self.jsonPath, "w") as registryFile:
+            json.dump(self.registryDict, registryFile, indent=4)
+
+    def tearDown(self):
+        self.tempDir.cleanup()
+
+    def testJsonAtomicSave(self):
+        """
+        Saving replaces the JSON file without leaving temporary files
+        """
+        registry = SkoobotRegistry(self.jsonPath)
+        self.assertIsInstance(registry.storage, JsonRegistryStorage)
+        registry.addSkoobot("aa:aa:aa:aa:aa:aa", "Alt")
+        registry.save()
+        self.assertEqual(["skoobots.json"], os.listdir(self.tempDir.name))
+        self.assertEqual(4, len(SkoobotRegistry(self.jsonPath).registry))
+
+    def testSqliteRegistry(self):
+        """
+        A registry with a .db path uses SQLite and round trips
+        """
+        registry = SkoobotRegistry(self.sqlitePath)
+        self.assertIsInstance(registry.storage, SqliteRegistryStorage)
+        self.assertEqual(0, len(registry.registry))
+        registry.addSkoobot(self.skooAddr, self.skooName)
+        registry.setDefault(self.skooName)
+        registry.save()
+
+        reloaded = SkoobotRegistry(self.sqlitePath)
+        self.assertEqual({ self.skooAddr : self.skooName }, reloaded.registry)
+        self.assertEqual(self.skooName, reloaded.getDefaultName())
+
+    def testSqliteIncrementalSave(self):
+        """
+        Two registries saving different Skoobots do not overwrite
+        each other's entries
+        """
+        first = SkoobotRegistry(self.sqlitePath)
+        second = SkoobotRegistry(self.sqlitePath)
+        first.addSkoobot("aa:aa:aa:aa:aa:01", "first")
+        second.addSkoobot("aa:aa:aa:aa:aa:02", "second")
+        first.save()
+        second.save()
+
+        reloaded = SkoobotRegistry(self.sqlitePath)
+        self.assertEqual(2, len(reloaded.registry))
+
+    def testSqliteDefaultSave(self):
+        """
+        Saving new Skoobots does not overwrite a default set and saved
+        by another registry
+        """
+        first = SkoobotRegistry(self.sqlitePath)
+        second = SkoobotRegistry(self.sqlitePath)
+        first.addSkoobot(self.skooAddr, self.skooName)
+        first.setDefault(self.skooName)
+        first.save()
+        second.addSkoobot("aa:aa:aa:aa:aa:02", "second")
+        second.save()
+
+        reloaded = SkoobotRegistry(self.sqlitePath)
+        self.assertEqual(self.skooName, reloaded.getDefaultName())
+        self.assertEqual(2, len(reloaded.registry))
+
+    def testMigration(self):
+        """
+        Migrating copies every entry and the default
+        """
+        self.assertEqual(3, migrateJsonToSqlite(self.jsonPath, self.sqlitePath))
+        registry = SkoobotRegistry(self.sqlitePath)
+        self.assertEqual(self.registryDict["skoobots"], registry.registry)
+        self.assertEqual(self.skooName, registry.getDefaultName())
+
+if __name__ == "__main__":
+    unittest.main()
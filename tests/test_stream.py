@@ -0,0 +1,123 @@
+"""
+Test cases for the skoopy.stream module, using the simulated transport
+"""
+
+import unittest
+import sys
+import asyncio
+import time
+
+# If this test is being executed standalone, add '..' to the path
+# to start searching for packages from the top level of the app.
+if __name__ == "__main__":
+    sys.path.insert(0, '..')
+
+from helpers import RegistryTestCase
+from skoopy.controller import SkoobotController, CMD_LEFT, CMD_GET_DISTANCE
+from skoopy.simulator import TransportSimulated, makeSkoobots
+from skoopy.stream import SensorStream
+
+class TestSensorStream(RegistryTestCase):
+    """
+    Test case for the SensorStream class
+    """
+
+    def setUp(self):
+        RegistryTestCase.setUp(self)
+        self.skoobots = makeSkoobots(1, seed=1)
+        self.skoobots[0].distance = 77.0
+        self.transport = TransportSimulated(self.skoobots, latency={ "write" : 0.002, "read" : 0.002 }, seed=1)
+        self.controller = SkoobotController(self.transport, self.registry)
+        self.controller.connect(addr=self.skoobots[0].addr)
+
+    def tearDown(self):
+        self.controller.disconnect()
+        RegistryTestCase.tearDown(self)
+
+    def testPoll(self):
+        """
+        Polled samples hold the value measured for their own request
+        """
+        self.controller.setFastMode(True)
+        with SensorStream(self.controller, "distance", rate=None, notify=False) as stream:
+            samples = [ stream.get(1.0) for i in range(5) ]
+        self.assertFalse(stream.notify)
+        for sample in samples:
+            self.assertEqual("distance", sample.channel)
+            self.assertEqual(77, sample.value)
+        # Each read acknowledges the request before it, and the last
+        # request is synced when the stream closes
+        self.assertEqual(0, self.controller.unacknowledged)
+
+    def testPipelined(self):
+        """
+        Each polled sample costs one read, with the next request sent
+        without response straight after it
+        """
+        self.transport.latency.update({ "write" : 0.02, "writeNoResponse" : 0.0, "read" : 0.02 })
+        with SensorStream(self.controller, "distance", rate=None, notify=False) as stream:
+            stream.get(1.0)
+            start = time.monotonic()
+            for i in range(5):
+                stream.get(1.0)
+            elapsed = time.monotonic() - start
+        # An acknowledged request and a read would take 0.2s
+        self.assertLess(elapsed, 0.16)
+
+    def testNotify(self):
+        """
+        Samples are delivered by notifications where supported
+        """
+        with SensorStream(self.controller, "distance", rate=50.0) as stream:
+            samples = [ stream.get(1.0) for i in range(3) ]
+        self.assertTrue(stream.notify)
+        self.assertEqual([77, 77, 77], [ sample.value for sample in samples ])
+        self.assertEqual(None, stream.error)
+
+    def testConcurrentCommands(self):
+        """
+        The caller can send commands while the stream is sampling
+        """
+        for notify in (False, True):
+            self.skoobots[0].commandLog = []
+            self.controller.setFastMode(True)
+            with SensorStream(self.controller, "distance", rate=None, notify=notify) as stream:
+                for i in range(20):
+                    self.controller.cmdLeft()
+                    self.assertIsNotNone(stream.get(1.0))
+            self.assertEqual(None, stream.error)
+            self.controller.sync()
+            commandLog = self.skoobots[0].commandLog
+            self.assertEqual(20, commandLog.count(CMD_LEFT))
+            self.assertEqual(len(commandLog), commandLog.count(CMD_LEFT) + commandLog.count(CMD_GET_DISTANCE))
+
+    def testDropped(self):
+        """
+        The oldest samples are dropped when the consumer falls behind
+        """
+        stream = SensorStream(self.controller, "distance", rate=None, bufferSize=4, notify=False)
+        with stream:
+            while stream.dropped == 0:
+                time.sleep(0.01)
+        self.assertEqual(4, len(stream.buffer))
+        self.assertGreater(stream.dropped, 0)
+
+    def testAsync(self):
+        """
+        Samples can be received with "async for"
+        """
+        async def collect():
+            samples = []
+            stream = SensorStream(self.controller, "distance", rate=100.0, notify=False)
+            async for sample in stream:
+                samples.append(sample)
+                if len(samples) == 3:
+                    stream.close()
+            return samples
+
+        samples = asyncio.run(collect())
+        self.assertGreaterEqual(len(samples), 3)
+        self.assertEqual(77, samples[0].value)
+
+if __name__ == "__main__":
+    unittest.main()
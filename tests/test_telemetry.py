@@ -0,0 +1,129 @@
+"""
+Test cases for the skoopy.telemetry module
+"""
+
+import unittest
+import unittest.mock
+import sys
+import io
+import os
+import time
+
+# If this test is being executed standalone, add '..' to the path
+# to start searching for packages from the top level of the app.
+if __name__ == "__main__":
+    sys.path.insert(0, '..')
+
+from helpers import RegistryTestCase
+from skoopy.controller import SkoobotController, CommandParser
+from skoopy.simulator import TransportSimulated, makeSkoobots
+from skoopy.stream import Sample
+from skoopy.telemetry import TelemetryLog, TelemetryRecord, CHANNEL_IDS, GROW_RECORDS
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+class TestTelemetryLog(RegistryTestCase):
+    """
+    Test case for the TelemetryLog class
+    """
+
+    def setUp(self):
+        RegistryTestCase.setUp(self)
+        self.path = self.tempPath("telemetry.log")
+
+    def testAppend(self):
+        """
+        Records persist, and the file grows as needed
+        """
+        with TelemetryLog(self.path) as log:
+            log.append("ee:00:00:00:00:01", "distance", 40, 1.0)
+            log.append("ee:00:00:00:00:02", "ambient", 600, 2.0)
+            for i in range(GROW_RECORDS):
+                log.append(0, "distance", i, 3.0 + i)
+
+        log = TelemetryLog(self.path)
+        self.assertEqual(GROW_RECORDS + 2, len(log))
+        self.assertEqual(["ee:00:00:00:00:01", "ee:00:00:00:00:02"], log.robots())
+        records = log.records()
+        self.assertEqual(TelemetryRecord(1.0, 0, CHANNEL_IDS["distance"], 40), records[0])
+        self.assertEqual(TelemetryRecord(2.0, 1, CHANNEL_IDS["ambient"], 600), records[1])
+        self.assertEqual(GROW_RECORDS - 1, records[-1].value)
+        log.close()
+
+    def testRing(self):
+        """
+        A ring keeps the newest capacity records
+        """
+        with TelemetryLog(self.path, capacity=4) as log:
+            for i in range(10):
+                log.append("ee:00:00:00:00:01", "distance", i, float(i))
+            self.assertEqual(4, len(log))
+            self.assertEqual([6, 7, 8, 9], [ record.value for record in log.records() ])
+            self.assertEqual([8, 9], [ record.value for record in log.records(2) ])
+            size = os.path.getsize(self.path)
+            log.append("ee:00:00:00:00:01", "distance", 10)
+            self.assertEqual(size, os.path.getsize(self.path))
+
+    @unittest.skipIf(numpy == None, "numpy is not installed")
+    def testViews(self):
+        """
+        NumPy views show overwritten ring slots in place, but not
+        records appended beyond their length
+        """
+        with TelemetryLog(self.path, capacity=8) as log:
+            for i in range(6):
+                log.append("ee:00:00:00:00:01", "distance", i)
+            view = log.view()
+            log.append("ee:00:00:00:00:01", "distance", 100)
+            self.assertEqual(0, view["value"][0])
+            log.append("ee:00:00:00:00:01", "distance", 200)
+            log.append("ee:00:00:00:00:01", "distance", 300)
+            self.assertEqual(300, view["value"][0])
+            self.assertEqual(6, len(view))
+            timestamps, values = log.channel("ee:00:00:00:00:01", "distance")
+            self.assertEqual([2, 3, 4, 5, 100, 200, 300], list(values[1:]))
+
+    def testNumpyMissing(self):
+        """
+        Views without NumPy fail with an error saying how to install it
+        """
+        with TelemetryLog(self.path) as log:
+            log.append("ee:00:00:00:00:01", "distance", 40)
+            with unittest.mock.patch.dict(sys.modules, { "numpy" : None }):
+                with self.assertRaisesRegex(ImportError, r"skoopy\[numpy\]"):
+                    log.view()
+
+    def testParser(self):
+        """
+        Readings from the get command are logged
+        """
+        skoobot = makeSkoobots(1, seed=1)[0]
+        controller = SkoobotController(TransportSimulated([skoobot]), self.registry)
+        controller.connect(addr=skoobot.addr)
+        parser = CommandParser(controller)
+        parser.output = io.StringIO()
+        with TelemetryLog(self.path) as parser.telemetry:
+            parser.parseCommandList(["get", "distance", "get", "ambient"])
+            records = parser.telemetry.records()
+        self.assertEqual([CHANNEL_IDS["distance"], CHANNEL_IDS["ambient"]], [ record.channel for record in records ])
+        self.assertEqual(int(skoobot.distance), records[0].value)
+
+    def testWallClock(self):
+        """
+        Timestamps are wall-clock time, also for stream Samples
+        """
+        with TelemetryLog(self.path) as log:
+            before = time.time()
+            log.append("ee:00:00:00:00:01", "distance", 40)
+            log.appendSample("ee:00:00:00:00:01", Sample(time.monotonic(), "distance", 41))
+            after = time.time()
+            for record in log.records():
+                self.assertGreaterEqual(record.timestamp, before - 0.01)
+                self.assertLessEqual(record.timestamp, after + 0.01)
+        self.assertTrue(log.map.closed)
+
+if __name__ == "__main__":
+    unittest.main()
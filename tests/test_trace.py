@@ -0,0 +1,122 @@
+"""
+Test cases for the skoopy.trace module, using the simulated transport
+"""
+
+import unittest
+import sys
+import io
+import time
+
+# If this test is being executed standalone, add '..' to the path
+# to start searching for packages from the top level of the app.
+if __name__ == "__main__":
+    sys.path.insert(0, '..')
+
+from helpers import RegistryTestCase
+from skoopy.controller import SkoobotController, CommandParser, CMD_GET_DISTANCE
+from skoopy.simulator import TransportSimulated, makeSkoobots
+from skoopy.trace import RecordingTransport, ReplayTransport, TraceMismatchError, ReplayLinkError
+from skoopy.trace import readTrace, summariseTrace, KIND_CONNECT
+
+class InWriteTransport(TransportSimulated):
+    """
+    Simulated transport that delivers a notification during the write
+    that caused it, as bluepy can
+    """
+
+    def notify(self, charName):
+        TransportSimulated.notify(self, charName)
+        while self.waitForNotifications(0.0):
+            pass
+
+class TestTrace(RegistryTestCase):
+    """
+    Test case for recording and replaying traces
+    """
+
+    def setUp(self):
+        RegistryTestCase.setUp(self)
+        self.tracePath = self.tempPath("session.trace")
+        self.skoobots = makeSkoobots(2, seed=1)
+        self.skoobots[0].connectable = False
+        self.words = ["forward", "get", "distance", "left", "get", "ambient", "stop"]
+
+    def runSession(self, transport):
+        controller = SkoobotController(transport, self.registry)
+        parser = CommandParser(controller)
+        parser.output = io.StringIO()
+        self.assertEqual(None, controller.connect(addr=self.skoobots[0].addr))
+        controller.connect(addr=self.skoobots[1].addr)
+        parser.parseCommandList(self.words)
+        controller.disconnect()
+        return parser.output.getvalue()
+
+    def record(self):
+        transport = TransportSimulated(self.skoobots, latency={ "write" : 0.01, "read" : 0.01 })
+        recorder = RecordingTransport(transport, self.tracePath)
+        output = self.runSession(recorder)
+        recorder.close()
+        return output
+
+    def testReplay(self):
+        """
+        A replayed session gives the same results, with the original
+        timing or faster
+        """
+        output = self.record()
+        records = list(readTrace(self.tracePath))
+        connects = [ record for record in records if record.kind == KIND_CONNECT ]
+        self.assertEqual([1, 0], [ record.outcome for record in connects ])
+        summary = summariseTrace(self.tracePath)
+        self.assertEqual(5, summary["write"]["count"])
+        self.assertEqual(2, summary["read"]["count"])
+        self.assertEqual(1, summary["connect"]["errors"])
+
+        for realtime in (True, False):
+            with self.subTest(realtime=realtime):
+                start = time.monotonic()
+                self.assertEqual(output, self.runSession(ReplayTransport(self.tracePath, realtime)))
+                elapsed = time.monotonic() - start
+                if realtime:
+                    self.assertGreater(elapsed, 0.06)
+                else:
+                    self.assertLess(elapsed, 0.05)
+
+    def testInWriteNotifications(self):
+        """
+        Notifications recorded during a write are replayed
+        """
+        def session(transport):
+            controller = SkoobotController(transport, self.registry)
+            controller.connect(addr=self.skoobots[1].addr)
+            values = []
+            charac = controller.getCharacteristic("data")
+            transport.enableNotifications(charac, lambda handle, data: values.append(data[0]))
+            for i in range(3):
+                controller.sendCommand(CMD_GET_DISTANCE, True)
+            transport.waitForNotifications(0.0)
+            transport.disableNotifications(charac)
+            controller.disconnect()
+            return values
+
+        recorder = RecordingTransport(InWriteTransport(self.skoobots), self.tracePath)
+        values = session(recorder)
+        recorder.close()
+        self.assertEqual([int(self.skoobots[1].distance)] * 3, values)
+        self.assertEqual(values, session(ReplayTransport(self.tracePath, realtime=False)))
+
+    def testMismatch(self):
+        """
+        Operations that differ from the trace are reported
+        """
+        self.record()
+        controller = SkoobotController(ReplayTransport(self.tracePath, realtime=False), self.registry)
+        with self.assertRaises(TraceMismatchError):
+            controller.connect(addr=self.skoobots[1].addr)
+
+        transport = ReplayTransport(self.tracePath, realtime=False)
+        with self.assertRaises(ReplayLinkError):
+            transport.connect(self.skoobots[0].addr)
+
+if __name__ == "__main__":
+    unittest.main()